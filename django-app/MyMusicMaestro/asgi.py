@@ -0,0 +1,8 @@
+# ASGI entry point, e.g. uvicorn MyMusicMaestro.asgi:application
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'MyMusicMaestro.settings')
+
+application = get_asgi_application()
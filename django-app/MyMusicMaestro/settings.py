@@ -1,4 +1,6 @@
 # You should not edit this file
+import os
+import sys
 from django.contrib import messages
 from pathlib import Path
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -31,6 +33,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'label_music_manager.profiling.RequestProfilingMiddleware',
+    'label_music_manager.assets.PrecompressedStaticMiddleware',
+    'label_music_manager.compression.CompressionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.middleware.security.SecurityMiddleware',
@@ -54,20 +59,102 @@ TEMPLATES = [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
-                'django.contrib.messages.context_processors.messages'
+                'django.contrib.messages.context_processors.messages',
+                'label_music_manager.profiles.music_manager'
             ]
         }
     }
 ]
 
 WSGI_APPLICATION = 'MyMusicMaestro.wsgi.application'
+ASGI_APPLICATION = 'MyMusicMaestro.asgi.application'
 
-# Database for development
+# Database. SQLite runs in WAL mode so readers never block the writer, and
+# writes take the write lock when their transaction begins (IMMEDIATE), so
+# concurrent workers wait up to SQLITE_TIMEOUT seconds for it instead of
+# failing with "database is locked". The pragmas run on every new connection,
+# and connections are kept open for DATABASE_CONN_MAX_AGE seconds.
+SQLITE_PATH = os.environ.get('SQLITE_PATH', str(BASE_DIR / 'db.sqlite3'))
+SQLITE_TIMEOUT = int(os.environ.get('SQLITE_TIMEOUT', 20))
+SQLITE_PRAGMAS = {
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'wal'),
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'normal'),
+    # Negative sizes are in KiB: a 64 MiB page cache per connection
+    'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', -64 * 1024)),
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    'temp_store': 'memory',
+}
+SQLITE_OPTIONS = {
+    'timeout': SQLITE_TIMEOUT,
+    'transaction_mode': 'IMMEDIATE',
+    'init_command': ';'.join(f'PRAGMA {name} = {value}' for name, value in SQLITE_PRAGMAS.items()),
+}
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3'
+        'NAME': SQLITE_PATH,
+        'OPTIONS': SQLITE_OPTIONS,
+        'CONN_MAX_AGE': int(os.environ.get('DATABASE_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+    }
+}
+# The tests use an in-memory database. Set DJANGO_CONCURRENCY_TESTS=1 to run
+# them on a database file instead, as SQLiteConcurrencyTest needs to share it
+# between threads with the locking of a real deployment.
+CONCURRENCY_TESTS = os.environ.get('DJANGO_CONCURRENCY_TESTS') == '1'
+if CONCURRENCY_TESTS:
+    DATABASES['default']['TEST'] = {'NAME': str(BASE_DIR / 'test_db.sqlite3')}
+
+# Set SQLITE_READ_REPLICA to read outside of transactions through a second,
+# read-only connection to the same file (or to a replicated copy of it)
+SQLITE_READ_REPLICA = os.environ.get('SQLITE_READ_REPLICA')
+if SQLITE_READ_REPLICA:
+    replica_path = SQLITE_PATH if SQLITE_READ_REPLICA == 'self' else SQLITE_READ_REPLICA
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': f'file:{replica_path}?mode=ro',
+        'OPTIONS': {
+            **SQLITE_OPTIONS,
+            'uri': True,
+            'transaction_mode': 'DEFERRED',
+            # The journal mode is the writer's to set
+            'init_command': ';'.join(
+                f'PRAGMA {name} = {value}' for name, value in SQLITE_PRAGMAS.items() if name != 'journal_mode'
+            ),
+        },
+        'TEST': {'MIRROR': 'default'},
     }
+    DATABASE_ROUTERS = ['label_music_manager.routers.ReadReplicaRouter']
+
+# Caches. The catalogue cache holds serialized albums and rendered album
+# fragments, invalidated by model signals. Every process writing albums,
+# including manage.py run_workers, must share it, or the others keep serving
+# entries it changed. It is kept in files by default; set CATALOGUE_CACHE to
+# 'redis' (with CATALOGUE_CACHE_LOCATION as a redis:// URL) for a cache
+# server, or to 'locmem' for an in-process LRU when a single process serves
+# the site and runs its tasks (TASK_QUEUE_EAGER=1). manage.py test keeps its
+# files apart, so it neither reads nor clears those of a running server.
+CATALOGUE_CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+}
+CATALOGUE_CACHE = os.environ.get('CATALOGUE_CACHE', 'file')
+CATALOGUE_CACHE_LOCATIONS = {
+    'locmem': 'catalogue',
+    'file': str(BASE_DIR / 'cache' / ('test-catalogue' if sys.argv[1:2] == ['test'] else 'catalogue')),
+    'redis': 'redis://127.0.0.1:6379/1',
+}
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalogue': {
+        'BACKEND': CATALOGUE_CACHE_BACKENDS[CATALOGUE_CACHE],
+        'LOCATION': os.environ.get('CATALOGUE_CACHE_LOCATION', CATALOGUE_CACHE_LOCATIONS[CATALOGUE_CACHE]),
+        'TIMEOUT': 24 * 60 * 60,
+        'OPTIONS': {'MAX_ENTRIES': 10000} if CATALOGUE_CACHE != 'redis' else {},
+    },
 }
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -91,6 +178,64 @@ STATIC_URL = 'static/'
 MEDIA_ROOT = BASE_DIR / 'media/'
 MEDIA_URL = 'media/'
 
+# Outside DEBUG, collectstatic writes content-hashed copies of static files
+# and precompresses them
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage' if DEBUG
+        else 'label_music_manager.assets.CompressedManifestStaticFilesStorage',
+    },
+}
+
+# The React production build (npm run build), served under SPA_URL. Its
+# assets are requested from /static/, next to Django's own.
+SPA_BUILD_DIR = BASE_DIR.parent / 'react-app' / 'build'
+SPA_URL = '/app/'
+
+# Directories served by PrecompressedStaticMiddleware, by URL prefix. Run
+# manage.py compress_assets after a build to write their .br and .gz copies.
+# Files with a content hash in their name are cached for STATIC_FILE_MAX_AGE.
+STATIC_FILE_ROOTS = {
+    '/' + STATIC_URL: [STATIC_ROOT, SPA_BUILD_DIR / 'static'],
+    '/' + MEDIA_URL: [MEDIA_ROOT],
+    SPA_URL: [SPA_BUILD_DIR],
+}
+STATIC_FILE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Responses and asset files smaller than this are not compressed. Brotli is
+# used where the brotli package is installed and the client accepts it.
+COMPRESSION_MIN_SIZE = 1024
+
+# Widths of the resized cover variants, made by the task queue after upload
+COVER_VARIANT_WIDTHS = [150, 300, 600]
+
+# Background tasks are stored in the database and run by manage.py
+# run_workers. Deletes and tracklist writes of more than
+# TASK_QUEUE_INLINE_LIMIT tracks are queued rather than run in the request.
+# Failed tasks are retried after TASK_QUEUE_RETRY_DELAY seconds, doubling up
+# to TASK_QUEUE_MAX_RETRY_DELAY. Workers renew the lease of their running
+# tasks every third of TASK_QUEUE_LEASE seconds, and tasks whose worker died
+# are claimed again once it expires. Finished tasks, and with them their
+# idempotency keys, are purged after TASK_QUEUE_RETENTION days. Set
+# TASK_QUEUE_EAGER=1 to run tasks in the process queueing them once its
+# transaction commits, e.g. in development without a worker.
+TASK_QUEUE_EAGER = os.environ.get('TASK_QUEUE_EAGER') == '1'
+TASK_QUEUE_INLINE_LIMIT = 200
+TASK_QUEUE_RETRY_DELAY = 10
+TASK_QUEUE_MAX_RETRY_DELAY = 60 * 60
+TASK_QUEUE_LEASE = 30 * 60
+TASK_QUEUE_POLL_INTERVAL = 1
+TASK_QUEUE_RETENTION = 7
+
+# Catalogue files uploaded to /api/import/ wait here for their import
+# task. It must not be served under any URL, unlike MEDIA_ROOT.
+IMPORT_UPLOAD_ROOT = BASE_DIR / 'imports'
+
+# Days of entries kept in the change log behind /api/changes/ by
+# manage.py compact_changes. Clients further behind download the catalogue again.
+CHANGE_LOG_RETENTION = 30
+
 # Set up for simple Bootstrap theming
 CRISPY_ALLOWED_TEMPLATE_PACKS = 'bootstrap5'
 CRISPY_TEMPLATE_PACK = 'bootstrap5'
@@ -102,6 +247,44 @@ MESSAGE_TAGS = {
     messages.ERROR: 'alert-danger'
 }
 
+# Seconds to cache each user's profile and role across requests (None disables)
+MUSIC_MANAGER_CACHE_TIMEOUT = None
+
+# Opt-in request profiling. Every response gets a Server-Timing header.
+# A REQUEST_PROFILING_SAMPLE_RATE share of requests, and every request slower
+# than REQUEST_PROFILING_SLOW_MS or running one query at least
+# REQUEST_PROFILING_DUPLICATE_QUERIES times, are logged as JSON lines to
+# REQUEST_PROFILING_LOG. Summarize the log with manage.py summarize_request_log,
+# whose percentiles come from the sampled lines.
+REQUEST_PROFILING = os.environ.get('REQUEST_PROFILING') == '1'
+REQUEST_PROFILING_SAMPLE_RATE = float(os.environ.get('REQUEST_PROFILING_SAMPLE_RATE', 1))
+REQUEST_PROFILING_SLOW_MS = float(os.environ.get('REQUEST_PROFILING_SLOW_MS', 500))
+REQUEST_PROFILING_DUPLICATE_QUERIES = 5
+REQUEST_PROFILING_LOG = os.environ.get('REQUEST_PROFILING_LOG', str(BASE_DIR / 'request_profile.log'))
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'message': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'request_profile': {
+            'class': 'logging.FileHandler',
+            'filename': REQUEST_PROFILING_LOG,
+            'formatter': 'message',
+            # The file is only created once a request is logged
+            'delay': True,
+        },
+    },
+    'loggers': {
+        'label_music_manager.profiling': {
+            'handlers': ['request_profile'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
 # Account redirects
 LOGOUT_REDIRECT_URL = '/'
 LOGIN_REDIRECT_URL = '/'
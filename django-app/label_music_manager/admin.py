@@ -1,7 +1,8 @@
 from django.contrib import admin
-from .models import Album, Song, AlbumTracklistItem, MusicManagerUser
+from .models import Album, Song, AlbumTracklistItem, MusicManagerUser, Task
 
 admin.site.register(Album)
 admin.site.register(Song)
 admin.site.register(AlbumTracklistItem)
 admin.site.register(MusicManagerUser)
+admin.site.register(Task)
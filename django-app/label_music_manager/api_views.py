@@ -1,21 +1,471 @@
 # Use this file for your API viewsets only
 # E.g., from rest_framework import ...
-from rest_framework import viewsets
-from .models import Album, Song, AlbumTracklistItem, MusicManagerUser
-from .serializers import AlbumSerializer, SongSerializer, AlbumTracklistSerializer, MusicManagerUserSerializer
+import hashlib
+import os
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.views import View
+from rest_framework import permissions, serializers, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import PermissionDenied
+from rest_framework.filters import BaseFilterBackend, OrderingFilter
+from rest_framework.generics import get_object_or_404
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from . import catalogue_cache, changes, exporter, importer, search, stats, tasks
+from .conditional import ConditionalGetMixin
+from .fast_serializers import AlbumReader, SongReader
+from .models import Album, Change, Song, AlbumTracklistItem, MusicManagerUser, Task
+from .pagination import CatalogueCursorPagination, TaskCursorPagination
+from .profiles import get_music_manager
+from .renderers import FastJSONRenderer
+from .serializers import (
+    AlbumSerializer, SongSerializer, AlbumTracklistSerializer, ExportFilterSerializer, ImportSerializer,
+    MusicManagerUserSerializer, TaskSerializer, TracklistItemInputSerializer, TracklistReplaceSerializer,
+    get_query_list, get_sparse_fields,
+)
+from .tracklists import apply_tracklist, check_song_ids, upsert_items
 
-class AlbumViewSet(viewsets.ModelViewSet):
+# Stored album aggregates the list can be filtered and sorted by
+AGGREGATE_FIELDS = ['track_count', 'total_playtime']
+
+def get_album_queryset(request):
+    """
+    Loads only what the requested fieldset renders. Tracks are prefetched
+    to avoid N+1 queries; the track count and playtime are album columns.
+    """
+    fields = get_sparse_fields(request, AlbumSerializer.Meta.expandable_fields)
+    if fields is None:
+        return Album.objects.with_tracklist()
+
+    queryset = Album.objects.with_tracklist() if 'tracks' in fields else Album.objects.all()
+    if not fields & {'description', 'short_description'}:
+        queryset = queryset.defer('description')
+    return queryset
+
+def get_task_response(request, task):
+    """
+    Answers a request whose work was queued with 202 Accepted and the task,
+    whose URL reports its progress.
+    """
+    data = TaskSerializer(task, context={'request': request}).data
+    return Response(data, status=status.HTTP_202_ACCEPTED, headers={'Location': data['url']})
+
+class AlbumAggregateFilter(BaseFilterBackend):
+    """
+    Filters albums by their stored track count and playtime in seconds with
+    ?min_tracks=, ?max_tracks=, ?min_playtime= and ?max_playtime=.
+    """
+    lookups = {
+        'min_tracks': 'track_count__gte',
+        'max_tracks': 'track_count__lte',
+        'min_playtime': 'total_playtime__gte',
+        'max_playtime': 'total_playtime__lte',
+    }
+
+    def filter_queryset(self, request, queryset, view):
+        for param, lookup in self.lookups.items():
+            value = request.query_params.get(param)
+            if value is None:
+                continue
+            try:
+                value = serializers.IntegerField(min_value=0).run_validation(value)
+            except serializers.ValidationError as error:
+                raise serializers.ValidationError({param: error.detail})
+            queryset = queryset.filter(**{lookup: value})
+        return queryset
+
+class CachedAlbumMixin:
+    """
+    Serves album list and detail payloads from the catalogue cache.
+    Lists page through album IDs only and serialize just the albums missing
+    from the cache, with AlbumReader rather than AlbumSerializer. Entries
+    are keyed per album and per fieldset, and are invalidated by the model
+    signals.
+    """
+    def get_cache_variant(self):
+        fields = get_sparse_fields(self.request, AlbumSerializer.Meta.expandable_fields)
+        variant = repr((self.request.build_absolute_uri('/'), sorted(fields) if fields is not None else None))
+        return hashlib.md5(variant.encode()).hexdigest()
+
+    def list(self, request, *args, **kwargs):
+        # The ordering columns are loaded too, as the cursor is built from them
+        page = self.paginate_queryset(self.filter_queryset(Album.objects.only('id', *AGGREGATE_FIELDS)))
+        album_ids = [album.id for album in page]
+        payloads = self.read_albums(album_ids)
+
+        # Albums deleted since the page was read are left out
+        return self.get_paginated_response([payloads[album_id] for album_id in album_ids if album_id in payloads])
+
+    def read_albums(self, album_ids):
+        """
+        Returns the payloads of the albums, keyed by ID, reading only those
+        missing from the cache.
+        """
+        payloads, keys = catalogue_cache.get_albums(album_ids, self.get_cache_variant())
+        missing = [album_id for album_id in album_ids if album_id not in payloads]
+        if missing:
+            fresh = self.get_reader().read(Album.objects.filter(id__in=missing))
+            catalogue_cache.set_entries({keys[album_id]: payload for album_id, payload in fresh.items()})
+            payloads.update(fresh)
+        return payloads
+
+    def retrieve(self, request, *args, **kwargs):
+        # Keyed by the integer ID, as the signals invalidate them, so
+        # spellings like 01 do not get entries of their own
+        try:
+            album_id = int(kwargs['pk'])
+        except ValueError:
+            raise Http404(f'No {Album._meta.object_name} matches the given query.')
+        # Entries are stored whatever the filters, so filtered details are
+        # read without the cache
+        if not request.query_params.keys().isdisjoint(AlbumAggregateFilter.lookups):
+            return Response(self.read_object(album_id))
+        payload = catalogue_cache.get_or_set_album(
+            album_id,
+            self.get_cache_variant(),
+            lambda: self.read_object(album_id),
+        )
+        return Response(payload)
+
+    def get_reader(self):
+        return AlbumReader(self.request, format=self.format_kwarg)
+
+    def read_object(self, pk):
+        # Filtered like get_object(), so ?min_tracks= and the like apply to details too
+        try:
+            payloads = self.get_reader().read(self.filter_queryset(Album.objects.filter(pk=pk)))
+        except (TypeError, ValueError, DjangoValidationError):
+            payloads = {}
+        if not payloads:
+            raise Http404(f'No {Album._meta.object_name} matches the given query.')
+        return next(iter(payloads.values()))
+
+class AlbumViewSet(ConditionalGetMixin, CachedAlbumMixin, viewsets.ModelViewSet):
+    """
+    Albums can be filtered and sorted by the stored aggregates without
+    joining their tracklists, e.g. ?ordering=-total_playtime&min_tracks=10.
+    """
     queryset = Album.objects.all()
     serializer_class = AlbumSerializer
+    pagination_class = CatalogueCursorPagination
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+    filter_backends = [AlbumAggregateFilter, OrderingFilter]
+    ordering_fields = ['id', *AGGREGATE_FIELDS]
+    ordering = 'id'
+
+    def get_queryset(self):
+        return get_album_queryset(self.request)
+
+    def destroy(self, request, *args, **kwargs):
+        # Albums with long tracklists are deleted by the task queue
+        album = self.get_object()
+        if album.track_count <= settings.TASK_QUEUE_INLINE_LIMIT:
+            self.perform_destroy(album)
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        task = tasks.enqueue('delete_album', key=f'delete_album:{album.pk}', user=request.user, album_id=album.pk)
+        return get_task_response(request, task)
+
+class SongReadMixin:
+    """
+    Renders listed and retrieved songs with SongReader rather than
+    SongSerializer, which is kept for writes.
+    """
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        return self.get_paginated_response(SongReader(request, format=self.format_kwarg).serialize(page))
+
+    def retrieve(self, request, *args, **kwargs):
+        return Response(SongReader(request, format=self.format_kwarg).serialize([self.get_object()])[0])
 
-class SongViewSet(viewsets.ModelViewSet):
+class SongViewSet(ConditionalGetMixin, SongReadMixin, viewsets.ModelViewSet):
     queryset = Song.objects.all()
     serializer_class = SongSerializer
+    pagination_class = CatalogueCursorPagination
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+
+    def get_queryset(self):
+        """
+        Filters songs by title with ?search=, as used by the album track picker.
+        """
+        queryset = Song.objects.all()
+        search = self.request.query_params.get('search', '').strip()
+        if search:
+            queryset = queryset.filter(title__icontains=search)
+        return queryset
 
 class AlbumTracklistViewSet(viewsets.ModelViewSet):
     queryset = AlbumTracklistItem.objects.all()
     serializer_class = AlbumTracklistSerializer
+    max_bulk_items = 1000
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Adds or moves many tracklist items in one transaction. Accepts a list
+        of {"album", "song", "position"} items; nothing is written unless
+        every item is valid, and errors are reported per item.
+        """
+        if not isinstance(request.data, list):
+            return Response({'detail': 'Expected a list of tracklist items.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(request.data) > self.max_bulk_items:
+            return Response(
+                {'detail': f'At most {self.max_bulk_items} items can be sent at once.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        serializer = TracklistItemInputSerializer(data=request.data, many=True)
+        if not serializer.is_valid():
+            return Response({'errors': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        results, errors = upsert_items(serializer.validated_data)
+        if errors:
+            return Response({'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'results': results})
+
+    @action(detail=False, methods=['put'], url_path=r'album/(?P<album_id>[0-9]+)')
+    def replace(self, request, album_id):
+        """
+        Replaces an album's whole tracklist with {"songs": [song IDs]}, in
+        order. Only the rows that differ are inserted, deleted or moved.
+        Tracklists of more than TASK_QUEUE_INLINE_LIMIT songs are written
+        by the task queue, answering 202 with the task.
+        """
+        album = get_object_or_404(Album, pk=album_id)
+        serializer = TracklistReplaceSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        song_ids, errors = check_song_ids(serializer.validated_data['songs'])
+        if any(errors):
+            return Response({'errors': {'songs': errors}}, status=status.HTTP_400_BAD_REQUEST)
+        if len(song_ids) > settings.TASK_QUEUE_INLINE_LIMIT:
+            task = tasks.enqueue('rewrite_tracklist', user=request.user, album_id=album.pk, song_ids=song_ids)
+            return get_task_response(request, task)
+        counts = apply_tracklist(album, song_ids)
+        return Response({'album': album.pk, 'songs': song_ids, **counts})
 
 class MusicManagerUserViewSet(viewsets.ModelViewSet):
     queryset = MusicManagerUser.objects.all()
     serializer_class = MusicManagerUserSerializer
+
+class TaskViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Status and results of queued background work, newest first, filtered
+    with ?status= and ?name=. Editors see every task, other users the
+    tasks they queued.
+    """
+    serializer_class = TaskSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = TaskCursorPagination
+
+    def get_queryset(self):
+        queryset = Task.objects.all()
+        if not (self.request.user.is_staff or get_music_manager(self.request).is_editor):
+            queryset = queryset.filter(created_by=self.request.user)
+        for param in ('status', 'name'):
+            value = self.request.query_params.get(param)
+            if value:
+                queryset = queryset.filter(**{param: value})
+        return queryset
+
+class CatalogueImportView(APIView):
+    """
+    Queues the import of an uploaded JSON, NDJSON or CSV catalogue file, as
+    read by bulk_import, and answers 202 with the task. Requests repeated
+    with the same Idempotency-Key header return the first task.
+    Only Editors can import.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        if not get_music_manager(request).is_editor:
+            raise PermissionDenied('You do not have permission to import albums.')
+        key = request.headers.get('Idempotency-Key')
+        if key:
+            key = f'import:{request.user.pk}:{key}'
+            task = Task.objects.filter(idempotency_key=key).first()
+            if task is not None:
+                return get_task_response(request, task)
+
+        serializer = ImportSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        upload = serializer.validated_data['file']
+        name = importer.get_upload_storage().save(os.path.basename(upload.name), upload)
+        task = tasks.enqueue(
+            'import_catalogue', key=key, user=request.user, name=name,
+            input_format=serializer.validated_data['format'], batch_size=serializer.validated_data['batch_size'],
+        )
+        return get_task_response(request, task)
+
+class ChangeFeedView(CachedAlbumMixin, APIView):
+    """
+    Feed of the albums, songs and tracklist items created, updated or
+    deleted after ?since=, in commit order, for clients keeping a copy of
+    the catalogue in sync. Each change carries the object as the albums,
+    songs and tracklist endpoints render it, or null for deletions, and
+    objects changed several times appear once, at their last change.
+    Follow the returned cursor while has_more is set. Without ?since=,
+    only the current cursor is returned, to follow after downloading the
+    catalogue. Cursors older than the compacted log answer 410 Gone.
+    """
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+    max_limit = 1000
+
+    def get(self, request):
+        if 'since' not in request.query_params:
+            return Response({'changes': [], 'cursor': changes.get_head(), 'has_more': False})
+        since = serializers.IntegerField(min_value=0).run_validation(request.query_params['since'])
+        limit = serializers.IntegerField(min_value=1, max_value=self.max_limit).run_validation(
+            request.query_params.get('limit', 500)
+        )
+        if since < changes.get_start():
+            return Response({
+                'detail': 'Changes this old were compacted. Download the catalogue again.',
+                'cursor': changes.get_head(),
+            }, status=status.HTTP_410_GONE)
+
+        entries, cursor, has_more = changes.read_changes(since, limit)
+        payloads = self.read_payloads(entries)
+        feed = []
+        for entry in entries:
+            data = payloads[entry.kind].get(entry.object_id)
+            if entry.action != Change.DELETED and data is None:
+                # Deleted since, which a later entry reports
+                continue
+            feed.append({
+                'cursor': entry.id,
+                'type': entry.kind,
+                'action': entry.action,
+                'id': entry.object_id,
+                'data': data if entry.action != Change.DELETED else None,
+            })
+        return Response({'changes': feed, 'cursor': cursor, 'has_more': has_more})
+
+    def read_payloads(self, entries):
+        """
+        Returns the current payloads of the changed objects by kind and ID,
+        with a query or two per kind.
+        """
+        ids = {kind: [] for kind, _ in Change.KIND_CHOICES}
+        for entry in entries:
+            if entry.action != Change.DELETED:
+                ids[entry.kind].append(entry.object_id)
+
+        payloads = {kind: {} for kind in ids}
+        if ids[Change.ALBUM]:
+            payloads[Change.ALBUM] = self.read_albums(ids[Change.ALBUM])
+        if ids[Change.SONG]:
+            reader = SongReader(self.request, format=self.format_kwarg)
+            payloads[Change.SONG] = reader.read(Song.objects.filter(id__in=ids[Change.SONG]))
+        if ids[Change.TRACKLIST]:
+            items = AlbumTracklistItem.objects.filter(id__in=ids[Change.TRACKLIST])
+            payloads[Change.TRACKLIST] = {item['id']: item for item in items.values('id', 'album', 'song', 'position')}
+        return payloads
+
+class CacheStatsView(APIView):
+    """
+    Reports this process's catalogue cache hit and miss counters.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response({
+            'backend': catalogue_cache.get_cache().__class__.__name__,
+            'stats': catalogue_cache.stats.snapshot(),
+        })
+
+class CatalogueStatsView(APIView):
+    """
+    Album count, track count, total playtime and average price of the
+    catalogue by artist, format and release year, read from the rollups
+    kept by stats.py rather than aggregated per request. ?group= limits
+    the groupings to artist, format or year. Only Editors can see them.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+
+    def get(self, request):
+        if not get_music_manager(request).is_editor:
+            raise PermissionDenied('You do not have permission to view catalogue stats.')
+        groups = get_query_list(request, 'group') or set(stats.DIMENSIONS)
+        if groups - set(stats.DIMENSIONS):
+            raise serializers.ValidationError({'group': 'Expected artist, format or year.'})
+        return Response(stats.get_stats([dimension for dimension in stats.DIMENSIONS if dimension in groups]))
+
+def get_search_params(request, max_limit=100):
+    """
+    Returns the query, the kinds searched and the result limit of a search
+    request, raising a ValidationError for an unknown type or bad limit.
+    """
+    query = request.GET.get('q', '').strip()
+    kinds = get_query_list(request, 'type') or {'album', 'song'}
+    if kinds - set(search.KINDS):
+        raise serializers.ValidationError({'type': 'Expected album or song.'})
+    limit = serializers.IntegerField(min_value=1, max_value=max_limit).run_validation(
+        request.GET.get('limit', 20)
+    )
+    return query, kinds, limit
+
+def get_search_scope(music_manager, query):
+    """
+    Returns the query and the artist profile ID that search results are
+    limited to, or None for users who may search the whole catalogue.
+    """
+    if not music_manager.is_artist:
+        return query, None
+    if music_manager.profile_id is None:
+        # Artists without a profile own nothing
+        return '', None
+    return query, music_manager.profile_id
+
+class SearchView(APIView):
+    """
+    Ranked full-text search over album titles, artists and descriptions and
+    song titles, matching each word of ?q= as a prefix. ?type=album or
+    ?type=song limits the kinds searched and ?limit= the results per kind.
+    Artists only find their own albums and the songs on them.
+    """
+    def get(self, request):
+        query, kinds, limit = get_search_params(request)
+        query, owner_id = get_search_scope(get_music_manager(request), query)
+
+        context = {'request': request}
+        data = {'query': query, 'albums': [], 'songs': []}
+        if 'album' in kinds:
+            ids = search.search_ids(query, 'album', owner_id, limit)
+            albums = search.in_rank_order(get_album_queryset(request), ids) if ids else []
+            data['albums'] = AlbumSerializer(albums, many=True, context=context).data
+        if 'song' in kinds:
+            ids = search.search_ids(query, 'song', owner_id, limit)
+            songs = search.in_rank_order(Song.objects.all(), ids) if ids else []
+            data['songs'] = SongSerializer(songs, many=True, context=context).data
+        return Response(data)
+
+class CatalogueExportView(View):
+    """
+    Streams albums with their ordered tracklists as NDJSON or CSV, e.g.
+    /api/export/albums.csv?artist=X&released_after=2020-01-01, filtered by
+    ExportFilterSerializer. Albums are read and written a chunk at a time,
+    so memory does not grow with the catalogue, and under ASGI the chunks
+    are yielded asynchronously for the same reason. A plain Django view,
+    as DRF reserves ?format= for choosing a renderer.
+    """
+    chunk_size = 500
+
+    def get(self, request, export_format):
+        if export_format not in exporter.WRITERS:
+            raise Http404
+        filters = ExportFilterSerializer(data=request.GET.dict())
+        if not filters.is_valid():
+            return JsonResponse(filters.errors, status=400)
+
+        content_type, _ = exporter.WRITERS[export_format]
+        export = exporter.aexport if isinstance(request, ASGIRequest) else exporter.export
+        response = StreamingHttpResponse(
+            export(filters.validated_data, export_format, self.chunk_size),
+            content_type=f'{content_type}; charset=utf-8',
+        )
+        response.headers['Content-Disposition'] = f'attachment; filename="albums.{export_format}"'
+        return response
@@ -0,0 +1,117 @@
+# Serving of static, media and React build files with their precompressed variants
+import mimetypes
+import os
+import re
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from .compression import VARIANT_SUFFIXES, choose_encoding, compress_directory, get_available_encodings
+
+# A content hash in a file name, as written by ManifestStaticFilesStorage
+# (app.0123456789ab.css), the React build (main.01234567.js) and covers.py
+# (cover-0123456789ab-300w.webp)
+HASHED_NAME = re.compile(r'[.-][0-9a-f]{8,}[.-]')
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    Collects static files under content-hashed names, then writes .br and
+    .gz copies of them for PrecompressedStaticMiddleware to serve.
+    """
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if not dry_run:
+            compress_directory(self.location, settings.COMPRESSION_MIN_SIZE)
+
+def get_cache_control(path):
+    if HASHED_NAME.search(os.path.basename(path)):
+        return f'public, max-age={settings.STATIC_FILE_MAX_AGE}, immutable'
+    # Fixed names, e.g. index.html, are revalidated on every use
+    return 'no-cache'
+
+class PrecompressedStaticMiddleware:
+    """
+    Serves the directories in STATIC_FILE_ROOTS by URL prefix, sending the
+    .br or .gz copy written by compress_assets or collectstatic when the
+    client accepts it, so nothing is compressed per request. Files with a
+    content hash in their name are cached for STATIC_FILE_MAX_AGE, others
+    are revalidated with their ETag. Unknown paths under SPA_URL get the
+    React app's index.html, for its client-side routes. Requests for files
+    that do not exist fall through to the URLconf.
+    It should come before CompressionMiddleware, which would otherwise
+    compress the files again.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.roots = sorted(settings.STATIC_FILE_ROOTS.items(), key=lambda item: len(item[0]), reverse=True)
+        # Under ASGI, requests for other paths reach async views unadapted
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        path = self.find_request_file(request)
+        if path is not None:
+            return self.serve(request, path)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        path = self.find_request_file(request)
+        if path is not None:
+            return await sync_to_async(self.serve, thread_sensitive=False)(request, path)
+        return await self.get_response(request)
+
+    def find_request_file(self, request):
+        if request.method in ('GET', 'HEAD'):
+            return self.find_file(request.path_info)
+        return None
+
+    def find_file(self, url_path):
+        for prefix, roots in self.roots:
+            if not url_path.startswith(prefix):
+                continue
+            name = url_path[len(prefix):]
+            if not name or name.endswith('/'):
+                name += 'index.html'
+            for root in roots:
+                try:
+                    path = safe_join(root, name)
+                except SuspiciousFileOperation:
+                    return None
+                if os.path.isfile(path):
+                    return path
+            # Client-side routes of the React app, e.g. /app/albums/1
+            if prefix == settings.SPA_URL and '.' not in name.rsplit('/', 1)[-1]:
+                index = os.path.join(settings.SPA_BUILD_DIR, 'index.html')
+                return index if os.path.isfile(index) else None
+            return None
+        return None
+
+    def serve(self, request, path):
+        available = [encoding for encoding in get_available_encodings()
+                     if os.path.isfile(path + VARIANT_SUFFIXES[encoding])]
+        encoding = choose_encoding(request, available)
+        served = path + VARIANT_SUFFIXES[encoding] if encoding else path
+        stat = os.stat(served)
+        etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+        response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+        if response is None:
+            content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+            response = FileResponse(open(served, 'rb'), content_type=content_type, filename=os.path.basename(path))
+            response.headers['Last-Modified'] = http_date(stat.st_mtime)
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+        response.headers['ETag'] = etag
+        response.headers['Cache-Control'] = get_cache_control(path)
+        if available:
+            patch_vary_headers(response, ('Accept-Encoding',))
+        return response
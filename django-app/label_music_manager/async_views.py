@@ -0,0 +1,111 @@
+# Async read-only API endpoints, served without blocking a worker under ASGI
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from rest_framework import serializers
+from . import search
+from .api_views import get_album_queryset, get_search_params, get_search_scope
+from .models import Album, Song
+from .pagination import CatalogueCursorPagination
+from .profiles import get_music_manager
+from .renderers import FastJSONRenderer
+from .serializers import AlbumSerializer, SongSerializer
+
+def render(data, status=200):
+    """
+    Renders data with the same JSON renderer as the DRF viewsets.
+    """
+    return HttpResponse(FastJSONRenderer().render(data), content_type='application/json', status=status)
+
+def not_found(model):
+    return render({'detail': f'No {model._meta.object_name} matches the given query.'}, status=404)
+
+async def serialize(serializer_class, instance, request, many=False):
+    """
+    Serializes already loaded objects in the sync thread pool, as building
+    hyperlinks and cover URLs is blocking work.
+    """
+    return await sync_to_async(
+        lambda: serializer_class(instance, many=many, context={'request': request}).data
+    )()
+
+def get_page_params(request):
+    """
+    Returns the page size and the ID after which the page starts.
+    """
+    pagination = CatalogueCursorPagination
+    page_size = serializers.IntegerField(min_value=1, max_value=pagination.max_page_size).run_validation(
+        request.GET.get(pagination.page_size_query_param, pagination.page_size)
+    )
+    after = serializers.IntegerField(min_value=0).run_validation(request.GET.get('after', 0))
+    return page_size, after
+
+async def get_page(request, queryset, serializer_class):
+    """
+    Reads one keyset page of objects ordered by ID, with a link to the next.
+    """
+    try:
+        page_size, after = get_page_params(request)
+    except serializers.ValidationError as error:
+        return render(error.detail, status=400)
+
+    objects = [obj async for obj in queryset.filter(id__gt=after).order_by('id')[:page_size + 1]]
+    next_url = None
+    if len(objects) > page_size:
+        objects = objects[:page_size]
+        params = request.GET.copy()
+        params['after'] = objects[-1].id
+        next_url = request.build_absolute_uri(f'{request.path}?{params.urlencode()}')
+
+    results = await serialize(serializer_class, objects, request, many=True)
+    return render({'next': next_url, 'results': results})
+
+async def album_list(request):
+    return await get_page(request, get_album_queryset(request), AlbumSerializer)
+
+async def album_detail(request, pk):
+    try:
+        album = await get_album_queryset(request).aget(pk=pk)
+    except Album.DoesNotExist:
+        return not_found(Album)
+    return render(await serialize(AlbumSerializer, album, request))
+
+async def song_list(request):
+    queryset = Song.objects.all()
+    query = request.GET.get('search', '').strip()
+    if query:
+        queryset = queryset.filter(title__icontains=query)
+    return await get_page(request, queryset, SongSerializer)
+
+async def song_detail(request, pk):
+    try:
+        song = await Song.objects.aget(pk=pk)
+    except Song.DoesNotExist:
+        return not_found(Song)
+    return render(await serialize(SongSerializer, song, request))
+
+async def in_rank_order(queryset, ids):
+    objects = {obj.pk: obj async for obj in queryset.filter(pk__in=ids)}
+    return [objects[object_id] for object_id in ids if object_id in objects]
+
+async def search_catalogue(request):
+    """
+    Async counterpart of SearchView, with the same parameters and results.
+    """
+    try:
+        query, kinds, limit = get_search_params(request)
+    except serializers.ValidationError as error:
+        return render(error.detail, status=400)
+    # Resolving the user and their role reads the session and permissions
+    music_manager = await sync_to_async(get_music_manager)(request)
+    query, owner_id = get_search_scope(music_manager, query)
+
+    data = {'query': query, 'albums': [], 'songs': []}
+    for kind, queryset, serializer_class in (
+        ('album', get_album_queryset(request), AlbumSerializer),
+        ('song', Song.objects.all(), SongSerializer),
+    ):
+        if kind in kinds:
+            ids = await sync_to_async(search.search_ids)(query, kind, owner_id, limit)
+            objects = await in_rank_order(queryset, ids) if ids else []
+            data[f'{kind}s'] = await serialize(serializer_class, objects, request, many=True)
+    return render(data)
@@ -0,0 +1,222 @@
+# Timed page, API and importer scenarios over generated catalogues, checked against budgets
+import json
+import statistics
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from django.contrib.auth.models import Permission, User
+from django.core.cache import caches
+from django.db import connection, reset_queries, transaction
+from django.db.models import Count
+from django.test import Client, RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils.text import slugify
+from rest_framework.renderers import JSONRenderer
+from .fast_serializers import AlbumReader
+from .generator import CatalogueGenerator
+from .importer import CatalogueImporter
+from .models import Album, AlbumTracklistItem, MusicManagerUser
+from .renderers import FastJSONRenderer
+from .serializers import AlbumSerializer
+
+# Catalogue sizes benchmarked with --scale
+SCALES = {
+    'tiny': {'albums': 40, 'songs': 400, 'artists': 5},
+    'small': {'albums': 1000, 'songs': 20000, 'artists': 100},
+    'medium': {'albums': 10000, 'songs': 200000, 'artists': 1000},
+    'large': {'albums': 10000, 'songs': 1000000, 'artists': 2000},
+}
+
+# Budgets checked by default, by scale, scenario and metric
+BUDGETS_PATH = Path(__file__).with_name('benchmark_budgets.json')
+
+# Fraction of the catalogue imported by the importer scenario
+IMPORT_FRACTION = 10
+
+METRICS = ('ms', 'queries', 'peak_kb')
+
+class BenchmarkError(Exception):
+    pass
+
+class CatalogueBenchmark:
+    """
+    Times each scenario against the catalogue of one scale. Every scenario
+    is run once with queries captured and memory traced, then timed
+    repeats times without either; the median wall time is reported. The
+    caches are cleared before each run, so the full work is measured.
+    """
+    def __init__(self, scale, repeats=5, seed=0):
+        self.scale = scale
+        self.repeats = repeats
+        self.seed = seed
+        self.generator = CatalogueGenerator(**SCALES[scale], seed=seed)
+
+    def generate(self):
+        return self.generator.write()
+
+    def get_client(self, username, role):
+        user, _ = User.objects.get_or_create(username=username)
+        user.user_permissions.add(Permission.objects.get(codename=role))
+        MusicManagerUser.objects.get_or_create(user=user, defaults={'display_name': username})
+        client = Client()
+        client.force_login(user)
+        return client
+
+    def get_scenarios(self):
+        """
+        Returns (name, function, repeats) tuples. Pages and endpoints are
+        read for the album with the longest tracklist, as the worst case.
+        """
+        busiest = (
+            AlbumTracklistItem.objects.values('album', 'album__slug').annotate(tracks=Count('id'))
+            .order_by('-tracks', 'album').first()
+        )
+        if busiest is None:
+            raise BenchmarkError('The catalogue has no tracklists to benchmark.')
+        item = AlbumTracklistItem.objects.filter(album=busiest['album']).order_by('position').first()
+        album_id = busiest['album']
+
+        anonymous = Client()
+        # The top artist owns the most albums, as their count follows a Zipf distribution
+        artist = self.get_client(slugify(self.generator.artist_names()[0]), 'Artist')
+        editor = self.get_client('benchmark-editor', 'Editor')
+
+        def get(client, url):
+            def run():
+                response = client.get(url)
+                if response.status_code != 200:
+                    raise BenchmarkError(f'GET {url} returned {response.status_code}.')
+            return run
+
+        return [
+            ('album_list', get(anonymous, reverse('album_list')), self.repeats),
+            ('album_list_artist', get(artist, reverse('album_list')), self.repeats),
+            ('album_detail', get(anonymous, reverse('album_detail_slug', args=[album_id, busiest['album__slug']])),
+             self.repeats),
+            ('album_edit', get(editor, reverse('album_edit', args=[album_id])), self.repeats),
+            ('api_albums_list', get(editor, reverse('albums-list')), self.repeats),
+            ('api_albums_detail', get(editor, reverse('albums-detail', args=[album_id])), self.repeats),
+            ('api_songs_list', get(editor, reverse('songs-list')), self.repeats),
+            ('api_songs_detail', get(editor, reverse('songs-detail', args=[item.song_id])), self.repeats),
+            ('api_tracklist_list', get(editor, reverse('tracklist-list')), self.repeats),
+            ('api_tracklist_detail', get(editor, reverse('tracklist-detail', args=[item.pk])), self.repeats),
+            # Imports are rolled back, so each run starts from the same catalogue
+            ('importer', self.run_import, 1),
+        ]
+
+    def run_import(self):
+        generator = CatalogueGenerator(
+            albums=max(1, self.generator.album_count // IMPORT_FRACTION),
+            songs=self.generator.song_count // IMPORT_FRACTION,
+            artists=self.generator.artist_count,
+            seed=self.seed + 1,
+        )
+        with transaction.atomic():
+            CatalogueImporter().run(generator.records(prefix='Imported'))
+            transaction.set_rollback(True)
+
+    def clear_caches(self):
+        for cache in caches.all():
+            cache.clear()
+
+    def measure(self, run, repeats):
+        self.clear_caches()
+        reset_queries()
+        with CaptureQueriesContext(connection) as queries:
+            tracemalloc.start()
+            try:
+                run()
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+        # Counted now, as every request resets the query log the count reads from
+        query_count = len(queries)
+
+        timings = []
+        for _ in range(repeats):
+            self.clear_caches()
+            started = time.perf_counter()
+            run()
+            timings.append((time.perf_counter() - started) * 1000)
+        return {'ms': round(statistics.median(timings), 2), 'queries': query_count, 'peak_kb': peak // 1024}
+
+    def run(self, progress=None):
+        """
+        Returns the metrics of every scenario, by name.
+        """
+        progress = progress or (lambda message: None)
+        results = {}
+        # Without DEBUG, as in production, queries are only logged while captured
+        with override_settings(DEBUG=False):
+            for name, run, repeats in self.get_scenarios():
+                results[name] = self.measure(run, repeats)
+                progress(f'{self.scale} {name}: {results[name]}')
+        return results
+
+def load_budgets(path=BUDGETS_PATH):
+    with open(path, encoding='utf-8') as stream:
+        return json.load(stream)
+
+def check_budgets(results, budgets):
+    """
+    Returns a message for each metric over its budget. results and budgets
+    are both keyed by scale, then scenario, then metric; scales, scenarios
+    and metrics without a budget are not checked.
+    """
+    violations = []
+    for scale, scenarios in results.items():
+        for name, metrics in scenarios.items():
+            budget = budgets.get(scale, {}).get(name, {})
+            for metric in METRICS:
+                if metric in budget and metrics[metric] > budget[metric]:
+                    violations.append(f'{scale} {name}: {metric} {metrics[metric]} exceeds the budget of {budget[metric]}')
+    return violations
+
+@contextmanager
+def temporary_database():
+    """
+    Runs the block against a fresh, empty test database, removed afterwards.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        # A file of its own, so benchmarks can run alongside the tests
+        if connection.vendor == 'sqlite':
+            connection.settings_dict['TEST']['NAME'] = str(Path(directory) / 'benchmark.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            yield
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+def benchmark_serializers(repeats=5):
+    """
+    Times reading and rendering every album with its tracks through
+    AlbumSerializer and JSONRenderer, and through AlbumReader and
+    FastJSONRenderer. Returns the median time and albums per second of
+    each, raising BenchmarkError if their output differs.
+    """
+    request = RequestFactory().get('/api/albums/')
+
+    def serialize():
+        albums = list(Album.objects.with_tracklist().order_by('id'))
+        return JSONRenderer().render(AlbumSerializer(albums, many=True, context={'request': request}).data)
+
+    def read():
+        payloads = AlbumReader(request).read(Album.objects.order_by('id'))
+        return FastJSONRenderer().render(list(payloads.values()))
+
+    if serialize() != read():
+        raise BenchmarkError('AlbumReader output differs from AlbumSerializer output.')
+    album_count = Album.objects.count()
+    results = {}
+    for name, run in [('serializer', serialize), ('reader', read)]:
+        timings = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - started)
+        median = statistics.median(timings)
+        results[name] = {'ms': round(median * 1000, 2), 'albums_per_second': round(album_count / median)}
+    return results
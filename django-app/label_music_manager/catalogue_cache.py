@@ -0,0 +1,138 @@
+# Server-side cache of serialized albums and rendered album fragments
+import threading
+import uuid
+from django.core.cache import caches
+from django.db import transaction
+
+CACHE_ALIAS = 'catalogue'
+
+class CacheStats:
+    """
+    Hit and miss counters for this process, per kind of cached entry.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def record(self, kind, hits=0, misses=0):
+        with self.lock:
+            counts = self.counts.setdefault(kind, {'hits': 0, 'misses': 0})
+            counts['hits'] += hits
+            counts['misses'] += misses
+
+    def snapshot(self):
+        with self.lock:
+            return {kind: dict(counts) for kind, counts in self.counts.items()}
+
+    def reset(self):
+        with self.lock:
+            self.counts = {}
+
+stats = CacheStats()
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+def get_versions(version_keys):
+    """
+    Returns the current version token of each key in one round trip.
+    Invalidating deletes a version key, and a missing key gets a fresh random
+    token, so entries stored under an old token are never read again.
+    """
+    cache = get_cache()
+    versions = cache.get_many(version_keys)
+    missing = {key: uuid.uuid4().hex for key in version_keys if key not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return versions
+
+def album_version_key(album_id):
+    return f'album-version:{album_id}'
+
+def list_version_key(scope):
+    return f'album-list-version:{scope}'
+
+def get_scope(owner_id=None):
+    """
+    Returns the list scope shown to a role. Artists see only the albums
+    their profile owns; anonymous users, viewers and editors share the full list.
+    """
+    if owner_id is None:
+        return 'all'
+    return f'owner-{owner_id}'
+
+def get_albums(album_ids, variant, kind='album'):
+    """
+    Returns the cached entries of the given albums for a representation
+    variant, keyed by album ID, together with the keys to store misses under.
+    """
+    versions = get_versions([album_version_key(album_id) for album_id in album_ids])
+    keys = {
+        album_id: f'{kind}:{album_id}:{versions[album_version_key(album_id)]}:{variant}'
+        for album_id in album_ids
+    }
+    found = get_cache().get_many(keys.values())
+    entries = {album_id: found[key] for album_id, key in keys.items() if key in found}
+    stats.record(kind, hits=len(entries), misses=len(album_ids) - len(entries))
+    return entries, keys
+
+def set_entries(entries_by_key):
+    if entries_by_key:
+        get_cache().set_many(entries_by_key)
+
+def get_or_set_album(album_id, variant, render, kind='album'):
+    """
+    Returns the cached entry of one album, rendering and storing it on a miss.
+    """
+    entries, keys = get_albums([album_id], variant, kind)
+    if album_id not in entries:
+        entries[album_id] = render()
+        set_entries({keys[album_id]: entries[album_id]})
+    return entries[album_id]
+
+def get_or_set_list(scope, variant, render):
+    """
+    Returns a cached album list fragment for a scope, rendering and storing
+    it on a miss. Lists have a version per scope and a global version.
+    """
+    global_key = list_version_key('global')
+    versions = get_versions([global_key, list_version_key(scope)])
+    key = f'album-list:{scope}:{versions[global_key]}:{versions[list_version_key(scope)]}:{variant}'
+    cache = get_cache()
+    fragment = cache.get(key)
+    if fragment is None:
+        stats.record('album_list', misses=1)
+        fragment = render()
+        cache.set(key, fragment)
+    else:
+        stats.record('album_list', hits=1)
+    return fragment
+
+def delete_versions(version_keys):
+    """
+    Deletes version keys now, and again once the current transaction
+    commits. Until then other connections still read the old rows, and
+    an entry they store under the new token would outlive the commit.
+    """
+    get_cache().delete_many(version_keys)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: get_cache().delete_many(version_keys))
+
+def invalidate_albums(album_ids):
+    """
+    Invalidates every cached representation of the given albums.
+    """
+    if album_ids:
+        delete_versions([album_version_key(album_id) for album_id in album_ids])
+
+def invalidate_lists(owner_ids=None):
+    """
+    Invalidates the full album list and the lists of the given artist
+    profiles, or every list when owner_ids is None.
+    """
+    if owner_ids is None:
+        keys = [list_version_key('global')]
+    else:
+        keys = [list_version_key('all')] + [list_version_key(get_scope(owner_id)) for owner_id in owner_ids]
+    delete_versions(keys)
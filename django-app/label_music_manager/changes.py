@@ -0,0 +1,63 @@
+# Append-only log of catalogue changes, read by API clients to sync deltas
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from .models import Change
+
+def record(kind, action, object_ids):
+    """
+    Appends an entry for each of the objects to the change log, in one
+    query. Returns the number of entries written.
+    """
+    now = timezone.now()
+    entries = [Change(kind=kind, action=action, object_id=object_id, created_at=now) for object_id in object_ids]
+    if entries:
+        Change.objects.bulk_create(entries)
+    return len(entries)
+
+def get_head():
+    """
+    Returns the cursor of the newest entry, or 0 while the log is empty.
+    """
+    return Change.objects.aggregate(head=Max('id'))['head'] or 0
+
+def get_start():
+    """
+    Returns the cursor the log starts after once compacted, or 0. Changes
+    up to it are gone, so older cursors can no longer be followed.
+    """
+    first = Change.objects.order_by('id').values_list('id', 'action').first()
+    return first[0] if first is not None and first[1] == Change.COMPACTED else 0
+
+def read_changes(since, limit):
+    """
+    Reads up to limit entries after the cursor since. Returns the entries
+    in commit order, keeping only the newest one for each object, the
+    cursor of the last entry read and whether more entries follow.
+    """
+    entries = list(Change.objects.filter(id__gt=since).order_by('id')[:limit + 1])
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    latest = {}
+    for entry in entries:
+        # Moved to the end, so objects stay in the order of their last change
+        latest.pop((entry.kind, entry.object_id), None)
+        latest[(entry.kind, entry.object_id)] = entry
+    return list(latest.values()), entries[-1].id if entries else since, has_more
+
+def compact(before):
+    """
+    Removes the entries logged before the given time. The newest of them
+    is kept as a COMPACTED marker, so clients holding an older cursor can
+    be told to download the catalogue again. Returns the number removed.
+    """
+    with transaction.atomic():
+        last = Change.objects.filter(created_at__lt=before).order_by('-id').values_list('id', 'action').first()
+        if last is None:
+            return 0
+        removed = Change.objects.filter(id__lt=last[0]).delete()[0]
+        if last[1] != Change.COMPACTED:
+            Change.objects.filter(id=last[0]).update(kind='', object_id=0, action=Change.COMPACTED)
+            removed += 1
+    return removed
@@ -0,0 +1,20 @@
+# System checks for settings the catalogue cache and task queue rely on
+from django.conf import settings
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Error, Tags, register
+from . import catalogue_cache
+
+@register(Tags.caches)
+def check_catalogue_cache_is_shared(app_configs, **kwargs):
+    """
+    Tasks run by manage.py run_workers write albums in a process of their
+    own, and can only invalidate a catalogue cache the web processes share.
+    """
+    if settings.TASK_QUEUE_EAGER or not isinstance(catalogue_cache.get_cache(), LocMemCache):
+        return []
+    return [Error(
+        'The catalogue cache is kept in each process, so albums changed by queued tasks stay cached '
+        'in the web processes.',
+        hint="Set CATALOGUE_CACHE to 'file' or 'redis', or set TASK_QUEUE_EAGER=1 to run tasks in-process.",
+        id='label_music_manager.E001',
+    )]
@@ -0,0 +1,162 @@
+# Response compression with brotli or gzip, and precompression of asset files
+import gzip
+import mimetypes
+import os
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+
+# brotli is optional; without it everything is compressed with gzip only
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Content types worth compressing. Images other than SVG, fonts and
+# archives are compressed already.
+COMPRESSIBLE_TYPES = (
+    'text/',
+    'application/json',
+    'application/x-ndjson',
+    'application/javascript',
+    'application/manifest+json',
+    'application/xml',
+    'image/svg+xml',
+    'image/vnd.microsoft.icon',
+    'image/x-icon',
+)
+
+# File name suffix of each precompressed variant, in order of preference
+VARIANT_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+def get_available_encodings():
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+def get_accepted_encodings(header):
+    """
+    Returns the content codings an Accept-Encoding header allows, leaving
+    out those with q=0. A * allows gzip and brotli.
+    """
+    accepted = set()
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        try:
+            quality = float(params.strip().partition('=')[2]) if params.strip().startswith('q=') else 1
+        except ValueError:
+            quality = 1
+        if coding and quality > 0:
+            accepted.update(['br', 'gzip'] if coding == '*' else [coding])
+    return accepted
+
+def choose_encoding(request, encodings):
+    """
+    Returns the first of encodings the client accepts, or None.
+    """
+    accepted = get_accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    return next((encoding for encoding in encodings if encoding in accepted), None)
+
+def is_compressible(content_type):
+    return content_type.split(';')[0].strip().lower().startswith(COMPRESSIBLE_TYPES)
+
+def brotli_sequence(sequence):
+    # Flushed after every chunk, so a streamed export keeps streaming
+    compressor = brotli.Compressor(quality=5)
+    for item in sequence:
+        data = compressor.process(item) + compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+async def brotli_async_sequence(sequence):
+    compressor = brotli.Compressor(quality=5)
+    async for item in sequence:
+        data = compressor.process(item) + compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    Compresses text, JSON and NDJSON responses of at least
+    COMPRESSION_MIN_SIZE bytes, and every streamed one, with brotli when
+    the client accepts it and the brotli package is installed, and with
+    gzip otherwise. HTML is always gzipped, as Django pads gzip output
+    against BREACH and pages carry CSRF tokens. Strong ETags become weak,
+    so conditional requests still match.
+    """
+    def process_response(self, request, response):
+        if response.has_header('Content-Encoding') or not is_compressible(response.get('Content-Type', '')):
+            return response
+        if not response.streaming and len(response.content) < settings.COMPRESSION_MIN_SIZE:
+            return response
+
+        encodings = get_available_encodings()
+        if response['Content-Type'].startswith('text/html'):
+            encodings = ['gzip']
+        encoding = choose_encoding(request, encodings)
+        if encoding != 'br':
+            # Django's gzip, which also sets Vary
+            return super().process_response(request, response)
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if response.streaming:
+            compress = brotli_async_sequence if response.is_async else brotli_sequence
+            response.streaming_content = compress(response.streaming_content)
+            del response.headers['Content-Length']
+        else:
+            compressed = brotli.compress(response.content, quality=5)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(compressed))
+
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = 'br'
+        return response
+
+def compress_file(path, min_size):
+    """
+    Writes .br (with brotli installed) and .gz copies of a compressible
+    file next to it, keeping only those smaller than the file. Copies
+    newer than the file are left alone. Returns the bytes saved by each
+    written copy, by path.
+    """
+    content_type = mimetypes.guess_type(path)[0]
+    if content_type is None or not is_compressible(content_type) or os.path.getsize(path) < min_size:
+        return {}
+    source_mtime = os.path.getmtime(path)
+    written = {}
+    data = None
+    for encoding in get_available_encodings():
+        variant = path + VARIANT_SUFFIXES[encoding]
+        if os.path.exists(variant) and os.path.getmtime(variant) >= source_mtime:
+            continue
+        if data is None:
+            with open(path, 'rb') as stream:
+                data = stream.read()
+        compressed = brotli.compress(data, quality=11) if encoding == 'br' else gzip.compress(data, 9, mtime=0)
+        if len(compressed) >= len(data):
+            if os.path.exists(variant):
+                os.remove(variant)
+            continue
+        # Replaced in one step, so a file being served is never half written
+        with open(variant + '.tmp', 'wb') as stream:
+            stream.write(compressed)
+        os.replace(variant + '.tmp', variant)
+        written[variant] = len(data) - len(compressed)
+    return written
+
+def compress_directory(root, min_size):
+    """
+    Precompresses every compressible file under root. Returns the bytes
+    saved by each written copy, by path.
+    """
+    written = {}
+    for directory, _, filenames in os.walk(root):
+        for filename in filenames:
+            if not filename.endswith(tuple(VARIANT_SUFFIXES.values()) + ('.tmp',)):
+                written.update(compress_file(os.path.join(directory, filename), min_size))
+    return written
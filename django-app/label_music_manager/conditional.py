@@ -0,0 +1,82 @@
+# Conditional GET support (ETag and Last-Modified) for catalogue reads
+import hashlib
+from django.contrib.messages import get_messages
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+def make_etag(*parts):
+    """
+    Returns a strong ETag hashing everything the representation depends on.
+    """
+    return '"%s"' % hashlib.sha256(repr(parts).encode()).hexdigest()[:40]
+
+def not_modified(request, etag, last_modified=None):
+    """
+    Returns a 304 (or 412) response when the request's preconditions say the
+    client already has this representation, otherwise None.
+    last_modified is only compared when given. List views leave it out
+    because a deleted row does not move the newest updated_at timestamp.
+    """
+    response = get_conditional_response(
+        request, etag=etag, last_modified=int(last_modified.timestamp()) if last_modified else None
+    )
+    if response is not None and response.status_code == 304:
+        set_validators(response, etag, last_modified)
+    return response
+
+def set_validators(response, etag, last_modified=None):
+    response.headers['ETag'] = etag
+    if last_modified is not None:
+        response.headers['Last-Modified'] = http_date(last_modified.timestamp())
+    return response
+
+def has_pending_messages(request):
+    """
+    Pages showing one-off flash messages must not be answered with 304.
+    Checking the storage does not mark the messages as read.
+    """
+    return bool(len(get_messages(request)))
+
+class ConditionalGetMixin:
+    """
+    Adds strong ETag and Last-Modified headers to list and retrieve actions,
+    and answers matching If-None-Match requests with 304 Not Modified before
+    anything is serialized.
+    The viewset's model needs an updated_at field that also moves when
+    nested data (e.g. an album's tracklist) changes.
+    """
+    def get_etag(self, request, *parts):
+        return make_etag(
+            self.basename, *parts, request.get_host(), request.get_full_path(), request.accepted_media_type
+        )
+
+    def list(self, request, *args, **kwargs):
+        # One aggregate query stands in for rendering the whole list
+        validators = self.queryset.aggregate(count=Count('pk'), last_modified=Max('updated_at'))
+        last_modified = validators['last_modified']
+        etag = self.get_etag(request, 'list', validators['count'], last_modified)
+
+        response = not_modified(request, etag)
+        if response is None:
+            response = set_validators(super().list(request, *args, **kwargs), etag, last_modified)
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        try:
+            last_modified = self.queryset.filter(
+                **{self.lookup_field: lookup}
+            ).values_list('updated_at', flat=True).first()
+        except (TypeError, ValueError, ValidationError):
+            last_modified = None
+        if last_modified is None:
+            # Let the normal lookup raise the 404
+            return super().retrieve(request, *args, **kwargs)
+        etag = self.get_etag(request, 'detail', lookup, last_modified)
+
+        response = not_modified(request, etag, last_modified)
+        if response is None:
+            response = set_validators(super().retrieve(request, *args, **kwargs), etag, last_modified)
+        return response
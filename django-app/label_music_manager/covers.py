@@ -0,0 +1,93 @@
+# Responsive cover image variants, generated off the request path
+import hashlib
+import io
+import logging
+import os
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import Image, UnidentifiedImageError
+from . import tasks
+from .models import Album, albums_touched
+
+logger = logging.getLogger(__name__)
+
+# Output formats and the Pillow encoder options used for them
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+def get_widths(source_width):
+    """
+    Returns the variant widths for a source image, never upscaling it.
+    """
+    widths = [width for width in settings.COVER_VARIANT_WIDTHS if width < source_width]
+    widths.append(min(max(settings.COVER_VARIANT_WIDTHS), source_width))
+    return sorted(set(widths))
+
+def flatten(image):
+    """
+    Returns an RGB copy of an image on a white background, as JPEG has no alpha.
+    """
+    if image.mode == 'RGB':
+        return image
+    image = image.convert('RGBA')
+    background = Image.new('RGB', image.size, (255, 255, 255))
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+def generate_variants(name, storage=default_storage):
+    """
+    Writes resized WebP and JPEG variants of a stored cover image and returns
+    their manifest. Filenames contain a hash of the source content, so
+    variants of a replaced file never collide and existing files are reused.
+    """
+    with storage.open(name, 'rb') as source:
+        content = source.read()
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    stem = os.path.splitext(os.path.basename(name))[0]
+
+    manifest = {'source': name}
+    with Image.open(io.BytesIO(content)) as image:
+        image.load()
+        for width in get_widths(image.width):
+            height = max(1, round(image.height * width / image.width))
+            resized = image.resize((width, height), Image.LANCZOS)
+            for extension, (image_format, options) in FORMATS.items():
+                variant_name = f'covers/{stem}-{digest}-{width}w.{extension}'
+                if not storage.exists(variant_name):
+                    output = flatten(resized) if image_format == 'JPEG' else resized
+                    buffer = io.BytesIO()
+                    output.save(buffer, image_format, **options)
+                    storage.save(variant_name, ContentFile(buffer.getvalue()))
+                manifest.setdefault(extension, {})[str(width)] = variant_name
+    return manifest
+
+def process_album_cover(album_id, name):
+    """
+    Generates the variants of an album's cover and stores their manifest,
+    unless the cover was replaced in the meantime.
+    """
+    try:
+        manifest = generate_variants(name)
+    except (OSError, UnidentifiedImageError, ValueError) as error:
+        logger.warning('Could not create variants of cover %s for album %s: %s', name, album_id, error)
+        return False
+    updated = Album.objects.filter(pk=album_id, cover_image=name).update(
+        cover_variants=manifest, updated_at=timezone.now()
+    )
+    if updated:
+        albums_touched.send(sender=Album, album_ids={album_id}, album_fields_changed=True)
+    return bool(updated)
+
+def schedule_album_cover(album_id, name):
+    """
+    Queues variant generation for the task queue. Saving the album again
+    before the variants are made does not queue the work twice.
+    """
+    return tasks.enqueue('process_album_cover', key=f'cover:{album_id}:{name}', album_id=album_id, name=name)
+
+def needs_variants(album):
+    return bool(album.cover_image) and album.cover_variants.get('source') != album.cover_image.name
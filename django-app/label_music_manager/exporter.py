@@ -0,0 +1,123 @@
+# Streaming catalogue exporter used by the export endpoint and export_catalogue command
+import csv
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from .models import Album
+
+# Columns of CSV exports, one row per track. Albums without tracks get one
+# row with empty track columns.
+ALBUM_COLUMNS = [
+    'album_id', 'title', 'artist', 'format', 'price', 'release_date', 'description',
+    'track_count', 'total_playtime', 'updated_at',
+]
+TRACK_COLUMNS = ['position', 'song_id', 'song_title', 'song_length']
+
+def get_export_queryset(filters):
+    """
+    Returns the albums matching filters validated by ExportFilterSerializer.
+    """
+    queryset = Album.objects.all()
+    lookups = {
+        'artist': 'artist',
+        'format': 'format',
+        'released_after': 'release_date__gte',
+        'released_before': 'release_date__lte',
+        'modified_since': 'updated_at__gte',
+    }
+    for name, lookup in lookups.items():
+        if name in filters:
+            queryset = queryset.filter(**{lookup: filters[name]})
+    return queryset
+
+def iter_chunks(queryset, chunk_size=500):
+    """
+    Yields lists of albums in ID order with their tracklists prefetched,
+    one chunk of albums and one of tracklist rows at a time. Each chunk is
+    a separate keyset query, so no read stays open between chunks while
+    a slow client downloads the export, and memory stays flat.
+    """
+    last_id = 0
+    queryset = queryset.with_tracklist().order_by('id')
+    while True:
+        albums = list(queryset.filter(id__gt=last_id)[:chunk_size])
+        if albums:
+            yield albums
+        if len(albums) < chunk_size:
+            return
+        last_id = albums[-1].id
+
+def get_album_record(album):
+    return {
+        'id': album.id,
+        'title': album.title,
+        'artist': album.artist,
+        'format': album.format,
+        'price': album.price,
+        'release_date': album.release_date,
+        'description': album.description,
+        'track_count': album.track_count,
+        'total_playtime': album.total_playtime,
+        'updated_at': album.updated_at,
+        'tracks': [
+            {'position': item.position, 'id': item.song.id, 'title': item.song.title, 'length': item.song.length}
+            for item in album.tracklist_items
+        ],
+    }
+
+def write_ndjson(chunks):
+    """
+    Yields one JSON album per line, with its tracks in order, per chunk.
+    """
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    for albums in chunks:
+        yield ''.join(encoder.encode(get_album_record(album)) + '\n' for album in albums)
+
+class LineBuffer:
+    """
+    File-like object handing back what csv.writer writes, so rows can be streamed.
+    """
+    def write(self, value):
+        return value
+
+def write_csv(chunks):
+    """
+    Yields the header, then the CSV rows of each chunk.
+    """
+    writer = csv.writer(LineBuffer())
+    yield writer.writerow(ALBUM_COLUMNS + TRACK_COLUMNS)
+    for albums in chunks:
+        rows = []
+        for album in albums:
+            album_row = [
+                album.id, album.title, album.artist, album.format, album.price, album.release_date.isoformat(),
+                album.description, album.track_count, album.total_playtime, album.updated_at.isoformat(),
+            ]
+            track_rows = [
+                [item.position, item.song.id, item.song.title, item.song.length] for item in album.tracklist_items
+            ]
+            for track_row in track_rows or [[''] * len(TRACK_COLUMNS)]:
+                rows.append(writer.writerow(album_row + track_row))
+        yield ''.join(rows)
+
+# Output formats and their content types
+WRITERS = {
+    'ndjson': ('application/x-ndjson', write_ndjson),
+    'csv': ('text/csv', write_csv),
+}
+
+def export(filters, export_format, chunk_size=500):
+    """
+    Returns an iterator of text chunks exporting the filtered albums.
+    """
+    return WRITERS[export_format][1](iter_chunks(get_export_queryset(filters), chunk_size))
+
+async def aexport(filters, export_format, chunk_size=500):
+    """
+    Yields the chunks of export() asynchronously, for ASGI servers, which
+    would otherwise read a sync iterator to its end before sending it.
+    Each chunk is read in the thread sync_to_async keeps for the request.
+    """
+    chunks = export(filters, export_format, chunk_size)
+    done = object()
+    while (chunk := await sync_to_async(next)(chunks, done)) is not done:
+        yield chunk
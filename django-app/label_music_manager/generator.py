@@ -0,0 +1,204 @@
+# Reproducible synthetic catalogues for load testing and benchmarks
+import math
+import random
+from array import array
+from datetime import date, timedelta
+from decimal import Decimal
+from django.contrib.auth.models import Permission, User
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.text import slugify
+from . import catalogue_cache, search
+from . import stats as catalogue_stats
+from .models import Album, AlbumTracklistItem, MusicManagerUser, Song
+
+WORDS = [
+    'amber', 'blue', 'broken', 'city', 'crimson', 'dawn', 'distant', 'echo', 'electric', 'empty',
+    'fire', 'garden', 'ghost', 'glass', 'golden', 'harbour', 'hollow', 'iron', 'kingdom', 'light',
+    'lost', 'midnight', 'mirror', 'neon', 'night', 'ocean', 'paper', 'quiet', 'river', 'satellite',
+    'shadow', 'silver', 'sky', 'static', 'stone', 'summer', 'thunder', 'velvet', 'wild', 'winter',
+]
+
+class CatalogueGenerator:
+    """
+    Builds the same catalogue for the same sizes and seed.
+    Albums per artist follow a Zipf distribution and tracklist lengths a
+    log-normal one, so a few artists and albums are much larger than the
+    rest, as in a real label. Songs are assigned to albums in order and
+    wrap around, so catalogues with more tracks than songs reuse songs.
+    """
+    def __init__(self, albums=1000, songs=20000, artists=100, seed=0, max_tracks=200):
+        self.album_count = albums
+        self.song_count = songs
+        self.artist_count = artists
+        self.seed = seed
+        self.max_tracks = max_tracks
+
+    def get_random(self, stream):
+        # Independent streams keep each part stable when another part's size changes
+        return random.Random(f'{self.seed}:{stream}')
+
+    def title(self, rng, words=3):
+        return ' '.join(rng.choice(WORDS) for _ in range(words)).title()
+
+    def artist_names(self):
+        return [f'Artist {index:05d}' for index in range(self.artist_count)]
+
+    def track_counts(self):
+        """
+        Returns the tracklist length of each album, averaging songs / albums.
+        """
+        rng = self.get_random('tracks')
+        mean = max(1, self.song_count / max(1, self.album_count))
+        sigma = 0.9
+        mu = math.log(mean) - sigma ** 2 / 2
+        return [
+            min(self.max_tracks, max(1, round(rng.lognormvariate(mu, sigma))))
+            for _ in range(self.album_count)
+        ]
+
+    def albums(self):
+        rng = self.get_random('albums')
+        artists = self.artist_names()
+        weights = [1 / (rank + 1) for rank in range(len(artists))]
+        today = date.today()
+        for index, artist in enumerate(rng.choices(artists, weights=weights, k=self.album_count)):
+            title = f'{self.title(rng)} {index}'
+            yield Album(
+                title=title,
+                slug=slugify(title),
+                description=' '.join(rng.choice(WORDS) for _ in range(rng.randint(5, 60))).capitalize(),
+                artist=artist,
+                price=Decimal(rng.randint(199, 4999)) / 100,
+                format=rng.choice(Album.FORMAT_CHOICES)[0],
+                release_date=today - timedelta(days=rng.randint(0, 30 * 365)),
+            )
+
+    def songs(self):
+        """
+        Yields (title, length) pairs.
+        """
+        rng = self.get_random('songs')
+        for index in range(self.song_count):
+            yield f'{self.title(rng, rng.randint(1, 4))} {index}', rng.randint(60, 600)
+
+    def records(self, prefix='Generated'):
+        """
+        Yields the catalogue as importer records, e.g. to time the importer.
+        """
+        albums = list(self.albums())
+        for album in albums:
+            yield 'album', {
+                'title': f'{prefix} {album.title}', 'artist': album.artist, 'description': album.description,
+                'price': str(album.price), 'format': album.format, 'release_date': album.release_date.isoformat(),
+            }
+        counts = self.track_counts()
+        songs = self.songs()
+        for album, count in zip(albums, counts):
+            for _ in range(count):
+                song = next(songs, None)
+                if song is None:
+                    return
+                yield 'song', {'title': song[0], 'length': song[1], 'albums': [f'{prefix} {album.title}']}
+
+    def create_profiles(self):
+        """
+        Creates a user with the Artist role and a profile for every artist.
+        """
+        users = User.objects.bulk_create(
+            [User(username=slugify(name), password='!') for name in self.artist_names()],
+            ignore_conflicts=True,
+        )
+        users = User.objects.filter(username__in=[user.username for user in users]).order_by('username')
+        artist = Permission.objects.get(codename='Artist')
+        User.user_permissions.through.objects.bulk_create(
+            [User.user_permissions.through(user_id=user.pk, permission_id=artist.pk) for user in users],
+            ignore_conflicts=True,
+        )
+        names = dict(zip([slugify(name) for name in self.artist_names()], self.artist_names()))
+        MusicManagerUser.objects.bulk_create(
+            [MusicManagerUser(user=user, display_name=names[user.username]) for user in users],
+            ignore_conflicts=True,
+        )
+
+    def write(self, batch_size=5000, progress=None):
+        """
+        Writes the catalogue with bulk inserts, then links owners and
+        rebuilds the search index and catalogue stats. Returns the number
+        of rows written.
+        """
+        progress = progress or (lambda message: None)
+        stats = {'albums': 0, 'songs': 0, 'tracklist_items': 0}
+        with transaction.atomic():
+            self.create_profiles()
+
+            # IDs are kept in compact arrays, as there may be millions of songs
+            album_ids = array('q')
+            for batch in batched(self.albums(), batch_size):
+                album_ids.extend(album.pk for album in Album.objects.bulk_create(batch))
+            stats['albums'] = len(album_ids)
+            progress(f"{stats['albums']} albums")
+
+            # Songs and tracklist items are inserted without model instances,
+            # which would dominate the time taken for millions of rows
+            last_song_id = Song.objects.aggregate(last=Max('id'))['last'] or 0
+            updated_at = connection.ops.adapt_datetimefield_value(timezone.now())
+            for batch in batched(self.songs(), batch_size):
+                insert_rows(Song, ['title', 'length', 'updated_at'], [row + (updated_at,) for row in batch])
+                stats['songs'] += len(batch)
+                progress(f"{stats['songs']} songs")
+            song_ids = array('q', Song.objects.filter(id__gt=last_song_id).order_by('id')
+                             .values_list('id', flat=True).iterator())
+
+            def tracklist_items():
+                song_index = 0
+                for album_id, count in zip(album_ids, self.track_counts()):
+                    # Each album takes the next songs, wrapping around at the end
+                    for position in range(1, min(count, len(song_ids)) + 1):
+                        yield album_id, song_ids[song_index % len(song_ids)], position
+                        song_index += 1
+
+            if album_ids and song_ids:
+                for batch in batched(tracklist_items(), batch_size):
+                    insert_rows(AlbumTracklistItem, ['album_id', 'song_id', 'position'], batch)
+                    stats['tracklist_items'] += len(batch)
+                progress(f"{stats['tracklist_items']} tracklist items")
+
+            # Bulk inserts bypass the signals maintaining these
+            Album.objects.refresh_aggregates()
+            Album.objects.link_owners()
+        search.rebuild()
+        catalogue_stats.rebuild()
+        catalogue_cache.invalidate_lists()
+        return stats
+
+def clear_catalogue():
+    """
+    Deletes every album, song and tracklist item.
+    """
+    with transaction.atomic():
+        AlbumTracklistItem.objects.all().delete()
+        Album.objects.all().delete()
+        Song.objects.all().delete()
+
+def insert_rows(model, columns, rows):
+    """
+    Inserts rows of column values with one prepared statement.
+    """
+    quote = connection.ops.quote_name
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        quote(model._meta.db_table), ', '.join(quote(column) for column in columns), ', '.join(['%s'] * len(columns))
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+def batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,407 @@
+# Bulk catalogue importer used by the bulk_import and seed management commands
+import csv
+import io
+import json
+import time
+from datetime import date
+from decimal import Decimal
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.utils.text import slugify
+from . import changes, search
+from .models import Album, Song, AlbumTracklistItem, Change, albums_touched
+
+# Accept both format codes ('VL') and their display names ('Vinyl')
+FORMAT_CODES = {}
+for code, label in Album.FORMAT_CHOICES:
+    FORMAT_CODES[code.lower()] = code
+    FORMAT_CODES[label.lower()] = code
+
+# Top-level JSON sections and the record kind they contain
+JSON_SECTIONS = {'albums': 'album', 'songs': 'song', 'tracklists': 'tracklist'}
+
+def read_json(stream, chunk_size=64 * 1024):
+    """
+    Streams a {"albums": [...], "songs": [...], "tracklists": [...]} document
+    one record at a time, so the whole file is never held in memory.
+    Yields (kind, record) pairs.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    eof = False
+
+    def fill():
+        nonlocal buffer, position, eof
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            eof = True
+        buffer = buffer[position:] + chunk
+        position = 0
+
+    def peek():
+        # Skip whitespace and return the next character, or '' at the end of input
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position].isspace():
+                position += 1
+            if position < len(buffer):
+                return buffer[position]
+            if eof:
+                return ''
+            fill()
+
+    def expect(char):
+        nonlocal position
+        if peek() != char:
+            raise ValueError(f'Expected "{char}" at offset {position} of the JSON input')
+        position += 1
+
+    def decode():
+        # Decode one value, reading more input while the value is incomplete
+        nonlocal position
+        while True:
+            peek()
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                fill()
+                continue
+            # A number ending exactly at the buffer boundary may be truncated
+            if end == len(buffer) and not eof:
+                fill()
+                continue
+            position = end
+            return value
+
+    expect('{')
+    while True:
+        char = peek()
+        if char == '}':
+            return
+        if char == ',':
+            position += 1
+            continue
+        key = decode()
+        expect(':')
+        kind = JSON_SECTIONS.get(key)
+        if peek() != '[':
+            # Ignore scalar or object sections we do not know about
+            decode()
+            continue
+        expect('[')
+        while True:
+            char = peek()
+            if char == ']':
+                position += 1
+                break
+            if char == ',':
+                position += 1
+                continue
+            record = decode()
+            if kind:
+                yield kind, record
+
+def read_ndjson(stream):
+    """
+    Reads one JSON object per line, each with a "type" of album, song or tracklist.
+    """
+    for line in stream:
+        line = line.strip()
+        if line:
+            record = json.loads(line)
+            # Lines without a type, or that are not objects, are left for
+            # the importer to skip
+            if not isinstance(record, dict):
+                yield None, record
+                continue
+            yield record.pop('type', None), record
+
+def read_csv(stream):
+    """
+    Reads a CSV file with a "type" column. Empty cells are ignored and a
+    song's album titles are separated by "|".
+    """
+    for row in csv.DictReader(stream):
+        record = {key: value for key, value in row.items() if value not in (None, '')}
+        if 'albums' in record:
+            record['albums'] = [title for title in record['albums'].split('|') if title]
+        yield record.pop('type', None), record
+
+READERS = {
+    'json': read_json,
+    'ndjson': read_ndjson,
+    'csv': read_csv,
+}
+
+class CatalogueImporter:
+    """
+    Imports albums, songs and tracklist items in batches.
+    Each batch is written with a handful of bulk queries inside one transaction.
+    Album titles are resolved through an in-memory index rather than one
+    query per song, and albums and tracklist items are upserted on their
+    unique_together keys, so re-importing a file updates rather than duplicates.
+    """
+    def __init__(self, batch_size=1000, warn=None, progress=None):
+        self.batch_size = batch_size
+        self.warn = warn or (lambda message: None)
+        self.progress = progress or (lambda stats: None)
+        self.album_index = {}
+        self.song_index = {}
+        self.positions = {}
+        self.pending_albums = {}
+        self.pending_songs = []
+        self.pending_tracklists = []
+        self.stats = {'albums': 0, 'songs': 0, 'tracklist_items': 0, 'skipped': 0}
+        self.started = None
+
+    def run(self, records):
+        """
+        Imports (kind, record) pairs and returns the import statistics.
+        """
+        self.started = time.monotonic()
+        handlers = {
+            'album': self.add_album,
+            'song': self.add_song,
+            'tracklist': self.add_tracklist,
+        }
+        for kind, record in records:
+            handler = handlers.get(kind)
+            if kind is None:
+                self.skip(f'Record without a type: {record!r}')
+                continue
+            if handler is None:
+                self.skip(f'Unknown record type "{kind}".')
+                continue
+            try:
+                handler(record)
+            # Records hold whatever the file did, e.g. a null or numeric format
+            except (KeyError, ValueError, ArithmeticError, AttributeError, TypeError) as error:
+                self.skip(f'Invalid {kind} record {record!r}: {error!r}')
+                continue
+            if self.pending_count() >= self.batch_size:
+                self.flush()
+        self.flush()
+        return self.get_stats()
+
+    def skip(self, message):
+        self.stats['skipped'] += 1
+        self.warn(message)
+
+    def pending_count(self):
+        return len(self.pending_albums) + len(self.pending_songs) + len(self.pending_tracklists)
+
+    def get_stats(self):
+        elapsed = time.monotonic() - self.started if self.started else 0
+        rows = self.stats['albums'] + self.stats['songs'] + self.stats['tracklist_items']
+        return {
+            **self.stats,
+            'rows': rows,
+            'seconds': elapsed,
+            'rows_per_second': rows / elapsed if elapsed else 0,
+        }
+
+    def add_album(self, record):
+        title = record['title']
+        album_format = FORMAT_CODES[record['format'].lower()]
+        release_date = record['release_date']
+        if isinstance(release_date, str):
+            release_date = date.fromisoformat(release_date)
+        album = Album(
+            title=title,
+            slug=slugify(title),
+            description=record.get('description', ''),
+            artist=record['artist'],
+            price=Decimal(str(record['price'])),
+            format=album_format,
+            release_date=release_date,
+            cover_image=record.get('cover') or record.get('cover_image') or 'no_cover.jpg',
+        )
+        # The last record wins when a batch repeats an album
+        self.pending_albums[(title, album.artist, album_format)] = album
+
+    def add_song(self, record):
+        length = int(record['runtime'] if 'runtime' in record else record['length'])
+        self.pending_songs.append((record['title'], length, list(record.get('albums', []))))
+
+    def add_tracklist(self, record):
+        position = record.get('position')
+        self.pending_tracklists.append((
+            record['album'], record['song'], int(position) if position is not None else None
+        ))
+
+    def flush(self):
+        if not self.pending_count():
+            return
+        with transaction.atomic():
+            self.flush_albums()
+            tracklist = self.flush_songs()
+            tracklist.extend(self.resolve_tracklists())
+            self.flush_tracklist(tracklist)
+        self.progress(self.get_stats())
+
+    def flush_albums(self):
+        albums = list(self.pending_albums.values())
+        self.pending_albums = {}
+        if not albums:
+            return
+        Album.objects.bulk_create(
+            albums,
+            batch_size=self.batch_size,
+            update_conflicts=True,
+            unique_fields=['title', 'artist', 'format'],
+            update_fields=['description', 'price', 'release_date', 'cover_image', 'slug', 'updated_at'],
+        )
+        self.stats['albums'] += len(albums)
+        self.index_albums({album.title for album in albums}, refresh=True)
+        # Upserts bypass post_save, and already set updated_at. The upsert
+        # returns the IDs of the rows it wrote, so albums of other artists
+        # with the same titles are left alone.
+        album_ids = {album.pk for album in albums}
+        Album.objects.filter(pk__in=album_ids).link_owners()
+        albums_touched.send(sender=Album, album_ids=album_ids, album_fields_changed=True)
+
+    def index_albums(self, titles, refresh=False):
+        """
+        Adds albums with the given titles to the title index.
+        Titles already indexed are only looked up again when refresh is set.
+        """
+        if not refresh:
+            titles = {title for title in titles if title not in self.album_index}
+        if not titles:
+            return
+        for title in titles:
+            self.album_index[title] = set()
+        rows = Album.objects.filter(title__in=titles).values_list('id', 'title')
+        for album_id, title in rows.iterator():
+            self.album_index[title].add(album_id)
+
+    def flush_songs(self):
+        """
+        Creates the pending songs, reusing existing songs with the same title
+        and length, and returns their (album ID, song ID, position) tracklist rows.
+        """
+        songs = self.pending_songs
+        self.pending_songs = []
+        if not songs:
+            return []
+
+        existing = {}
+        rows = Song.objects.filter(title__in={title for title, _, _ in songs}).values_list('id', 'title', 'length')
+        for song_id, title, length in rows.iterator():
+            existing.setdefault((title, length), song_id)
+
+        new_songs = {}
+        for title, length, _ in songs:
+            if (title, length) not in existing and (title, length) not in new_songs:
+                new_songs[(title, length)] = Song(title=title, length=length)
+        Song.objects.bulk_create(new_songs.values(), batch_size=self.batch_size)
+        for key, song in new_songs.items():
+            existing[key] = song.id
+        # Bulk inserts bypass the post_save signals that index songs for
+        # search and log their changes
+        search.index_songs(song.id for song in new_songs.values())
+        changes.record(Change.SONG, Change.CREATED, [song.id for song in new_songs.values()])
+        self.stats['songs'] += len(new_songs)
+
+        self.index_albums({title for _, _, album_titles in songs for title in album_titles})
+        tracklist = []
+        for title, length, album_titles in songs:
+            song_id = existing[(title, length)]
+            self.song_index[title] = song_id
+            for album_title in album_titles:
+                album_ids = self.album_index.get(album_title)
+                if not album_ids:
+                    self.warn(f'No albums found with title "{album_title}".')
+                for album_id in album_ids or ():
+                    tracklist.append((album_id, song_id, None))
+        return tracklist
+
+    def resolve_tracklists(self):
+        """
+        Resolves explicit tracklist records, given as album and song titles.
+        """
+        records = self.pending_tracklists
+        self.pending_tracklists = []
+        if not records:
+            return []
+
+        self.index_albums({album_title for album_title, _, _ in records})
+        missing = {song_title for _, song_title, _ in records if song_title not in self.song_index}
+        if missing:
+            rows = Song.objects.filter(title__in=missing).order_by('id').values_list('id', 'title')
+            for song_id, title in rows.iterator():
+                self.song_index.setdefault(title, song_id)
+
+        tracklist = []
+        for album_title, song_title, position in records:
+            album_ids = self.album_index.get(album_title)
+            song_id = self.song_index.get(song_title)
+            if not album_ids or song_id is None:
+                self.skip(f'Cannot resolve tracklist item "{album_title}" - "{song_title}".')
+                continue
+            for album_id in album_ids:
+                tracklist.append((album_id, song_id, position))
+        return tracklist
+
+    def flush_tracklist(self, tracklist):
+        """
+        Upserts tracklist items. Positions not given in the input follow the
+        order in which the album's tracks appear in the import.
+        """
+        items = {}
+        for album_id, song_id, position in tracklist:
+            if (album_id, song_id) in items:
+                continue
+            if position is None:
+                position = self.positions.get(album_id, 0) + 1
+            self.positions[album_id] = max(position, self.positions.get(album_id, 0))
+            items[(album_id, song_id)] = AlbumTracklistItem(album_id=album_id, song_id=song_id, position=position)
+        if not items:
+            return
+        AlbumTracklistItem.objects.bulk_create(
+            items.values(),
+            batch_size=self.batch_size,
+            update_conflicts=True,
+            unique_fields=['album', 'song'],
+            update_fields=['position'],
+        )
+        # Upserted, so new and existing items alike are logged as updated
+        changes.record(Change.TRACKLIST, Change.UPDATED, [item.pk for item in items.values()])
+        album_ids = {album_id for album_id, _ in items}
+        Album.objects.filter(pk__in=album_ids).refresh_aggregates()
+        Album.objects.touch(album_ids)
+        self.stats['tracklist_items'] += len(items)
+
+def get_upload_storage():
+    """
+    Returns the private storage of uploaded catalogue files, which no URL serves.
+    """
+    return FileSystemStorage(location=settings.IMPORT_UPLOAD_ROOT)
+
+def import_stored_file(name, input_format, batch_size=1000):
+    """
+    Task importing an uploaded file from the upload storage, which is
+    deleted once imported. Records are upserted, so a retried import does
+    not duplicate rows. Returns the import statistics and the first
+    warnings.
+    """
+    warnings = []
+
+    def warn(message):
+        if len(warnings) < 20:
+            warnings.append(message)
+
+    importer = CatalogueImporter(batch_size=batch_size, warn=warn)
+    storage = get_upload_storage()
+    with storage.open(name, 'rb') as stream:
+        stats = importer.run(READERS[input_format](io.TextIOWrapper(stream, encoding='utf-8', newline='')))
+    storage.delete(name)
+    return {**stats, 'warnings': warnings}
+
+def discard_stored_file(name, **arguments):
+    # Called when an import task has failed for good, so its upload is not kept
+    get_upload_storage().delete(name)
@@ -0,0 +1,107 @@
+# Compares API read throughput and tail latency of running servers under slow clients
+import asyncio
+import json
+import time
+from urllib.parse import urlsplit
+from django.core.management.base import BaseCommand, CommandError
+from label_music_manager.profiling import percentile
+
+class Command(BaseCommand):
+    help = (
+        'Load test running servers with many slow concurrent clients and report requests/sec '
+        'and latency percentiles, e.g. wsgi=http://127.0.0.1:8000/api/albums/ '
+        'asgi=http://127.0.0.1:8001/api/async/albums/ against gunicorn and uvicorn'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('targets', nargs='+', help='name=URL pairs to benchmark one after another')
+        parser.add_argument('--clients', type=int, default=100, help='Concurrent clients')
+        parser.add_argument('--requests', type=int, default=5, help='Requests made by each client')
+        parser.add_argument(
+            '--send-delay', type=float, default=0.05,
+            help='Seconds a client waits between sending each line of its request headers'
+        )
+        parser.add_argument(
+            '--read-delay', type=float, default=0.01,
+            help='Seconds a client waits between reading each chunk of the response'
+        )
+        parser.add_argument('--chunk-size', type=int, default=4096, help='Bytes read per chunk')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+
+    def handle(self, *args, **options):
+        targets = []
+        for target in options['targets']:
+            name, _, url = target.partition('=')
+            if not url or urlsplit(url).scheme != 'http':
+                raise CommandError(f'Expected name=http://host:port/path, got "{target}".')
+            targets.append((name, url))
+        if options['clients'] < 1 or options['requests'] < 1:
+            raise CommandError('--clients and --requests must be positive numbers.')
+
+        results = {name: asyncio.run(self.run_target(url, options)) for name, url in targets}
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f"{'target':<12}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:<12}{result['requests_per_second']:>10.1f}{result['p50_ms']:>10.1f}"
+                f"{result['p99_ms']:>10.1f}{result['errors']:>8}"
+            )
+
+    async def run_target(self, url, options):
+        latencies = []
+        errors = []
+        started = time.monotonic()
+        await asyncio.gather(*(
+            self.run_client(url, options, latencies, errors) for _ in range(options['clients'])
+        ))
+        elapsed = time.monotonic() - started
+        latencies.sort()
+        return {
+            'requests': len(latencies),
+            'errors': len(errors),
+            'seconds': elapsed,
+            'requests_per_second': len(latencies) / elapsed if elapsed else 0,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+            'first_error': errors[0] if errors else None,
+        }
+
+    async def run_client(self, url, options, latencies, errors):
+        for _ in range(options['requests']):
+            started = time.monotonic()
+            try:
+                status = await self.fetch(url, options)
+            except (OSError, asyncio.IncompleteReadError, IndexError, ValueError) as error:
+                errors.append(repr(error))
+                continue
+            if status != 200:
+                errors.append(f'HTTP {status}')
+                continue
+            latencies.append(time.monotonic() - started)
+
+    async def fetch(self, url, options):
+        """
+        Makes one request, trickling the request headers and reading the
+        response in small chunks. Returns the response status code.
+        """
+        parts = urlsplit(url)
+        reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+        try:
+            path = parts.path + (f'?{parts.query}' if parts.query else '')
+            # The empty last line ends the headers
+            lines = [f'GET {path or "/"} HTTP/1.1', f'Host: {parts.netloc}', 'Accept: application/json',
+                     'Connection: close', '']
+            for line in lines:
+                writer.write(f'{line}\r\n'.encode())
+                await writer.drain()
+                await asyncio.sleep(options['send_delay'])
+
+            status_line = await reader.readline()
+            while await reader.read(options['chunk_size']):
+                await asyncio.sleep(options['read_delay'])
+            return int(status_line.split()[1])
+        finally:
+            writer.close()
@@ -0,0 +1,49 @@
+# Compares album serialization throughput of AlbumSerializer and AlbumReader
+import json
+from django.core.management.base import BaseCommand, CommandError
+from label_music_manager.benchmarks import SCALES, BenchmarkError, benchmark_serializers, temporary_database
+from label_music_manager.generator import CatalogueGenerator, clear_catalogue
+
+class Command(BaseCommand):
+    help = (
+        'Render every album of a generated catalogue with its tracks through the DRF serializers and '
+        'through the fast read path, check the output is identical and report albums per second'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scale', choices=list(SCALES), default='medium',
+            help='Catalogue size; medium has 10,000 albums'
+        )
+        parser.add_argument('--repeats', type=int, default=5, help='Timed runs of each serializer')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the generated catalogue')
+        parser.add_argument(
+            '--in-place', action='store_true',
+            help='Use the configured database instead of a temporary one, replacing its catalogue'
+        )
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+
+    def handle(self, *args, **options):
+        if options['repeats'] < 1:
+            raise CommandError('--repeats must be a positive number.')
+        generator = CatalogueGenerator(**SCALES[options['scale']], seed=options['seed'])
+        try:
+            if options['in_place']:
+                clear_catalogue()
+                generator.write()
+                results = benchmark_serializers(options['repeats'])
+            else:
+                with temporary_database():
+                    generator.write()
+                    results = benchmark_serializers(options['repeats'])
+        except BenchmarkError as error:
+            raise CommandError(str(error))
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f"{'path':<12}{'ms':>10}{'albums/s':>12}")
+        for name, result in results.items():
+            self.stdout.write(f"{name:<12}{result['ms']:>10.1f}{result['albums_per_second']:>12}")
+        speedup = results['serializer']['ms'] / results['reader']['ms']
+        self.stdout.write(self.style.SUCCESS(f'The reader is {speedup:.1f}x faster.'))
@@ -0,0 +1,54 @@
+# Bulk loads albums, songs and tracklists from JSON, NDJSON or CSV files
+import os
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from label_music_manager.importer import CatalogueImporter, READERS
+
+class Command(BaseCommand):
+    help = 'Stream albums, songs and tracklists from a JSON, NDJSON or CSV file into the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import, or - to read from standard input')
+        parser.add_argument(
+            '--format', choices=sorted(READERS),
+            help='Input format. Defaults to the file extension.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of records written per transaction'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        input_format = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if input_format not in READERS:
+            raise CommandError(f'Cannot infer the input format of "{path}". Use --format.')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be a positive number.')
+
+        verbosity = options['verbosity']
+        importer = CatalogueImporter(
+            batch_size=options['batch_size'],
+            warn=lambda message: self.stdout.write(self.style.WARNING(message)),
+            progress=lambda stats: verbosity > 1 and self.stdout.write(self.format_stats(stats)),
+        )
+
+        try:
+            if path == '-':
+                stats = importer.run(READERS[input_format](sys.stdin))
+            else:
+                with open(path, 'r', encoding='utf-8', newline='') as stream:
+                    stats = importer.run(READERS[input_format](stream))
+        except FileNotFoundError:
+            raise CommandError(f'File not found: {path}')
+        except ValueError as error:
+            raise CommandError(f'Could not parse {path}: {error}')
+
+        self.stdout.write(self.style.SUCCESS(self.format_stats(stats)))
+
+    def format_stats(self, stats):
+        return (
+            f"Imported {stats['albums']} albums, {stats['songs']} songs and "
+            f"{stats['tracklist_items']} tracklist items ({stats['skipped']} skipped) "
+            f"in {stats['seconds']:.2f}s ({stats['rows_per_second']:.0f} rows/s)"
+        )
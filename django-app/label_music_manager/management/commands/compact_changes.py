@@ -0,0 +1,24 @@
+# Trims old entries from the change log read by /api/changes/
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from label_music_manager import changes
+
+class Command(BaseCommand):
+    help = (
+        'Delete change log entries older than the retention period. Clients whose cursor is older '
+        'are told to download the catalogue again.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=float, default=settings.CHANGE_LOG_RETENTION,
+            help='Keep the entries of this many days'
+        )
+
+    def handle(self, *args, **options):
+        if options['days'] < 0:
+            raise CommandError('--days must not be negative.')
+        removed = changes.compact(timezone.now() - timedelta(days=options['days']))
+        self.stdout.write(self.style.SUCCESS(f'Removed {removed} change log entries.'))
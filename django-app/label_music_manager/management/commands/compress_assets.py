@@ -0,0 +1,41 @@
+# Writes brotli and gzip copies of static and React build files, for serving without compressing per request
+import os
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from label_music_manager.compression import brotli, compress_directory
+
+class Command(BaseCommand):
+    help = (
+        'Precompress the collected static files and the React build. Compressible files get .br '
+        '(with the brotli package installed) and .gz copies, which PrecompressedStaticMiddleware '
+        'serves by Accept-Encoding. Run after collectstatic and npm run build.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'directories', nargs='*',
+            help='Directories to compress. Defaults to STATIC_ROOT and SPA_BUILD_DIR.'
+        )
+        parser.add_argument(
+            '--min-size', type=int, default=settings.COMPRESSION_MIN_SIZE,
+            help='Files smaller than this many bytes are left uncompressed'
+        )
+
+    def handle(self, *args, **options):
+        directories = options['directories'] or [
+            directory for directory in (settings.STATIC_ROOT, settings.SPA_BUILD_DIR) if os.path.isdir(directory)
+        ]
+        missing = [str(directory) for directory in directories if not os.path.isdir(directory)]
+        if missing:
+            raise CommandError(f"Not a directory: {', '.join(missing)}")
+        if not directories:
+            raise CommandError('Nothing to compress. Run collectstatic or npm run build first.')
+        if brotli is None:
+            self.stdout.write(self.style.WARNING('The brotli package is not installed; writing .gz copies only.'))
+
+        for directory in directories:
+            written = compress_directory(directory, options['min_size'])
+            self.stdout.write(
+                f'{directory}: wrote {len(written)} compressed copies, '
+                f'{sum(written.values()) // 1024} KB smaller than the originals'
+            )
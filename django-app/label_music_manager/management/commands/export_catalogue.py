@@ -0,0 +1,46 @@
+# Exports albums with their tracklists as NDJSON or CSV, a chunk at a time
+from django.core.management.base import BaseCommand, CommandError
+from label_music_manager import exporter
+from label_music_manager.serializers import ExportFilterSerializer
+
+class Command(BaseCommand):
+    help = (
+        'Write albums and their ordered tracklists as NDJSON or CSV to a file or stdout, '
+        'reading a chunk of albums at a time so memory stays flat for any catalogue size'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=list(exporter.WRITERS), default='ndjson', help='Output format')
+        parser.add_argument('--output', help='File to write. Defaults to stdout.')
+        parser.add_argument('--artist', help='Only albums by this artist')
+        parser.add_argument('--album-format', help='Only albums of this format, e.g. CD or Vinyl')
+        parser.add_argument('--released-after', help='Only albums released on or after this date')
+        parser.add_argument('--released-before', help='Only albums released on or before this date')
+        parser.add_argument('--modified-since', help='Only albums changed at or after this time')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Albums read per query')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be a positive number.')
+        data = {
+            'artist': options['artist'],
+            'format': options['album_format'],
+            'released_after': options['released_after'],
+            'released_before': options['released_before'],
+            'modified_since': options['modified_since'],
+        }
+        filters = ExportFilterSerializer(data={name: value for name, value in data.items() if value is not None})
+        if not filters.is_valid():
+            errors = '; '.join(f"{name}: {' '.join(messages)}" for name, messages in filters.errors.items())
+            raise CommandError(f'Invalid filters: {errors}')
+
+        chunks = exporter.export(filters.validated_data, options['format'], options['chunk_size'])
+        if not options['output']:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+        # newline='' so csv's \r\n line endings are written unchanged
+        with open(options['output'], 'w', encoding='utf-8', newline='') as stream:
+            for chunk in chunks:
+                stream.write(chunk)
+        self.stderr.write(self.style.SUCCESS(f"Exported the albums to {options['output']}"))
@@ -0,0 +1,45 @@
+# Generates a reproducible synthetic catalogue of configurable size
+import time
+from django.core.management.base import BaseCommand, CommandError
+from label_music_manager.generator import CatalogueGenerator, clear_catalogue
+from label_music_manager.models import Album
+
+class Command(BaseCommand):
+    help = 'Fill the database with a reproducible synthetic catalogue, e.g. --albums 10000 --songs 1000000'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--albums', type=int, default=1000, help='Number of albums')
+        parser.add_argument('--songs', type=int, default=20000, help='Number of songs')
+        parser.add_argument('--artists', type=int, default=100, help='Number of artists, each with a profile')
+        parser.add_argument('--max-tracks', type=int, default=200, help='Longest tracklist')
+        parser.add_argument('--seed', type=int, default=0, help='Seed; the same seed gives the same catalogue')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per insert')
+        parser.add_argument('--clear', action='store_true', help='Delete existing albums and songs first')
+
+    def handle(self, *args, **options):
+        for name in ('albums', 'songs', 'artists', 'max_tracks', 'batch_size'):
+            if options[name] < (0 if name in ('albums', 'songs') else 1):
+                raise CommandError(f"--{name.replace('_', '-')} is out of range.")
+
+        if options['clear']:
+            clear_catalogue()
+        elif Album.objects.exists():
+            raise CommandError('The database already has albums. Use --clear to replace them.')
+
+        generator = CatalogueGenerator(
+            albums=options['albums'],
+            songs=options['songs'],
+            artists=options['artists'],
+            seed=options['seed'],
+            max_tracks=options['max_tracks'],
+        )
+        started = time.monotonic()
+        verbosity = options['verbosity']
+        stats = generator.write(
+            batch_size=options['batch_size'],
+            progress=lambda message: verbosity > 1 and self.stdout.write(message),
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {stats['albums']} albums, {stats['songs']} songs and "
+            f"{stats['tracklist_items']} tracklist items in {time.monotonic() - started:.2f}s"
+        ))
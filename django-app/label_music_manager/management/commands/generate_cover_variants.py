@@ -0,0 +1,46 @@
+# Creates the resized WebP and JPEG variants of existing album covers
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from label_music_manager import covers
+from label_music_manager.models import Album
+
+class Command(BaseCommand):
+    help = 'Generate responsive cover image variants for albums that do not have them yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Regenerate the variants of every album, not only the missing ones'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Number of covers processed in parallel'
+        )
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError('--workers must be a positive number.')
+
+        albums = Album.objects.exclude(cover_image='').only('id', 'cover_image', 'cover_variants')
+        pending = [
+            (album.pk, album.cover_image.name)
+            for album in albums.iterator()
+            if options['force'] or covers.needs_variants(album)
+        ]
+
+        if options['workers'] == 1:
+            results = [covers.process_album_cover(album_id, name) for album_id, name in pending]
+        else:
+            with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+                results = list(executor.map(lambda args: self.process(*args), pending))
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated cover variants for {sum(results)} of {len(pending)} albums'
+        ))
+
+    def process(self, album_id, name):
+        try:
+            return covers.process_album_cover(album_id, name)
+        finally:
+            close_old_connections()
@@ -0,0 +1,23 @@
+# Backfills Album.owner from the artist name of albums created before it existed
+from django.core.management.base import BaseCommand
+from label_music_manager import catalogue_cache
+from label_music_manager.models import Album
+
+class Command(BaseCommand):
+    help = 'Link albums without an owner to the artist profile with a matching display name'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--relink', action='store_true',
+            help='Clear every existing owner first, e.g. after renaming profiles'
+        )
+
+    def handle(self, *args, **options):
+        if options['relink']:
+            Album.objects.exclude(owner=None).update(owner=None)
+        linked = Album.objects.link_owners()
+        catalogue_cache.invalidate_lists()
+        unowned = Album.objects.filter(owner=None).count()
+        self.stdout.write(self.style.SUCCESS(
+            f'Linked {linked} albums to their artist profiles ({unowned} albums have no matching profile)'
+        ))
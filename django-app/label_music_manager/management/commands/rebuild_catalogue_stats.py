@@ -0,0 +1,40 @@
+# Rebuilds or verifies the catalogue stats served by /api/stats/
+from django.core.management.base import BaseCommand, CommandError
+from label_music_manager import stats
+
+class Command(BaseCommand):
+    help = (
+        'Recount the catalogue stats by artist, format and release year from the albums, e.g. after bulk '
+        'inserts or raw SQL writes. Use --verify to only compare them with a live aggregate of the '
+        'albums and their tracklists.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true', help='Report stale stats and fail if there are any')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows written per query')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be a positive number.')
+
+        if options['verify']:
+            mismatches = stats.verify()
+            for dimension, key, stored, live in mismatches:
+                self.stdout.write(self.style.WARNING(
+                    f'{dimension} "{key}": {self.describe(stored)} stored, {self.describe(live)} live'
+                ))
+            if mismatches:
+                raise CommandError(
+                    f'{len(mismatches)} catalogue stats differ from the albums. Run rebuild_catalogue_stats.'
+                )
+            self.stdout.write(self.style.SUCCESS('All catalogue stats match the albums.'))
+            return
+
+        count = stats.rebuild(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} catalogue stats.'))
+
+    def describe(self, values):
+        if values is None:
+            return 'nothing'
+        album_count, track_count, total_playtime, total_price = values
+        return f'{album_count} albums, {track_count} tracks, {total_playtime}s, {total_price} total price'
@@ -0,0 +1,16 @@
+# Rebuilds the full-text search index from the album and song tables
+import time
+from django.core.management.base import BaseCommand, CommandError
+from label_music_manager import search
+
+class Command(BaseCommand):
+    help = 'Recreate the full-text search index of albums and songs'
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            raise CommandError('Full-text search needs the SQLite FTS5 extension.')
+        started = time.monotonic()
+        rows = search.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {rows} albums and songs in {time.monotonic() - started:.2f}s'
+        ))
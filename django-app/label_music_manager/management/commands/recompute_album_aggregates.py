@@ -0,0 +1,44 @@
+# Checks and repairs the stored track count and playtime of albums
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from label_music_manager.generator import batched
+from label_music_manager.models import Album
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the stored track count and total playtime of albums whose values differ from their '
+        'tracklists, e.g. after raw SQL or queryset updates of song lengths. Use --check to only report them.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='Report stale albums and fail if there are any')
+        parser.add_argument('--all', action='store_true', help='Recompute every album, not only stale ones')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Albums updated per query')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be a positive number.')
+
+        stale = Album.objects.inconsistent_aggregates().order_by('id')
+        if options['check']:
+            rows = list(stale.values_list(
+                'id', 'title', 'track_count', 'actual_track_count', 'total_playtime', 'actual_total_playtime'
+            ))
+            for album_id, title, tracks, actual_tracks, playtime, actual_playtime in rows:
+                self.stdout.write(self.style.WARNING(
+                    f'Album {album_id} "{title}": {tracks} tracks stored, {actual_tracks} actual; '
+                    f'{playtime}s playtime stored, {actual_playtime}s actual'
+                ))
+            if rows:
+                raise CommandError(f'{len(rows)} albums have stale aggregates. Run recompute_album_aggregates.')
+            self.stdout.write(self.style.SUCCESS('All album aggregates match their tracklists.'))
+            return
+
+        albums = Album.objects.order_by('id') if options['all'] else stale
+        album_ids = list(albums.values_list('id', flat=True))
+        for batch in batched(album_ids, options['batch_size']):
+            with transaction.atomic():
+                Album.objects.filter(pk__in=batch).refresh_aggregates()
+                # Cached payloads embed the aggregates
+                Album.objects.touch(batch)
+        self.stdout.write(self.style.SUCCESS(f'Recomputed the aggregates of {len(album_ids)} albums.'))
@@ -0,0 +1,102 @@
+# Benchmarks the templated views, API endpoints and importer at several catalogue sizes
+import json
+import platform
+import sqlite3
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from label_music_manager.benchmarks import (
+    BUDGETS_PATH, SCALES, BenchmarkError, CatalogueBenchmark, check_budgets, load_budgets, temporary_database,
+)
+from label_music_manager.generator import clear_catalogue
+
+class Command(BaseCommand):
+    help = (
+        'Time the album pages, API endpoints and importer against generated catalogues, '
+        'record wall time, query counts and peak memory, and fail when a budget is exceeded'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scale', action='append', choices=list(SCALES),
+            help='Catalogue size to benchmark; may be repeated. Defaults to small.'
+        )
+        parser.add_argument('--repeats', type=int, default=5, help='Timed runs of each scenario')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the generated catalogues')
+        parser.add_argument('--output', help='Write the results to this JSON file, e.g. as a new baseline')
+        parser.add_argument(
+            '--budgets', default=str(BUDGETS_PATH),
+            help='JSON file of budgets by scale, scenario and metric'
+        )
+        parser.add_argument('--no-budgets', action='store_true', help='Record the results without checking them')
+        parser.add_argument(
+            '--in-place', action='store_true',
+            help='Use the configured database instead of a temporary one, replacing its catalogue'
+        )
+
+    def handle(self, *args, **options):
+        scales = options['scale'] or ['small']
+        if options['repeats'] < 1:
+            raise CommandError('--repeats must be a positive number.')
+        budgets = {}
+        if not options['no_budgets']:
+            try:
+                budgets = load_budgets(options['budgets'])
+            except (OSError, ValueError) as error:
+                raise CommandError(f"Could not read the budgets in {options['budgets']}: {error}")
+
+        verbosity = options['verbosity']
+        results = {}
+        for scale in scales:
+            self.stdout.write(f"Generating the {scale} catalogue ({SCALES[scale]['albums']} albums, "
+                              f"{SCALES[scale]['songs']} songs)")
+            benchmark = CatalogueBenchmark(scale, repeats=options['repeats'], seed=options['seed'])
+            try:
+                results[scale] = self.run_benchmark(
+                    benchmark, options['in_place'],
+                    progress=lambda message: verbosity > 1 and self.stdout.write(message),
+                )
+            except BenchmarkError as error:
+                raise CommandError(str(error))
+            self.write_table(scale, results[scale])
+
+        if options['output']:
+            baseline = {
+                'created': timezone.now().isoformat(),
+                'seed': options['seed'],
+                'repeats': options['repeats'],
+                'environment': {
+                    'python': platform.python_version(),
+                    'django': django.get_version(),
+                    'sqlite': sqlite3.sqlite_version,
+                },
+                'scales': {scale: SCALES[scale] for scale in scales},
+                'results': results,
+            }
+            with open(options['output'], 'w', encoding='utf-8') as stream:
+                json.dump(baseline, stream, indent=2)
+            self.stdout.write(f"Wrote the results to {options['output']}")
+
+        violations = check_budgets(results, budgets)
+        if violations:
+            raise CommandError('Budgets exceeded:\n' + '\n'.join(violations))
+        self.stdout.write(self.style.SUCCESS('All scenarios are within budget.'))
+
+    def run_benchmark(self, benchmark, in_place, progress):
+        """
+        Runs a benchmark against a fresh temporary database, or against the
+        configured one after replacing its catalogue.
+        """
+        if in_place:
+            clear_catalogue()
+            benchmark.generate()
+            return benchmark.run(progress)
+
+        with temporary_database():
+            benchmark.generate()
+            return benchmark.run(progress)
+
+    def write_table(self, scale, results):
+        self.stdout.write(f"{scale:<24}{'ms':>10}{'queries':>10}{'peak KB':>10}")
+        for name, metrics in results.items():
+            self.stdout.write(f"  {name:<22}{metrics['ms']:>10.1f}{metrics['queries']:>10}{metrics['peak_kb']:>10}")
@@ -0,0 +1,35 @@
+# Runs the background task queue
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from label_music_manager import tasks
+
+class Command(BaseCommand):
+    help = (
+        'Run queued background tasks, such as cover variants, long deletes and tracklist writes and '
+        'uploaded imports, in a pool of worker processes and threads. Stops on SIGINT or SIGTERM once '
+        'the running tasks finish.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1, help='Worker processes')
+        parser.add_argument('--threads', type=int, default=2, help='Worker threads per process')
+        parser.add_argument(
+            '--poll-interval', type=float, default=settings.TASK_QUEUE_POLL_INTERVAL,
+            help='Seconds to wait before checking an empty queue again'
+        )
+        parser.add_argument('--burst', action='store_true', help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        if options['processes'] < 1 or options['threads'] < 1:
+            raise CommandError('--processes and --threads must be positive numbers.')
+
+        purged = tasks.purge(timezone.now() - timedelta(days=settings.TASK_QUEUE_RETENTION))
+        if purged:
+            self.stdout.write(f'Purged {purged} finished tasks.')
+        self.stdout.write(
+            f"Running {options['processes']} process(es) of {options['threads']} worker thread(s)"
+        )
+        tasks.run_workers(options['processes'], options['threads'], options['poll_interval'], options['burst'])
+        self.stdout.write(self.style.SUCCESS('Workers stopped.'))
@@ -0,0 +1,47 @@
+# Summarizes the request profiling log into per-endpoint latency percentiles
+import json
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from label_music_manager.profiling import read_log, summarize
+
+class Command(BaseCommand):
+    help = (
+        'Report request counts, p50/p95/p99 times and query counts per endpoint, estimated from the sampled '
+        'lines of the profiling log, with the number of slow requests and requests repeating queries'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default=settings.REQUEST_PROFILING_LOG,
+            help='Log file written by RequestProfilingMiddleware. Defaults to REQUEST_PROFILING_LOG.'
+        )
+        parser.add_argument(
+            '--sort', choices=['requests', 'p50_ms', 'p95_ms', 'p99_ms'], default='p95_ms',
+            help='Column to sort endpoints by, largest first'
+        )
+        parser.add_argument('--json', action='store_true', help='Print the summary as JSON')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['path'], encoding='utf-8') as stream:
+                summary = summarize(read_log(stream))
+        except FileNotFoundError:
+            raise CommandError(f"Log file not found: {options['path']}")
+
+        rows = sorted(summary.items(), key=lambda item: item[1][options['sort']], reverse=True)
+        if options['json']:
+            self.stdout.write(json.dumps(dict(rows), indent=2))
+            return
+        if not rows:
+            self.stdout.write('No requests logged.')
+            return
+        self.stdout.write(
+            f"{'endpoint':<40}{'requests':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+            f"{'queries':>10}{'slow':>6}{'N+1':>6}"
+        )
+        for endpoint, row in rows:
+            self.stdout.write(
+                f"{endpoint:<40}{row['requests']:>10}{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}"
+                f"{row['p99_ms']:>10.1f}{row['avg_sql_count']:>10.1f}{row['slow_requests']:>6}"
+                f"{row['duplicate_query_requests']:>6}"
+            )
@@ -1,10 +1,19 @@
 # Write your models here
 from datetime import date, timedelta
 from django.db import models
+from django.db.models import Count, F, OuterRef, Prefetch, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.utils import timezone
 from django.utils.text import slugify
 from django.core.exceptions import ValidationError
+from django.dispatch import Signal
+
+# Sent with album_ids when albums change through writes that bypass the
+# model signals. album_fields_changed is set when the album rows themselves
+# changed, rather than only their tracklist or songs.
+albums_touched = Signal()
 
 def validate_release_date(release_date):
     """
@@ -16,6 +25,86 @@ def validate_release_date(release_date):
         raise ValidationError(
             'Release date cannot be more than 3 years in the future')
 
+def get_cover_variants(cover_variants, cover_name, storage, extension='jpeg'):
+    """
+    Returns (URL, width) pairs of the variants stored in an album's
+    cover_variants for its cover_name, e.g. when reading values() rows.
+    """
+    if cover_variants.get('source') != cover_name:
+        return []
+    variants = cover_variants.get(extension, {})
+    return [
+        (storage.url(name), int(width))
+        for width, name in sorted(variants.items(), key=lambda item: int(item[0]))
+    ]
+
+def get_tracklist_aggregates():
+    """
+    Returns subqueries of an album's track count and total playtime,
+    computed from its tracklist, by field name.
+    """
+    items = AlbumTracklistItem.objects.filter(album=OuterRef('pk')).order_by().values('album')
+    return {
+        'track_count': Coalesce(Subquery(items.annotate(count=Count('pk')).values('count')), 0),
+        'total_playtime': Coalesce(Subquery(items.annotate(total=Sum('song__length')).values('total')), 0),
+    }
+
+class AlbumQuerySet(models.QuerySet):
+    def with_tracklist(self):
+        """
+        Prefetches the tracklist in position order, so any number of albums
+        and their tracks are read in two queries.
+        """
+        tracklist = AlbumTracklistItem.objects.select_related('song').order_by('position', 'id')
+        return self.prefetch_related(
+            Prefetch('albumtracklistitem_set', queryset=tracklist, to_attr='tracklist_items')
+        )
+
+    def refresh_aggregates(self):
+        """
+        Recomputes the stored track count and total playtime of these
+        albums from their tracklists in one query, e.g. after bulk writes.
+        Returns the number of albums updated.
+        """
+        return self.update(**get_tracklist_aggregates())
+
+    def add_to_aggregates(self, tracks, playtime):
+        """
+        Adjusts the stored aggregates of these albums by the given number of
+        tracks and seconds, which may be negative or an expression.
+        """
+        return self.update(track_count=F('track_count') + tracks, total_playtime=F('total_playtime') + playtime)
+
+    def inconsistent_aggregates(self):
+        """
+        Returns the albums whose stored aggregates differ from their tracklists.
+        """
+        return self.annotate(
+            actual_track_count=Count('albumtracklistitem'),
+            actual_total_playtime=Coalesce(Sum('albumtracklistitem__song__length'), 0),
+        ).exclude(track_count=F('actual_track_count'), total_playtime=F('actual_total_playtime'))
+
+    def touch(self, album_ids):
+        """
+        Marks the given albums as modified, e.g. after their tracklist changed,
+        and sends albums_touched so caches of their content can follow.
+        """
+        album_ids = set(album_ids)
+        if album_ids:
+            self.filter(pk__in=album_ids).update(updated_at=timezone.now())
+            albums_touched.send(sender=self.model, album_ids=album_ids)
+        return len(album_ids)
+
+    def link_owners(self):
+        """
+        Links albums without an owner to the artist profile whose display
+        name matches their artist, in one query. Returns the number linked.
+        """
+        profiles = MusicManagerUser.objects.filter(display_name=OuterRef('artist')).order_by('pk')
+        return self.filter(
+            owner=None, artist__in=MusicManagerUser.objects.values('display_name')
+        ).update(owner=Subquery(profiles.values('pk')[:1]))
+
 class Album(models.Model):
     FORMAT_CHOICES = [
         ('DD', 'Digital Download'),
@@ -27,6 +116,10 @@ class Album(models.Model):
     title = models.CharField(max_length=512, blank=False)
     description = models.TextField(blank=True)
     artist = models.CharField(max_length=512, blank=False)
+    # The artist profile the album belongs to, resolved from artist
+    owner = models.ForeignKey(
+        'MusicManagerUser', on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='albums'
+    )
     price = models.DecimalField(
         max_digits=5,
         decimal_places=2,
@@ -37,24 +130,91 @@ class Album(models.Model):
     release_date = models.DateField(validators=[validate_release_date])
     slug = models.SlugField(blank=True)
     tracks = models.ManyToManyField('Song', through='AlbumTracklistItem')
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    # Resized copies of cover_image by format and width, see covers.py
+    cover_variants = models.JSONField(default=dict, blank=True, editable=False)
+    # Kept in step with the tracklist and song lengths by signals.py,
+    # and by refresh_aggregates() after bulk writes
+    track_count = models.PositiveIntegerField(default=0, editable=False)
+    total_playtime = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = AlbumQuerySet.as_manager()
 
     def __str__(self):
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        album = super().from_db(db, field_names, values)
+        # Remember the stored artist and owner, so moving an album between
+        # artists can relink it and invalidate both artists' cached lists
+        album._loaded_artist = album.__dict__.get('artist')
+        album._loaded_owner_id = album.__dict__.get('owner_id')
+        return album
+
+    def get_cover_variants(self, extension='jpeg'):
+        """
+        Returns (URL, width) pairs of the cover's resized variants, or an empty
+        list while they have not been generated for the current cover.
+        """
+        return get_cover_variants(self.cover_variants, self.cover_image.name, self.cover_image.storage, extension)
+
+    def get_cover_srcset(self, extension='jpeg'):
+        return ', '.join(f'{url} {width}w' for url, width in self.get_cover_variants(extension))
+
+    @property
+    def cover_srcset(self):
+        return self.get_cover_srcset('jpeg')
+
+    @property
+    def cover_webp_srcset(self):
+        return self.get_cover_srcset('webp')
+
+    @property
+    def ordered_tracks(self):
+        """
+        Songs on the album in tracklist order.
+        Uses the tracklist prefetched by with_tracklist() when available.
+        """
+        items = getattr(self, 'tracklist_items', None)
+        if items is None:
+            items = self.albumtracklistitem_set.select_related('song').order_by('position', 'id')
+        return [item.song for item in items]
+
     def save(self, *args, **kwargs):
         self.slug = slugify(self.title)
+        # Link the album to the artist's profile when it is created or moved to another artist
+        loaded_artist = getattr(self, '_loaded_artist', None)
+        if (self._state.adding and self.owner_id is None) or (loaded_artist is not None and self.artist != loaded_artist):
+            self.owner_id = MusicManagerUser.objects.filter(
+                display_name=self.artist
+            ).order_by('pk').values_list('pk', flat=True).first()
         super().save(*args, **kwargs)
 
     class Meta:
         unique_together = ['title', 'artist', 'format']
+        indexes = [
+            models.Index(fields=['artist', 'release_date'], name='album_artist_release_idx'),
+            models.Index(fields=['format', 'release_date'], name='album_format_release_idx'),
+            models.Index(fields=['total_playtime'], name='album_playtime_idx'),
+            models.Index(fields=['track_count'], name='album_track_count_idx'),
+        ]
 
 class Song(models.Model):
     title = models.CharField(max_length=512, blank=False)
     length = models.PositiveIntegerField(blank=False, validators=[MinValueValidator(10)])
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        song = super().from_db(db, field_names, values)
+        # Remember the stored length, so albums' playtime can move by the difference
+        song._loaded_length = song.__dict__.get('length')
+        return song
+
 class AlbumTracklistItem(models.Model):
     album = models.ForeignKey(Album, on_delete=models.CASCADE)
     song = models.ForeignKey(Song, on_delete=models.CASCADE)
@@ -67,9 +227,17 @@ class AlbumTracklistItem(models.Model):
     def __str__(self):
         return f'{self.album.title} - {self.song.title}'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        item = super().from_db(db, field_names, values)
+        # Remember the stored album and song, so moving an item updates both albums' aggregates
+        item._loaded_album_id = item.__dict__.get('album_id')
+        item._loaded_song_id = item.__dict__.get('song_id')
+        return item
+
 class MusicManagerUser(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
-    display_name = models.CharField(max_length=512, blank=False)
+    display_name = models.CharField(max_length=512, blank=False, db_index=True)
 
     class Meta:
         permissions = [
@@ -80,3 +248,124 @@ class MusicManagerUser(models.Model):
 
     def __str__(self):
         return f'{self.user.username} [{self.display_name}]'
+
+class Task(models.Model):
+    """
+    A unit of background work, run by manage.py run_workers. Tasks are
+    written in the transaction that queues them, so work is never queued
+    for changes that roll back, nor lost once they commit.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+
+    name = models.CharField(max_length=100)
+    arguments = models.JSONField(default=dict)
+    # Queueing a task again under the same key returns the existing task
+    idempotency_key = models.CharField(max_length=255, unique=True, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    # The worker running the task, and when it claimed it. A task whose
+    # worker died is claimed again once TASK_QUEUE_LEASE seconds pass.
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'{self.name} #{self.pk} [{self.status}]'
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='task_status_run_after_idx'),
+        ]
+
+class Change(models.Model):
+    """
+    An entry of the append-only change log read by /api/changes/. SQLite
+    commits one writer at a time, so entries are numbered in commit order.
+    """
+    ALBUM = 'album'
+    SONG = 'song'
+    TRACKLIST = 'tracklist'
+    KIND_CHOICES = [
+        (ALBUM, 'Album'),
+        (SONG, 'Song'),
+        (TRACKLIST, 'Tracklist item'),
+    ]
+    CREATED = 'created'
+    UPDATED = 'updated'
+    DELETED = 'deleted'
+    # Replaces the newest of the entries removed by compaction, marking
+    # where the log now starts
+    COMPACTED = 'compacted'
+    ACTION_CHOICES = [
+        (CREATED, 'Created'),
+        (UPDATED, 'Updated'),
+        (DELETED, 'Deleted'),
+        (COMPACTED, 'Compacted'),
+    ]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, blank=True)
+    object_id = models.PositiveBigIntegerField()
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f'#{self.pk} {self.action} {self.kind} {self.object_id}'
+
+class CatalogueStat(models.Model):
+    """
+    The number of albums, their tracks, playtime and summed price for one
+    artist, format or release year, read by /api/stats/ and kept in step
+    with the albums by stats.py.
+    """
+    ARTIST = 'artist'
+    FORMAT = 'format'
+    YEAR = 'year'
+    DIMENSION_CHOICES = [
+        (ARTIST, 'Artist'),
+        (FORMAT, 'Format'),
+        (YEAR, 'Release year'),
+    ]
+
+    dimension = models.CharField(max_length=10, choices=DIMENSION_CHOICES)
+    key = models.CharField(max_length=512)
+    album_count = models.PositiveIntegerField(default=0)
+    track_count = models.PositiveBigIntegerField(default=0)
+    total_playtime = models.PositiveBigIntegerField(default=0)
+    total_price = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f'{self.dimension} {self.key}: {self.album_count} albums'
+
+    class Meta:
+        unique_together = ['dimension', 'key']
+
+class CountedAlbum(models.Model):
+    """
+    The values an album last added to the catalogue stats, so a change to
+    it is applied as the difference rather than recounting its groups.
+    """
+    album = models.OneToOneField(Album, on_delete=models.CASCADE, primary_key=True, related_name='counted')
+    artist = models.CharField(max_length=512)
+    format = models.CharField(max_length=2)
+    release_year = models.PositiveSmallIntegerField()
+    price = models.DecimalField(max_digits=5, decimal_places=2)
+    track_count = models.PositiveIntegerField()
+    total_playtime = models.PositiveIntegerField()
+
+    def __str__(self):
+        return f'Counted {self.album_id}'
@@ -0,0 +1,17 @@
+# Pagination classes for the API viewsets
+from rest_framework.pagination import CursorPagination
+
+class CatalogueCursorPagination(CursorPagination):
+    """
+    Keyset pagination ordered by primary key.
+    The key is unique and never changes, so pages stay stable while
+    albums and songs are added or removed between requests.
+    """
+    ordering = 'id'
+    page_size = 24
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+class TaskCursorPagination(CatalogueCursorPagination):
+    # The most recently queued tasks first
+    ordering = '-id'
@@ -0,0 +1,124 @@
+# Request-scoped access to the signed in user's MusicManagerUser profile and role
+from django.conf import settings
+from django.contrib.auth.models import Permission
+from django.core.cache import cache
+from django.db.models import Q
+from .models import MusicManagerUser
+from .profiling import timer
+
+# Role permissions in order of precedence
+ROLES = ['Editor', 'Artist', 'Viewer']
+
+class MusicManager:
+    """
+    The profile and role permissions of a user, resolved once per request.
+    Anonymous users and users without a profile have no role and an empty
+    display name.
+    """
+    def __init__(self, profile=None, permissions=()):
+        self.profile = profile
+        self.permissions = frozenset(permissions)
+
+    @property
+    def display_name(self):
+        return self.profile.display_name if self.profile else ''
+
+    @property
+    def profile_id(self):
+        return self.profile.pk if self.profile else None
+
+    @property
+    def role(self):
+        for role in ROLES:
+            if role in self.permissions:
+                return role
+        return None
+
+    @property
+    def is_editor(self):
+        return 'Editor' in self.permissions
+
+    @property
+    def is_artist(self):
+        return 'Artist' in self.permissions
+
+    @property
+    def is_viewer(self):
+        return 'Viewer' in self.permissions
+
+    def owns(self, album):
+        """
+        Returns whether the album belongs to this user's artist profile.
+        """
+        return self.is_artist and self.profile is not None and album.owner_id == self.profile.pk
+
+def load_music_manager(user):
+    """
+    Loads a user's profile and role permissions from the database.
+    Role permissions granted directly and through groups are read in one
+    query, mirroring User.has_perm() for active users and superusers.
+    """
+    profile = MusicManagerUser.objects.select_related('user').filter(user=user).first()
+    if not user.is_active:
+        permissions = []
+    elif user.is_superuser:
+        permissions = ROLES
+    else:
+        permissions = Permission.objects.filter(
+            Q(user=user) | Q(group__user=user),
+            content_type__app_label=MusicManagerUser._meta.app_label,
+            codename__in=ROLES,
+        ).values_list('codename', flat=True).distinct()
+    return MusicManager(profile, permissions)
+
+def get_cache_key(user_id):
+    """
+    Returns the versioned cache key for a user's MusicManager.
+    The key changes whenever the user's or every user's version is bumped.
+    """
+    versions = cache.get_many(['music-manager-version', f'music-manager-version:{user_id}'])
+    return 'music-manager:{}:{}:{}'.format(
+        user_id,
+        versions.get('music-manager-version', 0),
+        versions.get(f'music-manager-version:{user_id}', 0),
+    )
+
+def invalidate_music_manager(user_id=None):
+    """
+    Invalidates the cached MusicManager of one user, or of every user when
+    user_id is None (e.g. when a group's permissions change).
+    """
+    key = 'music-manager-version' if user_id is None else f'music-manager-version:{user_id}'
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+def get_music_manager(request):
+    """
+    Returns the MusicManager for the request's user, loading it at most once
+    per request. When MUSIC_MANAGER_CACHE_TIMEOUT is set, it is also cached
+    across requests under a versioned key.
+    """
+    if not hasattr(request, '_music_manager'):
+        with timer('permissions'):
+            user = request.user
+            timeout = getattr(settings, 'MUSIC_MANAGER_CACHE_TIMEOUT', None)
+            if not user.is_authenticated:
+                manager = MusicManager()
+            elif timeout is None:
+                manager = load_music_manager(user)
+            else:
+                key = get_cache_key(user.pk)
+                manager = cache.get(key)
+                if manager is None:
+                    manager = load_music_manager(user)
+                    cache.set(key, manager, timeout)
+        request._music_manager = manager
+    return request._music_manager
+
+def music_manager(request):
+    """
+    Context processor exposing the request's MusicManager to templates.
+    """
+    return {'music_manager': get_music_manager(request)}
@@ -0,0 +1,274 @@
+# Opt-in per-request profiling: Server-Timing headers and a structured request log
+import json
+import logging
+import math
+import random
+import re
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from collections import Counter, defaultdict
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template.base import Template
+from django.utils import timezone
+from rest_framework.serializers import ListSerializer, Serializer
+
+logger = logging.getLogger(__name__)
+
+# Server-Timing metrics, in header order
+METRICS = ('sql', 'view', 'serializer', 'template', 'permissions')
+
+_current = ContextVar('request_profile', default=None)
+
+class RequestProfile:
+    """
+    Wall time spent on each part of one request. sql covers every query,
+    including those made while rendering templates or serializing; view is
+    the time in the view and its response rendering, less serializer and
+    template time.
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view_started = None
+        self.durations = defaultdict(float)
+        self.depths = defaultdict(int)
+        self.sql_count = 0
+        self.queries = Counter()
+
+    @contextmanager
+    def timer(self, name):
+        # Nested timers of one name, e.g. included templates, are counted once
+        self.depths[name] += 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.depths[name] -= 1
+            if not self.depths[name]:
+                self.durations[name] += time.perf_counter() - started
+
+    def record_query(self, execute, sql, params, many, context):
+        """
+        Database execute wrapper counting and timing every query.
+        """
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.durations['sql'] += time.perf_counter() - started
+            self.sql_count += 1
+            self.queries[normalize_sql(sql)] += 1
+
+    def finish(self):
+        ended = time.perf_counter()
+        self.durations['total'] = ended - self.started
+        if self.view_started is not None:
+            self.durations['view'] = max(
+                0, ended - self.view_started - self.durations.get('serializer', 0) - self.durations.get('template', 0)
+            )
+
+    def get_ms(self, name):
+        return round(self.durations.get(name, 0) * 1000, 2)
+
+    def get_duplicates(self, threshold):
+        """
+        Returns the normalized queries run at least threshold times, which
+        usually means a related object loaded per row (N+1).
+        """
+        return [
+            {'sql': sql, 'count': count}
+            for sql, count in self.queries.most_common() if count >= threshold
+        ]
+
+    def get_server_timing(self):
+        metrics = [f'sql;dur={self.get_ms("sql")};desc="{self.sql_count} queries"']
+        metrics += [f'{name};dur={self.get_ms(name)}' for name in METRICS[1:] if name in self.durations]
+        metrics.append(f"total;dur={self.get_ms('total')}")
+        return ', '.join(metrics)
+
+def normalize_sql(sql):
+    """
+    Reduces a query to its shape, replacing literals with ? and IN lists of
+    any length with (...), so the same query with other values matches.
+    """
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql.replace('%s', '?'))
+    sql = re.sub(r'\(\s*\?(?:\s*,\s*\?)*\s*\)', '(...)', sql)
+    return re.sub(r'\s+', ' ', sql).strip()
+
+@contextmanager
+def timer(name):
+    """
+    Adds the time spent in the block to the current request's profile, if any.
+    """
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    with profile.timer(name):
+        yield
+
+def timed(name, function):
+    def wrapper(*args, **kwargs):
+        with timer(name):
+            return function(*args, **kwargs)
+    wrapper.__wrapped__ = function
+    return wrapper
+
+_installed = False
+
+def install():
+    """
+    Times template rendering and DRF serialization. Done once, and only
+    when profiling is enabled, so they are untouched otherwise.
+    """
+    global _installed
+    if _installed:
+        return
+    _installed = True
+    Template.render = timed('template', Template.render)
+    for serializer_class in (Serializer, ListSerializer):
+        serializer_class.data = property(timed('serializer', serializer_class.data.fget))
+
+def get_endpoint(request):
+    match = getattr(request, 'resolver_match', None)
+    return f"{request.method} {match.view_name if match else '<unresolved>'}"
+
+class RequestProfilingMiddleware:
+    """
+    Adds a Server-Timing header to every response and logs a JSON line for
+    a REQUEST_PROFILING_SAMPLE_RATE share of requests, which summarize()
+    takes percentiles from, and for every request slower than
+    REQUEST_PROFILING_SLOW_MS or repeating a query
+    REQUEST_PROFILING_DUPLICATE_QUERIES times. Enabled by REQUEST_PROFILING;
+    it should come first in MIDDLEWARE so the total covers the others.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'REQUEST_PROFILING', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+        install()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        profile = RequestProfile()
+        token = _current.set(profile)
+        try:
+            with ExitStack() as stack:
+                self.record_queries(stack, profile)
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, profile)
+
+    async def __acall__(self, request):
+        profile = RequestProfile()
+        token = _current.set(profile)
+        stack = ExitStack()
+        try:
+            # Queries of async views run in the thread sync_to_async keeps
+            # for the request, so that thread's connections are wrapped
+            await sync_to_async(self.record_queries)(stack, profile)
+            try:
+                response = await self.get_response(request)
+            finally:
+                await sync_to_async(stack.close)()
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, profile)
+
+    def record_queries(self, stack, profile):
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(profile.record_query))
+
+    def finish(self, request, response, profile):
+        profile.finish()
+        response.headers['Server-Timing'] = profile.get_server_timing()
+        self.log(request, response, profile)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        _current.get().view_started = time.perf_counter()
+
+    def log(self, request, response, profile):
+        reasons = []
+        if profile.get_ms('total') >= settings.REQUEST_PROFILING_SLOW_MS:
+            reasons.append('slow')
+        duplicates = profile.get_duplicates(settings.REQUEST_PROFILING_DUPLICATE_QUERIES)
+        if duplicates:
+            reasons.append('duplicate_queries')
+        sample_rate = settings.REQUEST_PROFILING_SAMPLE_RATE
+        sampled = random.random() < sample_rate
+        if not reasons and not sampled:
+            return
+        record = {
+            'time': timezone.now().isoformat(),
+            'endpoint': get_endpoint(request),
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'reasons': reasons,
+            **{f'{name}_ms': profile.get_ms(name) for name in ('total',) + METRICS},
+            'sql_count': profile.sql_count,
+            'duplicates': duplicates,
+        }
+        if sampled:
+            # Logged whatever its reasons, so the sampled lines represent every request
+            record['sample_rate'] = sample_rate
+        logger.warning(json.dumps(record))
+
+def read_log(stream):
+    """
+    Yields the records of a request log, skipping lines that are not JSON
+    objects, e.g. from other loggers.
+    """
+    for line in stream:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(record, dict) and 'endpoint' in record:
+            yield record
+
+def percentile(values, percent):
+    """
+    Returns the nearest-rank percentile of sorted values, or 0 when empty.
+    """
+    if not values:
+        return 0
+    return values[min(len(values) - 1, math.ceil(percent / 100 * len(values)) - 1)]
+
+def summarize(records):
+    """
+    Returns per-endpoint request counts, total time percentiles and
+    average query counts, estimated from the sampled lines, along with the
+    number of slow requests and of requests with repeated queries, which
+    are all logged.
+    """
+    endpoints = defaultdict(list)
+    for record in records:
+        endpoints[record['endpoint']].append(record)
+    summary = {}
+    for endpoint, entries in endpoints.items():
+        sampled = [entry for entry in entries if entry.get('sample_rate')]
+        totals = sorted(entry['total_ms'] for entry in sampled)
+        summary[endpoint] = {
+            'requests': round(sum(1 / entry['sample_rate'] for entry in sampled)),
+            'sampled': len(sampled),
+            'p50_ms': percentile(totals, 50),
+            'p95_ms': percentile(totals, 95),
+            'p99_ms': percentile(totals, 99),
+            'avg_sql_count': round(sum(entry.get('sql_count', 0) for entry in sampled) / len(sampled), 1)
+            if sampled else 0,
+            'slow_requests': sum('slow' in entry.get('reasons', ()) for entry in entries),
+            'duplicate_query_requests': sum(bool(entry.get('duplicates')) for entry in entries),
+        }
+    return summary
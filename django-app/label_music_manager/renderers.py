@@ -0,0 +1,28 @@
+# Renderers for the API viewsets
+import orjson
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    Renders compact JSON with orjson, byte for byte as JSONRenderer does
+    for the album and song payloads. Dates, decimals and lazy strings go
+    through DRF's encoder. Indented output (the browsable API, or
+    Accept: application/json; indent=4) and anything orjson cannot encode,
+    e.g. integers above 64 bits, fall back to JSONRenderer.
+    Floats are written in orjson's shortest form (1e16 rather than 1e+16),
+    which the catalogue payloads do not contain.
+    """
+    options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.ensure_ascii or not self.compact or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=JSONEncoder().default, option=self.options)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Escaped like JSONRenderer, so the output stays a JavaScript subset
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
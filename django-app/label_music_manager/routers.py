@@ -0,0 +1,22 @@
+# Database router sending reads to the read-only SQLite connection
+from django.db import connections
+
+class ReadReplicaRouter:
+    """
+    Routes reads to the 'replica' database unless a transaction is open on
+    the default database, so a request always reads its own writes.
+    Writes, relations and migrations all use the default database.
+    """
+    def db_for_read(self, model, **hints):
+        if connections['default'].in_atomic_block:
+            return 'default'
+        return 'replica'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
@@ -0,0 +1,178 @@
+# Full-text catalogue search backed by an SQLite FTS5 index
+import re
+from django.db import connection
+from django.db.models import Q
+from .models import Album, AlbumTracklistItem, Song
+
+TABLE = 'label_music_manager_search'
+
+# Each object is stored under rowid = id * 2 + kind, so it can be replaced in place
+KINDS = {'album': 0, 'song': 1}
+
+# Relative weight of the title, artist and description columns when ranking
+RANK = 'bm25(10.0, 5.0, 1.0)'
+
+# Longest query, in words, that is matched
+MAX_TERMS = 8
+
+# Rows written per statement, well under SQLite's variable limit
+CHUNK_SIZE = 500
+
+_available = None
+
+def is_available():
+    """
+    Returns whether the database is SQLite built with FTS5. Probed on the
+    first call and remembered, as the library cannot change while running.
+    """
+    global _available
+    if _available is None:
+        _available = connection.vendor == 'sqlite' and has_fts5()
+    return _available
+
+def has_fts5():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pragma_compile_options WHERE compile_options = 'ENABLE_FTS5'")
+        return cursor.fetchone() is not None
+
+def create_index():
+    """
+    Creates the FTS5 table if it does not exist. Prefix indexes on the first
+    two and three characters keep prefix queries as fast as whole words.
+    """
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5('
+            'title, artist, description, kind UNINDEXED, object_id UNINDEXED, '
+            "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+        )
+        cursor.execute(f"INSERT INTO {TABLE}({TABLE}, rank) VALUES ('rank', %s)", [RANK])
+
+def chunks(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), CHUNK_SIZE):
+        yield ids[start:start + CHUNK_SIZE]
+
+def index_rows(kind, select, ids=None):
+    """
+    Inserts or replaces the index rows of one kind, for the given IDs or
+    for every object when ids is None. select reads (title, artist,
+    description) columns from the model's table.
+    """
+    if not is_available():
+        return
+    model = Album if kind == 'album' else Song
+    sql = (
+        f'INSERT OR REPLACE INTO {TABLE} (rowid, title, artist, description, kind, object_id) '
+        f"SELECT id * 2 + {KINDS[kind]}, {select}, '{kind}', id FROM {model._meta.db_table}"
+    )
+    with connection.cursor() as cursor:
+        if ids is None:
+            cursor.execute(sql)
+            return
+        for chunk in chunks(ids):
+            cursor.execute(f"{sql} WHERE id IN ({', '.join(['%s'] * len(chunk))})", chunk)
+
+def index_albums(album_ids=None):
+    index_rows('album', 'title, artist, description', album_ids)
+
+def index_songs(song_ids=None):
+    index_rows('song', "title, '', ''", song_ids)
+
+def remove(kind, ids):
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        for chunk in chunks(ids):
+            rowids = [object_id * 2 + KINDS[kind] for object_id in chunk]
+            cursor.execute(f"DELETE FROM {TABLE} WHERE rowid IN ({', '.join(['%s'] * len(rowids))})", rowids)
+
+def rebuild():
+    """
+    Recreates the index from the album and song tables and merges it into
+    as few segments as possible. Returns the number of rows indexed.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE IF EXISTS {TABLE}')
+    create_index()
+    index_albums()
+    index_songs()
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {TABLE}({TABLE}) VALUES ('optimize')")
+        cursor.execute(f'SELECT COUNT(*) FROM {TABLE}')
+        return cursor.fetchone()[0]
+
+def get_terms(query):
+    return re.findall(r'\w+', query)[:MAX_TERMS]
+
+def build_match(query):
+    """
+    Turns free text into an FTS5 query matching every word as a prefix,
+    e.g. 'sea lif' becomes '"sea"* "lif"*'. Returns None when no words remain.
+    """
+    terms = get_terms(query)
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"*' for term in terms)
+
+def get_scope_filter(kind, owner_id):
+    """
+    Restricts matches to an artist's albums, and to the songs on them.
+    """
+    if kind == 'album':
+        return f'object_id IN (SELECT id FROM {Album._meta.db_table} WHERE owner_id = %s)'
+    return (
+        f'object_id IN (SELECT t.song_id FROM {AlbumTracklistItem._meta.db_table} t '
+        f'INNER JOIN {Album._meta.db_table} a ON a.id = t.album_id WHERE a.owner_id = %s)'
+    )
+
+def search_ids(query, kind, owner_id=None, limit=20):
+    """
+    Returns the IDs of the best matching objects of one kind, best first.
+    When owner_id is given only that artist's albums and songs match.
+    """
+    match = build_match(query)
+    if match is None:
+        return []
+    if not is_available():
+        return fallback_ids(query, kind, owner_id, limit)
+
+    sql = f'SELECT object_id FROM {TABLE} WHERE {TABLE} MATCH %s AND kind = %s'
+    params = [match, kind]
+    if owner_id is not None:
+        sql += ' AND ' + get_scope_filter(kind, owner_id)
+        params.append(owner_id)
+    sql += ' ORDER BY rank LIMIT %s'
+    params.append(limit)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+def fallback_ids(query, kind, owner_id, limit):
+    """
+    Unranked substring search for databases without FTS5.
+    """
+    condition = Q()
+    for term in get_terms(query):
+        if kind == 'album':
+            condition &= Q(title__icontains=term) | Q(artist__icontains=term) | Q(description__icontains=term)
+        else:
+            condition &= Q(title__icontains=term)
+    if kind == 'album':
+        queryset = Album.objects.filter(condition)
+        if owner_id is not None:
+            queryset = queryset.filter(owner=owner_id)
+    else:
+        queryset = Song.objects.filter(condition)
+        if owner_id is not None:
+            queryset = queryset.filter(album__owner=owner_id).distinct()
+    return list(queryset.order_by('id').values_list('id', flat=True)[:limit])
+
+def in_rank_order(queryset, ids):
+    """
+    Loads the objects with the given IDs in one query, in the order of ids.
+    """
+    objects = {obj.pk: obj for obj in queryset.filter(pk__in=ids)}
+    return [objects[object_id] for object_id in ids if object_id in objects]
@@ -1,6 +1,44 @@
 # Write your serializers here
 from rest_framework import serializers
-from .models import Album, Song, AlbumTracklistItem, MusicManagerUser
+from .importer import FORMAT_CODES, READERS
+from .models import Album, Song, AlbumTracklistItem, MusicManagerUser, Task
+
+def get_query_list(request, param):
+    """
+    Returns the comma separated values of a query parameter as a set,
+    or None when the parameter is absent.
+    """
+    if request is None:
+        return None
+    value = getattr(request, 'query_params', request.GET).get(param)
+    if value is None:
+        return None
+    return {item.strip() for item in value.split(',') if item.strip()}
+
+def get_sparse_fields(request, expandable_fields=()):
+    """
+    Returns the fields selected with ?fields=, plus any expandable fields
+    asked for with ?expand=, or None when every field should be rendered.
+    """
+    fields = get_query_list(request, 'fields')
+    if fields is None:
+        return None
+    expand = get_query_list(request, 'expand') or set()
+    return fields | (expand & set(expandable_fields))
+
+class SparseFieldsetMixin:
+    """
+    Restricts the serialized fields to those requested with ?fields=a,b.
+    Fields listed in Meta.expandable_fields (e.g. nested tracks) are only
+    included alongside ?fields= when named there or in ?expand=.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        expandable_fields = getattr(self.Meta, 'expandable_fields', ())
+        selected = get_sparse_fields(self.context.get('request'), expandable_fields)
+        if selected is not None:
+            for field_name in set(self.fields) - selected:
+                self.fields.pop(field_name)
 
 class SongSerializer(serializers.ModelSerializer):
     url = serializers.HyperlinkedIdentityField(view_name='songs-detail')
@@ -9,11 +47,12 @@ class SongSerializer(serializers.ModelSerializer):
         model = Song
         fields = ['id', 'url', 'title', 'length']
 
-class AlbumSerializer(serializers.ModelSerializer):
-    tracks = SongSerializer(many=True, read_only=True)
+class AlbumSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    tracks = SongSerializer(many=True, read_only=True, source='ordered_tracks')
     short_description = serializers.SerializerMethodField()
     release_year = serializers.SerializerMethodField()
-    total_playtime = serializers.SerializerMethodField()
+    cover_srcset = serializers.SerializerMethodField()
+    cover_webp_srcset = serializers.SerializerMethodField()
     url = serializers.HyperlinkedIdentityField(view_name='albums-detail')
 
     class Meta:
@@ -21,11 +60,14 @@ class AlbumSerializer(serializers.ModelSerializer):
         fields = [
             'id',
             'total_playtime',
+            'track_count',
             'short_description',
             'release_year',
             'tracks',
             'url',
             'cover_image',
+            'cover_srcset',
+            'cover_webp_srcset',
             'title',
             'description',
             'artist',
@@ -34,6 +76,7 @@ class AlbumSerializer(serializers.ModelSerializer):
             'release_date',
             'slug',
         ]
+        expandable_fields = ['tracks']
 
     def get_short_description(self, obj):
         if len(obj.description) > 255:
@@ -43,14 +86,81 @@ class AlbumSerializer(serializers.ModelSerializer):
     def get_release_year(self, obj):
         return obj.release_date.year
 
-    def get_total_playtime(self, obj):
-        return sum(song.length for song in obj.tracks.all())
+    def get_cover_srcset(self, obj):
+        return self.build_srcset(obj.get_cover_variants('jpeg'))
+
+    def get_cover_webp_srcset(self, obj):
+        return self.build_srcset(obj.get_cover_variants('webp'))
+
+    def build_srcset(self, variants):
+        # Variant URLs are absolute, like cover_image
+        request = self.context.get('request')
+        return ', '.join(
+            f'{request.build_absolute_uri(url) if request else url} {width}w' for url, width in variants
+        )
 
 class AlbumTracklistSerializer(serializers.ModelSerializer):
     class Meta:
         model = AlbumTracklistItem
         fields = ['id', 'album', 'song', 'position']
 
+class TracklistItemInputSerializer(serializers.Serializer):
+    """
+    One item of a bulk tracklist request. Album and song IDs are checked
+    for all items at once rather than per item.
+    """
+    album = serializers.IntegerField(min_value=1)
+    song = serializers.IntegerField(min_value=1)
+    position = serializers.IntegerField(min_value=1, required=False, allow_null=True)
+
+class TracklistReplaceSerializer(serializers.Serializer):
+    songs = serializers.ListField(child=serializers.JSONField(), max_length=1000)
+
+class ImportSerializer(serializers.Serializer):
+    """
+    A catalogue file uploaded for the task queue to import. The format
+    defaults to the file extension.
+    """
+    file = serializers.FileField()
+    format = serializers.ChoiceField(choices=sorted(READERS), required=False)
+    batch_size = serializers.IntegerField(min_value=1, max_value=10000, default=1000)
+
+    def validate(self, data):
+        if 'format' not in data:
+            extension = data['file'].name.rpartition('.')[2].lower()
+            if extension not in READERS:
+                raise serializers.ValidationError({'format': 'Cannot infer the format from the file name.'})
+            data['format'] = extension
+        return data
+
+class TaskSerializer(serializers.ModelSerializer):
+    url = serializers.HyperlinkedIdentityField(view_name='tasks-detail')
+
+    class Meta:
+        model = Task
+        fields = [
+            'id', 'url', 'name', 'arguments', 'status', 'attempts', 'max_attempts', 'run_after',
+            'result', 'last_error', 'created_at', 'finished_at',
+        ]
+
+class ExportFilterSerializer(serializers.Serializer):
+    """
+    Filters of an export. modified_since selects albums changed since a
+    previous export, including changes to their tracklist or songs.
+    """
+    artist = serializers.CharField(required=False)
+    format = serializers.CharField(required=False)
+    released_after = serializers.DateField(required=False)
+    released_before = serializers.DateField(required=False)
+    modified_since = serializers.DateTimeField(required=False)
+
+    def validate_format(self, value):
+        # Format codes ('VL') and display names ('Vinyl') are both accepted
+        code = FORMAT_CODES.get(value.lower())
+        if code is None:
+            raise serializers.ValidationError(f'Unknown format "{value}".')
+        return code
+
 class MusicManagerUserSerializer(serializers.ModelSerializer):
     class Meta:
         model = MusicManagerUser
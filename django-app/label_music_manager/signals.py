@@ -0,0 +1,227 @@
+# Signal receivers keeping derived data and caches in step with the database
+from django.contrib.auth.models import Group, User
+from django.db.models import QuerySet, Subquery
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save, pre_delete
+from django.dispatch import receiver
+from . import catalogue_cache, changes, covers, search, stats
+from .models import Album, AlbumQuerySet, AlbumTracklistItem, Change, MusicManagerUser, Song, albums_touched
+from .profiles import invalidate_music_manager
+
+@receiver([post_save, post_delete], sender=MusicManagerUser)
+def profile_changed(sender, instance, **kwargs):
+    invalidate_music_manager(instance.user_id)
+
+@receiver(post_save, sender=MusicManagerUser)
+def profile_saved(sender, instance, **kwargs):
+    # A new or renamed artist profile claims the unowned albums under its name
+    if Album.objects.filter(artist=instance.display_name).link_owners():
+        catalogue_cache.invalidate_lists([instance.pk])
+
+@receiver([post_save, post_delete], sender=User)
+def user_changed(sender, instance, **kwargs):
+    # Active and superuser flags affect the resolved role
+    invalidate_music_manager(instance.pk)
+
+@receiver(m2m_changed, sender=User.user_permissions.through)
+@receiver(m2m_changed, sender=User.groups.through)
+def user_permissions_changed(sender, instance, action, reverse, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if isinstance(instance, User):
+        invalidate_music_manager(instance.pk)
+    else:
+        # Changed from the permission or group side, which may affect any user
+        invalidate_music_manager()
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def group_permissions_changed(sender, action, **kwargs):
+    if action.startswith('post_'):
+        invalidate_music_manager()
+
+def get_song_length(song_id, origin=None):
+    # A song being deleted is already gone from its table
+    if isinstance(origin, Song):
+        return origin.length
+    return Subquery(Song.objects.filter(pk=song_id).values('length')[:1])
+
+@receiver(post_save, sender=AlbumTracklistItem)
+def tracklist_item_saved(sender, instance, created, **kwargs):
+    # Albums store their track count and playtime, moved by one item at a time
+    loaded = (getattr(instance, '_loaded_album_id', None), getattr(instance, '_loaded_song_id', None))
+    if created:
+        Album.objects.filter(pk=instance.album_id).add_to_aggregates(1, get_song_length(instance.song_id))
+    elif None not in loaded and loaded != (instance.album_id, instance.song_id):
+        Album.objects.filter(pk__in={loaded[0], instance.album_id}).refresh_aggregates()
+    instance._loaded_album_id = instance.album_id
+    instance._loaded_song_id = instance.song_id
+
+@receiver(post_delete, sender=AlbumTracklistItem)
+def tracklist_item_deleted(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, (Album, AlbumQuerySet)):
+        return
+    if isinstance(origin, QuerySet):
+        # Every item of a bulk delete is gone before the first signal, so
+        # each album is recomputed once rather than adjusted per item
+        refreshed = origin.__dict__.setdefault('_refreshed_album_ids', set())
+        if instance.album_id not in refreshed:
+            refreshed.add(instance.album_id)
+            Album.objects.filter(pk=instance.album_id).refresh_aggregates()
+        return
+    Album.objects.filter(pk=instance.album_id).add_to_aggregates(-1, -get_song_length(instance.song_id, origin))
+
+@receiver([post_save, post_delete], sender=AlbumTracklistItem)
+def tracklist_item_changed(sender, instance, origin=None, **kwargs):
+    # Albums embed their tracklist, so it is part of the album's version.
+    # Items removed by deleting their album need no update.
+    if isinstance(origin, (Album, AlbumQuerySet)):
+        return
+    if isinstance(origin, QuerySet):
+        # Deleting many items touches each of their albums once
+        touched = origin.__dict__.setdefault('_touched_album_ids', set())
+        if instance.album_id in touched:
+            return
+        touched.add(instance.album_id)
+    Album.objects.touch([instance.album_id])
+
+@receiver(post_save, sender=Song)
+def song_changed(sender, instance, created, **kwargs):
+    if not created:
+        loaded_length = getattr(instance, '_loaded_length', None)
+        if loaded_length is not None and instance.length != loaded_length:
+            Album.objects.filter(tracks=instance).add_to_aggregates(0, instance.length - loaded_length)
+        Album.objects.touch(Album.objects.filter(tracks=instance).values_list('pk', flat=True))
+    instance._loaded_length = instance.length
+
+@receiver(m2m_changed, sender=Album.tracks.through)
+def album_tracks_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # album.tracks.add() and song.album_set.add() write tracklist rows in bulk
+    if action == 'pre_clear' and reverse:
+        instance._cleared_album_ids = set(instance.album_set.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if not reverse:
+            album_ids = [instance.pk]
+        elif action == 'post_clear':
+            album_ids = instance.__dict__.pop('_cleared_album_ids', ())
+        else:
+            album_ids = pk_set
+        Album.objects.filter(pk__in=album_ids).refresh_aggregates()
+        Album.objects.touch(album_ids)
+
+@receiver([post_save, post_delete], sender=Album)
+def album_changed(sender, instance, **kwargs):
+    catalogue_cache.invalidate_albums([instance.pk])
+    owner_ids = {instance.owner_id, getattr(instance, '_loaded_owner_id', None)} - {None}
+    catalogue_cache.invalidate_lists(owner_ids)
+    instance._loaded_artist = instance.artist
+    instance._loaded_owner_id = instance.owner_id
+
+@receiver(albums_touched)
+def albums_content_changed(sender, album_ids, album_fields_changed=False, **kwargs):
+    catalogue_cache.invalidate_albums(album_ids)
+    if album_fields_changed:
+        catalogue_cache.invalidate_lists()
+
+@receiver(post_save, sender=Album)
+def album_cover_changed(sender, instance, **kwargs):
+    # Resized variants are made off the request path once the save commits
+    if covers.needs_variants(instance):
+        covers.schedule_album_cover(instance.pk, instance.cover_image.name)
+
+@receiver(post_migrate)
+def create_search_index(sender, **kwargs):
+    if sender.name == 'label_music_manager':
+        search.create_index()
+
+@receiver(post_migrate)
+def clear_catalogue_cache(sender, **kwargs):
+    # Entries may not match the new schema, and a newly created database,
+    # e.g. the test database, reuses the album IDs of the last one
+    if sender.name == 'label_music_manager':
+        catalogue_cache.get_cache().clear()
+
+@receiver(post_save, sender=Album)
+def album_saved_for_search(sender, instance, **kwargs):
+    search.index_albums([instance.pk])
+
+@receiver(post_save, sender=Song)
+def song_saved_for_search(sender, instance, **kwargs):
+    search.index_songs([instance.pk])
+
+@receiver(post_delete, sender=Album)
+@receiver(post_delete, sender=Song)
+def removed_from_search(sender, instance, **kwargs):
+    search.remove('album' if sender is Album else 'song', [instance.pk])
+
+@receiver(albums_touched)
+def albums_reindexed(sender, album_ids, album_fields_changed=False, **kwargs):
+    # Bulk upserts change titles, artists and descriptions without post_save
+    if album_fields_changed:
+        search.index_albums(album_ids)
+
+@receiver(post_save, sender=Album)
+def album_saved_to_stats(sender, instance, **kwargs):
+    stats.refresh_albums([instance.pk])
+
+@receiver(albums_touched)
+def albums_touched_to_stats(sender, album_ids, **kwargs):
+    # Tracklist and song length changes reach the stats through the stored
+    # album aggregates, which are updated before albums are touched
+    stats.refresh_albums(album_ids)
+
+@receiver(pre_delete, sender=Album)
+def album_deleted_from_stats(sender, instance, origin=None, **kwargs):
+    # Albums deleted in bulk are subtracted together, while their rows still exist
+    if isinstance(origin, AlbumQuerySet):
+        if origin.__dict__.get('_stats_removed'):
+            return
+        origin._stats_removed = True
+        stats.remove_albums(origin.values('pk'))
+    else:
+        stats.remove_albums([instance.pk])
+
+CHANGE_KINDS = {Album: Change.ALBUM, Song: Change.SONG, AlbumTracklistItem: Change.TRACKLIST}
+
+@receiver(post_save, sender=Album)
+@receiver(post_save, sender=Song)
+@receiver(post_save, sender=AlbumTracklistItem)
+def saved_to_change_log(sender, instance, created, **kwargs):
+    changes.record(CHANGE_KINDS[sender], Change.CREATED if created else Change.UPDATED, [instance.pk])
+
+@receiver(pre_delete, sender=Album)
+@receiver(pre_delete, sender=Song)
+@receiver(pre_delete, sender=AlbumTracklistItem)
+def tracklist_deleted_to_change_log(sender, instance, origin=None, **kwargs):
+    # Tracklist items deleted with their album or song, or in bulk, are
+    # logged in one query while their rows still exist
+    if sender is not AlbumTracklistItem:
+        items = AlbumTracklistItem.objects.filter(**{'album' if sender is Album else 'song': instance})
+    elif isinstance(origin, QuerySet) and origin.model is AlbumTracklistItem:
+        if origin.__dict__.get('_changes_logged'):
+            return
+        origin._changes_logged = True
+        items = origin
+    else:
+        return
+    changes.record(Change.TRACKLIST, Change.DELETED, items.values_list('pk', flat=True))
+
+@receiver(post_delete, sender=Album)
+@receiver(post_delete, sender=Song)
+@receiver(post_delete, sender=AlbumTracklistItem)
+def deleted_to_change_log(sender, instance, origin=None, **kwargs):
+    # Other tracklist items are logged before they are deleted
+    if sender is AlbumTracklistItem and not isinstance(origin, AlbumTracklistItem):
+        return
+    changes.record(CHANGE_KINDS[sender], Change.DELETED, [instance.pk])
+
+@receiver(m2m_changed, sender=Album.tracks.through)
+def tracks_added_to_change_log(sender, instance, action, reverse, pk_set, **kwargs):
+    # Rows added by album.tracks.add() bypass post_save; removed rows send post_delete
+    if action == 'post_add' and pk_set:
+        lookups = {'song': instance, 'album__in': pk_set} if reverse else {'album': instance, 'song__in': pk_set}
+        items = AlbumTracklistItem.objects.filter(**lookups)
+        changes.record(Change.TRACKLIST, Change.CREATED, items.values_list('pk', flat=True))
+
+@receiver(albums_touched)
+def albums_touched_to_change_log(sender, album_ids, **kwargs):
+    # Bulk writes to albums, their tracklists or songs change their payload
+    changes.record(Change.ALBUM, Change.UPDATED, album_ids)
@@ -0,0 +1,223 @@
+# Catalogue stats per artist, format and release year, kept as rollups updated with each album change
+from collections import defaultdict
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import CharField, Count, DecimalField, F, Q, Sum
+from django.db.models.functions import Cast, ExtractYear
+from .models import Album, CatalogueStat, CountedAlbum, get_tracklist_aggregates
+
+DIMENSIONS = [CatalogueStat.ARTIST, CatalogueStat.FORMAT, CatalogueStat.YEAR]
+
+# The album values the stats are made of, as stored on CountedAlbum
+COUNTED_FIELDS = ['artist', 'format', 'release_year', 'price', 'track_count', 'total_playtime']
+
+STAT_FIELDS = ['album_count', 'track_count', 'total_playtime', 'total_price']
+
+def get_keys(artist, album_format, release_year):
+    return [
+        (CatalogueStat.ARTIST, artist),
+        (CatalogueStat.FORMAT, album_format),
+        (CatalogueStat.YEAR, str(release_year)),
+    ]
+
+def add_album(totals, values, sign=1):
+    """
+    Adds an album's counted values to, or with sign -1 subtracts them
+    from, the totals of its groups.
+    """
+    artist, album_format, release_year, price, track_count, total_playtime = values
+    for key in get_keys(artist, album_format, release_year):
+        total = totals[key]
+        total[0] += sign
+        total[1] += sign * track_count
+        total[2] += sign * total_playtime
+        total[3] += sign * price
+
+def new_totals():
+    return defaultdict(lambda: [0, 0, 0, Decimal(0)])
+
+def apply_differences(differences):
+    """
+    Adds the differences to the stored rollups, in a query to read them
+    and one to write them back. Groups left without albums are deleted.
+    """
+    differences = {key: values for key, values in differences.items() if any(values)}
+    if not differences:
+        return
+    lookup = Q()
+    for dimension in DIMENSIONS:
+        keys = [key for key_dimension, key in differences if key_dimension == dimension]
+        if keys:
+            lookup |= Q(dimension=dimension, key__in=keys)
+    stored = {(stat.dimension, stat.key): stat for stat in CatalogueStat.objects.filter(lookup)}
+
+    changed = []
+    emptied = []
+    for (dimension, key), values in differences.items():
+        stat = stored.get((dimension, key))
+        totals = [getattr(stat, field) + value for field, value in zip(STAT_FIELDS, values)] if stat else values
+        if totals[0] > 0:
+            # Upserted on dimension and key without their IDs, so new and
+            # existing groups are written by the same query
+            changed.append(CatalogueStat(dimension=dimension, key=key, **dict(zip(STAT_FIELDS, totals))))
+        elif stat is not None:
+            emptied.append(stat.pk)
+    if changed:
+        CatalogueStat.objects.bulk_create(
+            changed, update_conflicts=True, unique_fields=['dimension', 'key'], update_fields=STAT_FIELDS,
+        )
+    if emptied:
+        CatalogueStat.objects.filter(pk__in=emptied).delete()
+
+def refresh_albums(album_ids):
+    """
+    Brings the stats in step with the given albums, applying the
+    difference between their current values and those they were last
+    counted with. Albums whose counted values did not change cost only
+    the query reading them, e.g. after a description was edited.
+    """
+    album_ids = list(album_ids)
+    if not album_ids:
+        return
+    with transaction.atomic(savepoint=False):
+        rows = Album.objects.filter(pk__in=album_ids).values_list(
+            'pk', 'artist', 'format', 'release_date', 'price', 'track_count', 'total_playtime',
+            'counted__pk', *(f'counted__{field}' for field in COUNTED_FIELDS),
+        )
+        differences = new_totals()
+        counted = []
+        for album_id, artist, album_format, release_date, price, tracks, playtime, counted_id, *previous in rows:
+            values = (artist, album_format, release_date.year, price, tracks, playtime)
+            if counted_id is not None:
+                if tuple(previous) == values:
+                    continue
+                add_album(differences, previous, -1)
+            add_album(differences, values)
+            counted.append(CountedAlbum(album_id=album_id, **dict(zip(COUNTED_FIELDS, values))))
+        if not counted:
+            return
+        apply_differences(differences)
+        CountedAlbum.objects.bulk_create(
+            counted, update_conflicts=True, unique_fields=['album'], update_fields=COUNTED_FIELDS,
+        )
+
+def remove_albums(albums):
+    """
+    Subtracts albums about to be deleted, given as a queryset or a list of
+    IDs, from the stats. Their CountedAlbum rows are deleted with them.
+    """
+    with transaction.atomic(savepoint=False):
+        differences = new_totals()
+        for values in CountedAlbum.objects.filter(album__in=albums).values_list(*COUNTED_FIELDS):
+            add_album(differences, values, -1)
+        apply_differences(differences)
+
+def rebuild(batch_size=5000):
+    """
+    Recounts the stats of every album from scratch, e.g. after raw SQL
+    writes or bulk inserts that bypass the signals. Returns the number of
+    groups stored.
+    """
+    with transaction.atomic():
+        CatalogueStat.objects.all().delete()
+        CountedAlbum.objects.all().delete()
+        totals = new_totals()
+        rows = Album.objects.order_by().values_list(
+            'pk', 'artist', 'format', 'release_date', 'price', 'track_count', 'total_playtime',
+        )
+        counted = []
+        for album_id, artist, album_format, release_date, price, tracks, playtime in rows.iterator(batch_size):
+            values = (artist, album_format, release_date.year, price, tracks, playtime)
+            add_album(totals, values)
+            counted.append(CountedAlbum(album_id=album_id, **dict(zip(COUNTED_FIELDS, values))))
+            if len(counted) >= batch_size:
+                CountedAlbum.objects.bulk_create(counted)
+                counted = []
+        CountedAlbum.objects.bulk_create(counted)
+        CatalogueStat.objects.bulk_create(
+            [
+                CatalogueStat(dimension=dimension, key=key, **dict(zip(STAT_FIELDS, values)))
+                for (dimension, key), values in totals.items()
+            ],
+            batch_size=batch_size,
+        )
+    return len(totals)
+
+def get_live_stats():
+    """
+    Aggregates the stats over the albums and their tracklists with one
+    GROUP BY query per dimension, without the stored rollups or the
+    albums' stored aggregates. Returns their values by (dimension, key).
+    """
+    aggregates = get_tracklist_aggregates()
+    albums = Album.objects.order_by().annotate(
+        live_track_count=aggregates['track_count'],
+        live_total_playtime=aggregates['total_playtime'],
+    )
+    group_keys = {
+        CatalogueStat.ARTIST: F('artist'),
+        CatalogueStat.FORMAT: F('format'),
+        CatalogueStat.YEAR: Cast(ExtractYear('release_date'), CharField()),
+    }
+    live = {}
+    for dimension, group_key in group_keys.items():
+        rows = albums.annotate(group_key=group_key).values('group_key').annotate(
+            live_album_count=Count('pk'),
+            live_track_sum=Sum('live_track_count'),
+            live_playtime_sum=Sum('live_total_playtime'),
+            live_price_sum=Sum('price', output_field=DecimalField(max_digits=14, decimal_places=2)),
+        ).values_list('group_key', 'live_album_count', 'live_track_sum', 'live_playtime_sum', 'live_price_sum')
+        for key, *values in rows:
+            live[(dimension, key)] = tuple(values)
+    return live
+
+def verify():
+    """
+    Compares the stored rollups with the live aggregate. Returns
+    (dimension, key, stored, live) for each group that differs, with
+    None for a group missing on either side.
+    """
+    stored = {
+        (dimension, key): tuple(values)
+        for dimension, key, *values in CatalogueStat.objects.values_list('dimension', 'key', *STAT_FIELDS)
+    }
+    live = get_live_stats()
+    return [
+        (dimension, key, stored.get((dimension, key)), live.get((dimension, key)))
+        for dimension, key in sorted(stored.keys() | live.keys())
+        if stored.get((dimension, key)) != live.get((dimension, key))
+    ]
+
+def get_average_price(total_price, album_count):
+    return str((total_price / album_count).quantize(Decimal('0.01'))) if album_count else None
+
+def get_stats(dimensions=DIMENSIONS):
+    """
+    Reads the stats of the given dimensions in one query. Returns their
+    groups, ordered by key, and the totals of the whole catalogue.
+    """
+    groups = {dimension: [] for dimension in dimensions}
+    totals = [0, 0, 0, Decimal(0)]
+    stats = CatalogueStat.objects.filter(dimension__in=dimensions).order_by('dimension', 'key')
+    for stat in stats:
+        groups[stat.dimension].append({
+            'key': stat.key,
+            'album_count': stat.album_count,
+            'track_count': stat.track_count,
+            'total_playtime': stat.total_playtime,
+            'average_price': get_average_price(stat.total_price, stat.album_count),
+        })
+        # Each dimension splits the whole catalogue, so any one adds up to it
+        if stat.dimension == dimensions[0]:
+            for index, field in enumerate(STAT_FIELDS):
+                totals[index] += getattr(stat, field)
+    album_count, track_count, total_playtime, total_price = totals
+    return {
+        'totals': {
+            'album_count': album_count,
+            'track_count': track_count,
+            'total_playtime': total_playtime,
+            'average_price': get_average_price(total_price, album_count),
+        },
+        **groups,
+    }
@@ -0,0 +1,312 @@
+# Durable background task queue stored in the project database
+import logging
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import threading
+import traceback
+from datetime import timedelta
+from django.conf import settings
+from django.db import close_old_connections, connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .models import Album, Task
+
+logger = logging.getLogger(__name__)
+
+# Functions that can be queued, by task name. They are called with the
+# task's arguments as keywords, and their return value, which must be JSON
+# serializable, is stored as the task's result. Raising retries the task.
+TASKS = {
+    'delete_album': 'label_music_manager.tasks.delete_album',
+    'import_catalogue': 'label_music_manager.importer.import_stored_file',
+    'process_album_cover': 'label_music_manager.covers.process_album_cover',
+    'rewrite_tracklist': 'label_music_manager.tracklists.rewrite_tracklist',
+}
+
+# Functions called with a task's arguments once it has failed for good,
+# e.g. to remove files it would have cleaned up on success
+FAILURE_HANDLERS = {
+    'import_catalogue': 'label_music_manager.importer.discard_stored_file',
+}
+
+def enqueue(task_name, key=None, user=None, max_attempts=5, delay=0, **arguments):
+    """
+    Queues a task in the current transaction and returns it. With a key,
+    a task queued, running or succeeded under that key is returned
+    instead, so retried requests do not repeat work, while one that failed
+    is queued again with the new arguments and a fresh set of attempts.
+    With TASK_QUEUE_EAGER set, the task runs here once the transaction commits.
+    """
+    if task_name not in TASKS:
+        raise LookupError(f'Unknown task "{task_name}".')
+    values = {
+        'name': task_name,
+        'arguments': arguments,
+        'max_attempts': max_attempts,
+        'run_after': timezone.now() + timedelta(seconds=delay),
+        'created_by': user if user is not None and user.is_authenticated else None,
+    }
+    if key is None:
+        task = Task.objects.create(**values)
+    else:
+        task, created = Task.objects.get_or_create(idempotency_key=key, defaults=values)
+        if not created:
+            # Checked again by the update, so concurrent requests requeue it once
+            if task.status != Task.FAILED or not Task.objects.filter(pk=task.pk, status=Task.FAILED).update(
+                status=Task.QUEUED, attempts=0, locked_by='', locked_at=None, result=None, last_error='',
+                finished_at=None, **values,
+            ):
+                return task
+            task.refresh_from_db()
+    if settings.TASK_QUEUE_EAGER:
+        transaction.on_commit(lambda: run_next(f'eager-{os.getpid()}', task_id=task.pk))
+    return task
+
+def get_retry_delay(attempts):
+    """
+    Seconds to wait before retrying a task that failed attempts times,
+    doubling from TASK_QUEUE_RETRY_DELAY up to TASK_QUEUE_MAX_RETRY_DELAY.
+    Up to a quarter is added at random, so tasks failing together spread out.
+    """
+    delay = min(settings.TASK_QUEUE_RETRY_DELAY * 2 ** (attempts - 1), settings.TASK_QUEUE_MAX_RETRY_DELAY)
+    return delay * random.uniform(1, 1.25)
+
+def claim(worker_id, task_id=None):
+    """
+    Marks the next due task, or the given one if it is due, as running by
+    worker_id and returns it, or returns None when there is nothing to run.
+    Tasks whose worker's lease expired are claimed again, unless they have
+    used up their attempts. The write lock is taken when the transaction
+    begins, so two workers never claim the same task.
+    """
+    while True:
+        now = timezone.now()
+        with transaction.atomic():
+            due = Task.objects.filter(
+                Q(status=Task.QUEUED, run_after__lte=now)
+                | Q(status=Task.RUNNING, locked_at__lt=now - timedelta(seconds=settings.TASK_QUEUE_LEASE))
+            )
+            if task_id is not None:
+                due = due.filter(pk=task_id)
+            task = due.select_for_update(skip_locked=True).order_by('run_after', 'id').first()
+            if task is None:
+                return None
+            if task.status == Task.RUNNING and task.attempts >= task.max_attempts:
+                logger.error('Task %s failed: its worker %s stopped responding', task, task.locked_by)
+                task.status = Task.FAILED
+                task.last_error = f'Worker {task.locked_by} stopped responding.'
+                task.finished_at = now
+                task.save(update_fields=['status', 'last_error', 'finished_at'])
+                handle_failure(task)
+                continue
+            task.status = Task.RUNNING
+            task.attempts += 1
+            task.locked_by = worker_id
+            task.locked_at = now
+            task.save(update_fields=['status', 'attempts', 'locked_by', 'locked_at'])
+            return task
+
+def handle_failure(task):
+    handler = FAILURE_HANDLERS.get(task.name)
+    if handler is None:
+        return
+    try:
+        import_string(handler)(**task.arguments)
+    except Exception:
+        logger.exception('Failure handler of task %s failed', task)
+
+def finish(task, **values):
+    # A task reclaimed after its lease expired belongs to the other worker
+    return Task.objects.filter(pk=task.pk, locked_by=task.locked_by, status=Task.RUNNING).update(**values)
+
+def renew_lease(task, stopped, interval):
+    """
+    Moves the lease of a running task forward every interval seconds
+    until stopped is set, so a task running longer than TASK_QUEUE_LEASE
+    is not claimed again while its worker is alive.
+    """
+    try:
+        while not stopped.wait(interval):
+            finish(task, locked_at=timezone.now())
+    except Exception:
+        logger.exception('Could not renew the lease of task %s', task)
+    finally:
+        # The thread's own connection
+        connections.close_all()
+
+def call(task):
+    # Runs the task's function while a thread renews its lease
+    stopped = threading.Event()
+    heartbeat = threading.Thread(
+        target=renew_lease, args=(task, stopped, settings.TASK_QUEUE_LEASE / 3), daemon=True
+    )
+    heartbeat.start()
+    try:
+        return import_string(TASKS[task.name])(**task.arguments)
+    finally:
+        stopped.set()
+        heartbeat.join()
+
+def run(task):
+    """
+    Runs a claimed task and records its result, or its error and when it
+    will be retried. Returns the task's new status.
+    """
+    try:
+        result = call(task)
+    except Exception:
+        error = traceback.format_exc()
+        now = timezone.now()
+        if task.attempts < task.max_attempts:
+            logger.warning('Task %s failed on attempt %s, retrying:\n%s', task, task.attempts, error)
+            status = Task.QUEUED
+            finish(task, status=status, last_error=error, run_after=now + timedelta(
+                seconds=get_retry_delay(task.attempts)
+            ))
+        else:
+            logger.error('Task %s failed after %s attempts:\n%s', task, task.attempts, error)
+            status = Task.FAILED
+            if finish(task, status=status, last_error=error, finished_at=now):
+                handle_failure(task)
+        return status
+    finish(task, status=Task.SUCCEEDED, result=result, last_error='', finished_at=timezone.now())
+    return Task.SUCCEEDED
+
+def run_next(worker_id, task_id=None):
+    """
+    Claims and runs the next due task, or the given one. Returns its new
+    status, or None when there was nothing to run.
+    """
+    task = claim(worker_id, task_id)
+    return run(task) if task is not None else None
+
+def run_pending(worker_id='inline', limit=None):
+    """
+    Runs due tasks one after another until none are left, or limit have
+    run. Returns the number of tasks run.
+    """
+    count = 0
+    while limit is None or count < limit:
+        if run_next(worker_id) is None:
+            break
+        count += 1
+    return count
+
+def work(worker_id, stop, poll_interval, burst=False):
+    """
+    Runs tasks until stop is set, waiting poll_interval seconds whenever
+    the queue is empty, or returning then in burst mode. Errors outside
+    the tasks, e.g. a locked database while claiming, are logged and the
+    worker carries on after a pause that doubles while they repeat.
+    """
+    logger.info('Worker %s started', worker_id)
+    errors = 0
+    while not stop.is_set():
+        try:
+            status = run_next(worker_id)
+        except Exception:
+            errors += 1
+            delay = min(poll_interval * 2 ** errors, settings.TASK_QUEUE_MAX_RETRY_DELAY)
+            logger.exception('Worker %s failed to run a task, retrying in %.1fs', worker_id, delay)
+            stop.wait(delay)
+            continue
+        finally:
+            close_old_connections()
+        errors = 0
+        if status is None:
+            if burst:
+                break
+            stop.wait(poll_interval)
+    logger.info('Worker %s stopped', worker_id)
+
+def stop_on_signals(stop):
+    """
+    Sets stop on SIGINT and SIGTERM, when called from the main thread.
+    Returns the replaced handlers, for restore_signals.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return {}
+    return {signum: signal.signal(signum, lambda *args: stop.set()) for signum in (signal.SIGINT, signal.SIGTERM)}
+
+def restore_signals(handlers):
+    for signum, handler in handlers.items():
+        signal.signal(signum, handler)
+
+def run_threads(threads, poll_interval, burst=False):
+    """
+    Runs worker threads in this process until SIGINT or SIGTERM, which let
+    their current tasks finish, or until the queue is empty in burst mode.
+    """
+    stop = threading.Event()
+    handlers = stop_on_signals(stop)
+    prefix = f'{socket.gethostname()}:{os.getpid()}'
+    workers = [
+        threading.Thread(target=work, args=(f'{prefix}:{index}', stop, poll_interval, burst), daemon=True)
+        for index in range(threads)
+    ]
+    try:
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            # Joined with a timeout, so signals are handled while waiting
+            while worker.is_alive():
+                worker.join(timeout=0.5)
+    finally:
+        stop.set()
+        restore_signals(handlers)
+
+def run_workers(processes=1, threads=1, poll_interval=None, burst=False):
+    """
+    Runs processes worker processes of threads worker threads each. A
+    single process runs its threads in this process. Threads suit tasks
+    waiting on storage or the database; processes spread image work over
+    several cores.
+    """
+    poll_interval = settings.TASK_QUEUE_POLL_INTERVAL if poll_interval is None else poll_interval
+    if processes == 1:
+        run_threads(threads, poll_interval, burst)
+        return
+
+    # Connections must not be shared with the forked processes
+    connections.close_all()
+    workers = [
+        multiprocessing.Process(target=run_threads, args=(threads, poll_interval, burst))
+        for _ in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    stop = threading.Event()
+    handlers = stop_on_signals(stop)
+    try:
+        while any(worker.is_alive() for worker in workers) and not stop.wait(0.5):
+            pass
+    finally:
+        # Each process stops once its current tasks finish
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+        for worker in workers:
+            worker.join()
+        restore_signals(handlers)
+
+def delete_album(album_id):
+    """
+    Deletes an album with its tracklist, e.g. one too long to delete
+    within a request.
+    """
+    album = Album.objects.filter(pk=album_id).first()
+    if album is None:
+        return {'deleted': False}
+    album.delete()
+    return {'deleted': True}
+
+def purge(before):
+    """
+    Deletes succeeded and failed tasks finished before the given time.
+    Returns the number deleted.
+    """
+    return Task.objects.filter(status__in=[Task.SUCCEEDED, Task.FAILED], finished_at__lt=before).delete()[0]
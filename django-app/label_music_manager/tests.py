@@ -1,11 +1,48 @@
 # Write your tests here. Use only the Django testing framework.
+import csv
+import gzip
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
 from datetime import date, timedelta
+from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
-from django.test import TestCase
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, transaction
+from django.http import HttpResponse
+from django.test import (
+    AsyncClient, Client, LiveServerTestCase, RequestFactory, TestCase, TransactionTestCase, override_settings,
+)
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from django.contrib.auth.models import User, Permission
 from rest_framework.exceptions import PermissionDenied
-from .models import Album, MusicManagerUser, Song, AlbumTracklistItem
+from rest_framework.renderers import JSONRenderer
+from PIL import Image
+from .generator import CatalogueGenerator
+from .importer import CatalogueImporter, read_json, read_ndjson
+from .api_views import CatalogueExportView
+from .checks import check_catalogue_cache_is_shared
+from .compression import brotli, get_accepted_encodings
+from .fast_serializers import AlbumReader, SongReader
+from .models import Album, CatalogueStat, Change, MusicManagerUser, Song, AlbumTracklistItem, Task
+from . import catalogue_cache, changes, exporter, importer, search, stats, tasks
+from .profiles import get_music_manager
+from .profiling import RequestProfilingMiddleware, normalize_sql
+from .renderers import FastJSONRenderer
+from .routers import ReadReplicaRouter
+from .serializers import AlbumSerializer, SongSerializer
+from .tracklists import sync_tracklist
+from .views import AlbumListView
 
 class AlbumModelTest(TestCase):
     def test_create_album(self):
@@ -106,7 +143,11 @@ class MusicManagerUserTest(TestCase):
         self.assertEqual(music_manager_user.user, self.user)
         self.assertEqual(music_manager_user.display_name, 'Test User')
 
-class AlbumViewTest(TestCase):
+class CatalogueFixturesMixin:
+    """
+    Viewer, artist and editor users with their profiles, an album with one
+    track and an empty album, for the test cases that work with all three roles.
+    """
     def setUp(self):
         # Create users
         self.viewer_user = User.objects.create_user(username='viewer', password='password')
@@ -155,6 +196,7 @@ class AlbumViewTest(TestCase):
             release_date=date.today(),
         )
 
+class AlbumViewTest(CatalogueFixturesMixin, TestCase):
     def test_unauthenticated_user_can_view_all_albums(self):
         response = self.client.get(reverse('album_list'))
         self.assertEqual(response.status_code, 200)
@@ -207,6 +249,30 @@ class AlbumViewTest(TestCase):
         album = response.context['album']
         self.assertEqual(album, self.album1)
 
+    def test_album_detail_page_conditional_get(self):
+        self.client.login(username='viewer', password='password')
+        url = reverse('album_detail', args=[self.album1.id])
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # The page differs per user
+        self.client.login(username='editor', password='password')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_album_detail_page_etag_changes_at_login(self):
+        self.client.login(username='viewer', password='password')
+        url = reverse('album_detail', args=[self.album1.id])
+        response = self.client.get(url)
+        self.assertTrue(response['ETag'].startswith('W/"'))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        # The cached logout form's CSRF token is no longer valid
+        self.client.logout()
+        self.client.login(username='viewer', password='password')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
     def test_album_edit_view_without_login_redirects(self):
         response = self.client.get(reverse('album_edit', args=[self.album1.id]))
         self.assertEqual(response.status_code, 302)
@@ -270,6 +336,57 @@ class AlbumViewTest(TestCase):
         self.assertIn('title', form.errors)
         self.assertEqual(form.errors['title'], ['This field is required.'])
 
+    def test_album_edit_lists_selected_tracks_only(self):
+        Song.objects.create(title='Library Song', length=90)
+        self.client.login(username='editor', password='password')
+        response = self.client.get(reverse('album_edit', args=[self.album1.id]))
+        self.assertEqual(response.context['selected_tracks'], [self.song1])
+        self.assertContains(response, 'value="%d"' % self.song1.id)
+        self.assertNotContains(response, 'Library Song')
+
+    def test_album_edit_query_count_independent_of_library_size(self):
+        self.client.login(username='editor', password='password')
+        with CaptureQueriesContext(connection) as small_library:
+            self.client.get(reverse('album_edit', args=[self.album1.id]))
+
+        Song.objects.bulk_create(Song(title=f'Song {i}', length=60) for i in range(50))
+        with self.assertNumQueries(len(small_library.captured_queries)):
+            self.client.get(reverse('album_edit', args=[self.album1.id]))
+        with CaptureQueriesContext(connection) as create_page:
+            self.client.get(reverse('album_create'))
+        self.assertLess(len(create_page.captured_queries), 10)
+
+    def test_album_edit_saves_tracks_in_submitted_order(self):
+        song2 = Song.objects.create(title='Test Song 2', length=150)
+        self.client.login(username='editor', password='password')
+        response = self.client.post(reverse('album_edit', args=[self.album1.id]), {
+            'title': 'Test Album',
+            'artist': 'Artist',
+            'price': 9.99,
+            'format': 'CD',
+            'release_date': '2023-01-01',
+            'tracks': [song2.id, self.song1.id],
+        })
+        self.assertRedirects(response, reverse('album_detail', args=[self.album1.id]))
+        items = AlbumTracklistItem.objects.filter(album=self.album1).order_by('position')
+        self.assertEqual([(item.song_id, item.position) for item in items], [(song2.id, 1), (self.song1.id, 2)])
+
+    def test_album_edit_with_unknown_track_is_rejected(self):
+        self.client.login(username='editor', password='password')
+        response = self.client.post(reverse('album_edit', args=[self.album1.id]), {
+            'title': 'Renamed',
+            'artist': 'Artist',
+            'price': 9.99,
+            'format': 'CD',
+            'release_date': '2023-01-01',
+            'tracks': [self.song1.id, 9999],
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('9999', str(response.context['form'].non_field_errors()))
+        # Nothing is saved when the tracklist is invalid
+        self.album1.refresh_from_db()
+        self.assertEqual(self.album1.title, 'Test Album')
+
     def test_album_delete_view_without_login_redirects(self):
         response = self.client.get(reverse('album_delete', args=[self.album1.id]))
         self.assertEqual(response.status_code, 302)
@@ -336,3 +453,2033 @@ class AlbumViewTest(TestCase):
         form = response.context['form']
         self.assertIn('title', form.errors)
         self.assertEqual(form.errors['title'], ['This field is required.'])
+
+class ReorderedAlbumMixin:
+    """
+    An album of two songs whose tracklist positions differ from the
+    order they were added in.
+    """
+    def setUp(self):
+        self.album = Album.objects.create(
+            title='Test Album',
+            artist='Artist',
+            price=9.99,
+            format='CD',
+            release_date=date.today(),
+        )
+        self.song1 = Song.objects.create(title='Second Song', length=100)
+        self.song2 = Song.objects.create(title='First Song', length=200)
+        AlbumTracklistItem.objects.create(album=self.album, song=self.song1, position=2)
+        AlbumTracklistItem.objects.create(album=self.album, song=self.song2, position=1)
+
+class AlbumApiTest(ReorderedAlbumMixin, TestCase):
+    def create_albums(self, count):
+        # Create albums with three tracks each
+        for i in range(count):
+            album = Album.objects.create(
+                title=f'Album {i}',
+                artist='Artist',
+                price=9.99,
+                format='DD',
+                release_date=date.today(),
+            )
+            for j in range(3):
+                song = Song.objects.create(title=f'Song {i}-{j}', length=60)
+                AlbumTracklistItem.objects.create(album=album, song=song, position=j + 1)
+
+    def test_album_detail_tracks_in_position_order(self):
+        response = self.client.get(reverse('albums-detail', args=[self.album.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([track['title'] for track in response.data['tracks']], ['First Song', 'Second Song'])
+        self.assertEqual(response.data['total_playtime'], 300)
+        self.assertEqual(response.data['track_count'], 2)
+
+    def test_empty_album_playtime(self):
+        album = Album.objects.create(
+            title='Empty Album',
+            artist='Artist',
+            price=9.99,
+            format='VL',
+            release_date=date.today(),
+        )
+        response = self.client.get(reverse('albums-detail', args=[album.id]))
+        self.assertEqual(response.data['total_playtime'], 0)
+        self.assertEqual(response.data['track_count'], 0)
+        self.assertEqual(response.data['tracks'], [])
+
+    def test_album_list_query_count_is_constant(self):
+        # The ETag aggregate, the page of IDs, and the uncached albums with
+        # their prefetched tracklists
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('albums-list'))
+        self.assertEqual(len(response.data['results']), 1)
+
+        self.create_albums(10)
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('albums-list'))
+        self.assertEqual(len(response.data['results']), 11)
+
+    def test_album_detail_query_count(self):
+        with self.assertNumQueries(3):
+            self.client.get(reverse('albums-detail', args=[self.album.id]))
+
+    def test_album_list_cursor_pagination(self):
+        self.create_albums(2)
+        response = self.client.get(reverse('albums-list'), {'page_size': 2})
+        self.assertEqual([album['id'] for album in response.data['results']], list(
+            Album.objects.order_by('id').values_list('id', flat=True)[:2]))
+        self.assertIsNone(response.data['previous'])
+
+        # Follow the cursor to the last page
+        response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIsNone(response.data['next'])
+
+    def test_song_list_cursor_pagination(self):
+        response = self.client.get(reverse('songs-list'), {'page_size': 1})
+        self.assertEqual(response.data['results'][0]['id'], self.song1.id)
+        self.assertIsNotNone(response.data['next'])
+
+    def test_album_list_conditional_get(self):
+        response = self.client.get(reverse('albums-list'))
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+
+        # A matching ETag is answered without serializing the albums
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('albums-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        # Other fieldsets are other representations
+        response = self.client.get(reverse('albums-list'), {'fields': 'id'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_album_etag_changes_with_tracklist_and_songs(self):
+        url = reverse('albums-detail', args=[self.album.id])
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.song1.title = 'Renamed'
+        self.song1.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        etag = response['ETag']
+        AlbumTracklistItem.objects.get(album=self.album, song=self.song2).delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_album_list_etag_changes_on_delete(self):
+        self.create_albums(1)
+        etag = self.client.get(reverse('albums-list'))['ETag']
+        Album.objects.filter(title='Album 0').delete()
+        response = self.client.get(reverse('albums-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_song_detail_if_modified_since(self):
+        url = reverse('songs-detail', args=[self.song1.id])
+        response = self.client.get(url)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_song_search(self):
+        response = self.client.get(reverse('songs-list'), {'search': 'first'})
+        self.assertEqual([song['id'] for song in response.data['results']], [self.song2.id])
+
+    def test_album_sparse_fieldset(self):
+        # Without tracks or descriptions, no tracklist prefetch runs
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('albums-list'), {'fields': 'id,title,total_playtime'})
+        self.assertEqual(response.data['results'][0], {'id': self.album.id, 'title': 'Test Album', 'total_playtime': 300})
+
+    def test_album_sparse_fieldset_expand_tracks(self):
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('albums-detail', args=[self.album.id]), {'fields': 'id', 'expand': 'tracks'})
+        self.assertEqual(set(response.data), {'id', 'tracks'})
+        self.assertEqual(len(response.data['tracks']), 2)
+
+class BulkImportTest(TestCase):
+    sample_data = os.path.join(os.path.dirname(__file__), 'management', 'sample_data.json')
+
+    def write_file(self, suffix, content):
+        handle, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(handle, 'w') as file:
+            file.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_sample_data_loads(self):
+        out = io.StringIO()
+        call_command('bulk_import', self.sample_data, stdout=out)
+        self.assertIn('rows/s', out.getvalue())
+        self.assertEqual(Album.objects.count(), 7)
+        self.assertEqual(Song.objects.count(), 10)
+
+        # Display names are stored as format codes and positions follow the file order
+        album = Album.objects.get(title='Dripping Stereo (Deluxe Edition)')
+        self.assertEqual(album.format, 'VL')
+        self.assertEqual(album.slug, 'dripping-stereo-deluxe-edition')
+        positions = list(album.albumtracklistitem_set.order_by('position').values_list('position', 'song__title'))
+        self.assertEqual(positions[0], (1, 'its too loud'))
+
+    def test_reimport_does_not_duplicate(self):
+        call_command('bulk_import', self.sample_data, stdout=io.StringIO())
+        items = AlbumTracklistItem.objects.count()
+        call_command('bulk_import', self.sample_data, stdout=io.StringIO())
+        self.assertEqual(Album.objects.count(), 7)
+        self.assertEqual(Song.objects.count(), 10)
+        self.assertEqual(AlbumTracklistItem.objects.count(), items)
+
+    def test_seed_uses_bulk_import(self):
+        call_command('seed', stdout=io.StringIO())
+        self.assertEqual(Album.objects.count(), 7)
+
+    def test_json_streaming_across_small_chunks(self):
+        # A tiny chunk size forces values to be split across reads
+        with open(self.sample_data) as file:
+            records = list(read_json(file, chunk_size=7))
+        self.assertEqual([kind for kind, _ in records].count('album'), 7)
+        self.assertEqual(records[-1][0], 'song')
+
+    def test_ndjson_import_with_tracklist_records(self):
+        path = self.write_file('.ndjson', '\n'.join([
+            '{"type": "album", "title": "A", "artist": "X", "price": 5, "format": "CD", "release_date": "2020-01-01"}',
+            '{"type": "song", "title": "One", "runtime": 100}',
+            '{"type": "song", "title": "Two", "runtime": 120}',
+            '{"type": "tracklist", "album": "A", "song": "Two", "position": 1}',
+            '{"type": "tracklist", "album": "A", "song": "One", "position": 2}',
+        ]))
+        call_command('bulk_import', path, stdout=io.StringIO())
+        album = Album.objects.get(title='A')
+        self.assertEqual([song.title for song in album.ordered_tracks], ['Two', 'One'])
+
+    def test_ndjson_lines_without_a_type_are_skipped(self):
+        path = self.write_file('.ndjson', '\n'.join([
+            '{"title": "No type"}',
+            '[1, 2]',
+            '"x"',
+            '{"type": "song", "title": "One", "runtime": 100}',
+        ]))
+        out = io.StringIO()
+        call_command('bulk_import', path, stdout=out)
+        self.assertIn('(3 skipped)', out.getvalue())
+        self.assertEqual(out.getvalue().count('Record without a type'), 3)
+        self.assertTrue(Song.objects.filter(title='One').exists())
+
+    def test_csv_rows_without_a_type_are_skipped(self):
+        path = self.write_file('.csv', (
+            'type,title,runtime\n'
+            ',No type,100\n'
+            'song,One,100\n'
+        ))
+        out = io.StringIO()
+        call_command('bulk_import', path, stdout=out)
+        self.assertIn('(1 skipped)', out.getvalue())
+        self.assertTrue(Song.objects.filter(title='One').exists())
+
+    def test_csv_import(self):
+        path = self.write_file('.csv', (
+            'type,title,artist,price,format,release_date,runtime,albums\n'
+            'album,B,Y,7.50,Digital Download,2021-05-05,,\n'
+            'song,Three,,,,,200,B\n'
+        ))
+        call_command('bulk_import', path, stdout=io.StringIO())
+        album = Album.objects.get(title='B')
+        self.assertEqual(album.format, 'DD')
+        self.assertEqual(album.ordered_tracks[0].length, 200)
+
+    def test_query_count_is_independent_of_rows(self):
+        records = [('album', {'title': f'Album {i}', 'artist': 'X', 'price': 1, 'format': 'CD',
+                              'release_date': '2020-01-01'}) for i in range(50)]
+        records += [('song', {'title': f'Song {i}', 'runtime': 60, 'albums': [f'Album {i}']}) for i in range(50)]
+        # Savepoint, album upsert, album index, owner links, album search rows,
+        # album change log, song lookup, song insert, song search rows, song
+        # change log, tracklist upsert, tracklist change log, album
+        # aggregates, album versions, album change log and release, with the
+        # catalogue stats read and written both times the albums change
+        with self.assertNumQueries(24):
+            stats = CatalogueImporter(batch_size=1000).run(records)
+        self.assertEqual(stats['tracklist_items'], 50)
+
+    def test_albums_of_other_artists_are_left_alone(self):
+        other = Album.objects.create(title='A', artist='Other', price=1, format='CD', release_date=date(2020, 1, 1))
+        updated_at = other.updated_at
+        CatalogueImporter().run([
+            ('album', {'title': 'A', 'artist': 'X', 'price': 1, 'format': 'CD', 'release_date': '2020-01-01'}),
+        ])
+        other.refresh_from_db()
+        self.assertEqual(other.updated_at, updated_at)
+        self.assertFalse(Change.objects.filter(kind='album', object_id=other.pk, action='updated').exists())
+        imported = Album.objects.get(title='A', artist='X')
+        self.assertTrue(Change.objects.filter(kind='album', object_id=imported.pk, action='updated').exists())
+
+    def test_invalid_records_are_skipped(self):
+        messages = []
+        stats = CatalogueImporter(warn=messages.append).run([('album', {'title': 'No artist'}), ('label', {})])
+        self.assertEqual(stats['skipped'], 2)
+        self.assertEqual(len(messages), 2)
+
+    def test_records_of_the_wrong_type_are_skipped(self):
+        album = {'title': 'A', 'artist': 'X', 'price': 1, 'release_date': '2020-01-01'}
+        stats = CatalogueImporter(warn=lambda message: None).run([
+            ('album', {**album, 'format': None}),
+            ('album', {**album, 'format': 3}),
+            ('song', {'title': 'Song', 'runtime': None}),
+            ('tracklist', ['A', 'Song']),
+            ('album', {**album, 'format': 'CD'}),
+        ])
+        self.assertEqual((stats['skipped'], stats['albums']), (4, 1))
+
+class TracklistSyncTest(TestCase):
+    def setUp(self):
+        self.album = Album.objects.create(
+            title='Test Album',
+            artist='Artist',
+            price=9.99,
+            format='CD',
+            release_date=date.today(),
+        )
+        self.songs = [Song.objects.create(title=f'Song {i}', length=60) for i in range(4)]
+        sync_tracklist(self.album, [song.id for song in self.songs[:3]])
+
+    def positions(self):
+        items = AlbumTracklistItem.objects.filter(album=self.album).order_by('position')
+        return [(item.song_id, item.position) for item in items]
+
+    def test_sync_applies_diff(self):
+        song0, song1, song2, song3 = self.songs
+        result = sync_tracklist(self.album, [song2.id, song0.id, song3.id])
+        self.assertEqual(result, {'created': 1, 'deleted': 1, 'updated': 2})
+        self.assertEqual(self.positions(), [(song2.id, 1), (song0.id, 2), (song3.id, 3)])
+
+    def test_unchanged_tracklist_writes_nothing(self):
+        # Savepoint, song validation, existing rows and release
+        with self.assertNumQueries(4):
+            result = sync_tracklist(self.album, [str(song.id) for song in self.songs[:3]])
+        self.assertEqual(result, {'created': 0, 'deleted': 0, 'updated': 0})
+
+    def test_duplicates_keep_first_position(self):
+        song0, song1 = self.songs[:2]
+        sync_tracklist(self.album, [song1.id, song0.id, song1.id])
+        self.assertEqual(self.positions(), [(song1.id, 1), (song0.id, 2)])
+
+    def test_invalid_ids_raise(self):
+        with self.assertRaises(ValidationError):
+            sync_tracklist(self.album, [self.songs[0].id, 'abc'])
+        self.assertEqual(len(self.positions()), 3)
+
+class MusicManagerQueryTest(CatalogueFixturesMixin, TestCase):
+    """
+    Each view resolves the profile and role with one query each, on top of
+    the session and user lookups and the view's own queries.
+    """
+    def test_album_list_queries(self):
+        # The page's album IDs, then the albums of its uncached cards
+        with self.assertNumQueries(2):
+            self.client.get(reverse('album_list'))
+
+        self.client.login(username='artist', password='password')
+        # Session, user, profile, role permissions and album IDs; the card is cached
+        with self.assertNumQueries(5):
+            self.client.get(reverse('album_list'))
+
+    def test_album_detail_queries(self):
+        self.client.login(username='editor', password='password')
+        # Album, session, user, profile, role permissions and the tracklist with its songs
+        with self.assertNumQueries(6):
+            self.client.get(reverse('album_detail', args=[self.album1.id]))
+
+    def test_album_edit_queries(self):
+        self.client.login(username='artist', password='password')
+        # Session, user, album, the tracklist with its songs, profile and role permissions
+        with self.assertNumQueries(6):
+            self.client.get(reverse('album_edit', args=[self.album1.id]))
+
+    def test_album_delete_queries(self):
+        self.client.login(username='editor', password='password')
+        with self.assertNumQueries(5):
+            self.client.get(reverse('album_delete', args=[self.album1.id]))
+
+    def test_album_create_queries(self):
+        self.client.login(username='editor', password='password')
+        with self.assertNumQueries(4):
+            self.client.get(reverse('album_create'))
+
+    def test_roles_resolved(self):
+        request = RequestFactory().get('/')
+        request.user = self.artist_user
+        music_manager = get_music_manager(request)
+        self.assertEqual(music_manager.role, 'Artist')
+        self.assertEqual(music_manager.display_name, 'Artist')
+        # The profile is only loaded once per request
+        with self.assertNumQueries(0):
+            self.assertIs(get_music_manager(request), music_manager)
+
+    @override_settings(MUSIC_MANAGER_CACHE_TIMEOUT=60)
+    def test_cached_role_is_invalidated(self):
+        cache.clear()
+        self.client.login(username='viewer', password='password')
+        self.client.get(reverse('album_list'))
+        # Session and user only once the profile and album list are cached
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('album_list'))
+        self.assertEqual(response.context['music_manager'].role, 'Viewer')
+
+        self.viewer_user.user_permissions.add(Permission.objects.get(codename='Editor'))
+        response = self.client.get(reverse('album_list'))
+        self.assertEqual(response.context['music_manager'].role, 'Editor')
+
+        self.viewer.display_name = 'Renamed'
+        self.viewer.save()
+        response = self.client.get(reverse('album_list'))
+        self.assertEqual(response.context['display_name'], 'Renamed')
+
+class AlbumOwnerTest(CatalogueFixturesMixin, TestCase):
+    def test_albums_linked_to_artist_profile(self):
+        self.assertEqual(self.album1.owner, self.artist)
+        self.assertIsNone(self.album2.owner)
+
+        # A profile created later claims the albums under its name
+        user = User.objects.create_user(username='artist2', password='password')
+        profile = MusicManagerUser.objects.create(user=user, display_name='Artist2')
+        self.album2.refresh_from_db()
+        self.assertEqual(self.album2.owner, profile)
+
+        # Moving an album to another artist relinks it
+        self.album1.artist = 'Artist2'
+        self.album1.save()
+        self.album1.refresh_from_db()
+        self.assertEqual(self.album1.owner, profile)
+
+    def test_renamed_profile_keeps_its_albums(self):
+        self.artist.display_name = 'Renamed Artist'
+        self.artist.save()
+        self.client.login(username='artist', password='password')
+        self.assertContains(self.client.get(reverse('album_list')), 'Test Album')
+        self.assertEqual(self.client.get(reverse('album_edit', args=[self.album1.id])).status_code, 200)
+        self.assertContains(self.client.get(reverse('album_detail', args=[self.album1.id])), 'Edit Album')
+
+    def test_buttons_follow_ownership(self):
+        # An artist named like an album's artist, without owning it
+        Album.objects.filter(pk=self.album2.pk).update(artist='Artist')
+        self.client.login(username='artist', password='password')
+        self.assertNotContains(self.client.get(reverse('album_detail', args=[self.album2.id])), 'Edit Album')
+
+    def test_import_links_owners(self):
+        CatalogueImporter().run([('album', {
+            'title': 'Imported', 'artist': 'Artist', 'price': 5, 'format': 'CD', 'release_date': '2020-01-01',
+        })])
+        self.assertEqual(Album.objects.get(title='Imported').owner, self.artist)
+
+    def test_backfill_command(self):
+        Album.objects.update(owner=None)
+        out = io.StringIO()
+        call_command('link_album_owners', stdout=out)
+        self.assertIn('Linked 1 albums', out.getvalue())
+        self.assertEqual(Album.objects.get(pk=self.album1.pk).owner, self.artist)
+
+    def assert_uses_index(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(f'USING INDEX {index_name}', plan)
+        # Neither a table scan nor a separate sort step
+        self.assertNotIn('SCAN label_music_manager_album', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_owner_lookup_uses_index(self):
+        plan = Album.objects.filter(owner=self.artist).explain()
+        self.assertIn('SEARCH label_music_manager_album USING INDEX', plan)
+
+    def test_list_orderings_use_composite_indexes(self):
+        self.assert_uses_index(
+            Album.objects.filter(artist='Artist').order_by('release_date'), 'album_artist_release_idx'
+        )
+        self.assert_uses_index(
+            Album.objects.filter(format='CD').order_by('-release_date'), 'album_format_release_idx'
+        )
+
+class CatalogueCacheTest(TestCase):
+    def setUp(self):
+        catalogue_cache.get_cache().clear()
+        catalogue_cache.stats.reset()
+        self.album = Album.objects.create(
+            title='Test Album',
+            artist='Artist',
+            description='First description',
+            price=9.99,
+            format='CD',
+            release_date=date.today(),
+        )
+        self.song = Song.objects.create(title='Test Song', length=100)
+        AlbumTracklistItem.objects.create(album=self.album, song=self.song, position=1)
+
+    def test_album_payloads_are_cached(self):
+        self.client.get(reverse('albums-list'))
+        # Only the ETag aggregate and the page of IDs on a cache hit
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('albums-list'))
+        self.assertEqual(response.data['results'][0]['tracks'][0]['title'], 'Test Song')
+        self.assertEqual(catalogue_cache.stats.snapshot()['album'], {'hits': 1, 'misses': 1})
+
+        # The detail endpoint shares the payloads cached by the list
+        with self.assertNumQueries(1):
+            self.client.get(reverse('albums-detail', args=[self.album.id]))
+
+    def test_filtered_details_bypass_the_cache(self):
+        url = reverse('albums-detail', args=[self.album.id])
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(self.client.get(url, {'min_tracks': 999}).status_code, 404)
+        self.assertEqual(self.client.get(url, {'max_tracks': 1}).status_code, 200)
+        self.assertEqual(self.client.get(url, {'min_tracks': 'many'}).status_code, 400)
+
+    def test_entries_stored_before_commit_are_invalidated(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.album.description = 'Changed'
+                self.album.save()
+                # Stands in for another connection, which still reads the old row
+                catalogue_cache.get_or_set_album(self.album.pk, 'en', lambda: 'stale')
+        self.assertEqual(catalogue_cache.get_or_set_album(self.album.pk, 'en', lambda: 'fresh'), 'fresh')
+
+    def test_album_payload_invalidated_by_song_and_tracklist_changes(self):
+        url = reverse('albums-detail', args=[self.album.id])
+        self.client.get(url)
+
+        self.song.title = 'Renamed Song'
+        self.song.save()
+        self.assertEqual(self.client.get(url).data['tracks'][0]['title'], 'Renamed Song')
+
+        song2 = Song.objects.create(title='Added Song', length=60)
+        self.album.tracks.add(song2)
+        self.assertEqual(self.client.get(url).data['track_count'], 2)
+
+        sync_tracklist(self.album, [song2.id])
+        self.assertEqual([track['title'] for track in self.client.get(url).data['tracks']], ['Added Song'])
+
+    def test_other_spellings_of_an_id_share_its_entry(self):
+        url = f"{reverse('albums-list')}0{self.album.id}/"
+        self.client.get(url)
+        self.album.refresh_from_db()
+        self.album.title = 'Renamed'
+        self.album.save()
+        self.assertEqual(self.client.get(url).data['title'], 'Renamed')
+        self.assertEqual(self.client.get(f"{reverse('albums-list')}x1/").status_code, 404)
+
+    def test_album_list_fragment_invalidated_by_album_changes(self):
+        self.client.get(reverse('album_list'))
+        with self.assertNumQueries(0):
+            self.client.get(reverse('album_list'))
+
+        self.album.description = 'Second description'
+        self.album.save()
+        self.assertContains(self.client.get(reverse('album_list')), 'Second description')
+
+        self.album.delete()
+        self.assertNotContains(self.client.get(reverse('album_list')), 'Second description')
+
+    def test_album_detail_fragment_cached(self):
+        url = reverse('album_detail', args=[self.album.id])
+        self.client.get(url)
+        # Only the album itself is read once its summary is cached
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertContains(response, 'Test Song')
+
+    def test_import_invalidates_lists(self):
+        self.client.get(reverse('album_list'))
+        CatalogueImporter().run([('album', {
+            'title': 'Test Album', 'artist': 'Artist', 'description': 'Imported', 'price': 5,
+            'format': 'CD', 'release_date': '2020-01-01',
+        })])
+        self.assertContains(self.client.get(reverse('album_list')), 'Imported')
+
+    def test_cache_stats_endpoint(self):
+        self.assertEqual(self.client.get(reverse('cache_stats')).status_code, 403)
+        User.objects.create_superuser(username='admin', password='password')
+        self.client.login(username='admin', password='password')
+        self.client.get(reverse('albums-list'))
+        response = self.client.get(reverse('cache_stats'))
+        self.assertEqual(response.data['stats']['album'], {'hits': 0, 'misses': 1})
+
+class CoverVariantTest(TestCase):
+    def setUp(self):
+        catalogue_cache.get_cache().clear()
+        # Store covers in a temporary media directory and run queued tasks inline
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media.name, TASK_QUEUE_EAGER=True)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.media_root = media.name
+
+    def make_cover(self, name='cover.png', size=(800, 800)):
+        buffer = io.BytesIO()
+        Image.new('RGBA', size, (200, 30, 30, 255)).save(buffer, 'PNG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+    def create_album(self, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            album = Album.objects.create(
+                title='Cover Album',
+                artist='Artist',
+                price=9.99,
+                format='CD',
+                release_date=date.today(),
+                **kwargs,
+            )
+        album.refresh_from_db()
+        return album
+
+    def test_variants_created_on_upload(self):
+        album = self.create_album(cover_image=self.make_cover())
+        self.assertEqual(album.cover_variants['source'], album.cover_image.name)
+        for extension in ('webp', 'jpeg'):
+            self.assertEqual(sorted(album.cover_variants[extension], key=int), ['150', '300', '600'])
+            for name in album.cover_variants[extension].values():
+                self.assertTrue(os.path.exists(os.path.join(self.media_root, name)))
+        with Image.open(os.path.join(self.media_root, album.cover_variants['jpeg']['300'])) as image:
+            self.assertEqual((image.format, image.size), ('JPEG', (300, 300)))
+
+    def test_small_covers_are_not_upscaled(self):
+        album = self.create_album(cover_image=self.make_cover(size=(200, 100)))
+        self.assertEqual(sorted(album.cover_variants['webp'], key=int), ['150', '200'])
+
+    def test_srcset_in_api_and_pages(self):
+        album = self.create_album(cover_image=self.make_cover())
+        response = self.client.get(reverse('albums-detail', args=[album.id]))
+        self.assertIn('-150w.jpeg 150w', response.data['cover_srcset'])
+        self.assertTrue(response.data['cover_webp_srcset'].startswith('http://testserver/media/covers/'))
+        self.assertContains(self.client.get(reverse('album_list')), 'type="image/webp"')
+
+    def test_replaced_cover_invalidates_variants(self):
+        album = self.create_album(cover_image=self.make_cover())
+        with self.captureOnCommitCallbacks(execute=True):
+            album.cover_image = self.make_cover('other.png')
+            album.save()
+        album.refresh_from_db()
+        self.assertEqual(album.cover_variants['source'], album.cover_image.name)
+        self.assertIn('other-', album.cover_variants['webp']['150'])
+
+    def test_unreadable_cover_leaves_album_without_variants(self):
+        cover = SimpleUploadedFile('broken.png', b'not an image', content_type='image/png')
+        with self.assertLogs('label_music_manager.covers', 'WARNING'):
+            album = self.create_album(cover_image=cover)
+        self.assertEqual(album.cover_variants, {})
+        self.assertEqual(album.cover_srcset, '')
+
+    def test_backfill_command(self):
+        # Imported albums are upserted without post_save, so get no variants
+        Image.new('RGB', (400, 400)).save(os.path.join(self.media_root, 'imported.png'))
+        CatalogueImporter().run([('album', {
+            'title': 'Imported', 'artist': 'Artist', 'price': 5, 'format': 'CD',
+            'release_date': '2020-01-01', 'cover': 'imported.png',
+        })])
+        album = Album.objects.get(title='Imported')
+        self.assertEqual(album.cover_variants, {})
+
+        out = io.StringIO()
+        call_command('generate_cover_variants', stdout=out)
+        self.assertIn('1 of 1 albums', out.getvalue())
+        album.refresh_from_db()
+        self.assertEqual(sorted(album.cover_variants['jpeg'], key=int), ['150', '300', '400'])
+
+        # Albums with current variants are skipped unless forced
+        out = io.StringIO()
+        call_command('generate_cover_variants', stdout=out)
+        self.assertIn('0 of 0 albums', out.getvalue())
+
+class SearchTest(CatalogueFixturesMixin, TestCase):
+    def search(self, query, **params):
+        return self.client.get(reverse('search'), {'q': query, **params}).data
+
+    def test_prefix_matches_ranked_by_title(self):
+        Album.objects.create(
+            title='Deep Blue', artist='Artist2', description='Songs about the sea', price=5,
+            format='CD', release_date=date.today(),
+        )
+        data = self.search('sea')
+        # A title match outranks a description match
+        self.assertEqual([album['title'] for album in data['albums']], ['Sealife', 'Deep Blue'])
+        self.assertEqual(self.search('tes son')['songs'][0]['title'], 'Test Song 1')
+        self.assertEqual(self.search('nothing matches')['albums'], [])
+
+    def test_availability_is_probed_once(self):
+        self.assertTrue(search.is_available())
+        with self.assertNumQueries(0):
+            self.assertTrue(search.is_available())
+
+        self.addCleanup(setattr, search, '_available', True)
+        search._available = None
+        with connection.execute_wrapper(lambda execute, sql, params, many, context: execute(
+            sql.replace('ENABLE_FTS5', 'ENABLE_MISSING'), params, many, context,
+        )):
+            self.assertFalse(search.is_available())
+        self.assertEqual(self.search('sea')['albums'][0]['title'], 'Sealife')
+
+    def test_index_follows_changes(self):
+        self.album2.title = 'Renamed'
+        self.album2.save()
+        self.assertEqual(self.search('sealife')['albums'], [])
+        self.assertEqual(self.search('renam')['albums'][0]['id'], self.album2.id)
+
+        self.song1.delete()
+        self.assertEqual(self.search('test song')['songs'], [])
+
+        CatalogueImporter().run([
+            ('album', {'title': 'Imported Album', 'artist': 'X', 'price': 5, 'format': 'CD',
+                       'release_date': '2020-01-01'}),
+            ('song', {'title': 'Imported Song', 'runtime': 60, 'albums': ['Imported Album']}),
+        ])
+        data = self.search('imported')
+        self.assertEqual([album['title'] for album in data['albums']], ['Imported Album'])
+        self.assertEqual([song['title'] for song in data['songs']], ['Imported Song'])
+
+    def test_artists_only_find_their_albums(self):
+        self.assertEqual(len(self.search('sealife')['albums']), 1)
+        self.client.login(username='artist', password='password')
+        self.assertEqual(self.search('sealife')['albums'], [])
+        self.assertEqual(self.search('test')['albums'][0]['title'], 'Test Album')
+        self.assertEqual(self.search('test')['songs'][0]['title'], 'Test Song 1')
+        self.assertNotContains(self.client.get(reverse('album_list'), {'q': 'sealife'}), 'Sealife cover')
+
+    def test_templated_list_search(self):
+        response = self.client.get(reverse('album_list'), {'q': 'seal'})
+        self.assertContains(response, 'Sealife')
+        self.assertNotContains(response, 'Test Album')
+        self.assertContains(self.client.get(reverse('album_list'), {'q': 'zzz'}), 'No albums match')
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get(reverse('search'), {'q': 'a', 'type': 'user'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('search'), {'q': 'a', 'limit': 0}).status_code, 400)
+
+    def test_rebuild_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM label_music_manager_search')
+        out = io.StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('Indexed 3 albums and songs', out.getvalue())
+        self.assertEqual(self.search('sealife')['albums'][0]['id'], self.album2.id)
+
+class SQLiteProfileTest(TestCase):
+    def test_pragmas_applied_on_connect(self):
+        with connection.cursor() as cursor:
+            pragmas = {}
+            for name in ('journal_mode', 'synchronous', 'temp_store', 'cache_size', 'busy_timeout'):
+                cursor.execute(f'PRAGMA {name}')
+                pragmas[name] = cursor.fetchone()[0]
+        # The in-memory test database keeps its journal in memory whatever is asked
+        self.assertEqual(pragmas['journal_mode'], 'wal' if settings.CONCURRENCY_TESTS else 'memory')
+        # NORMAL synchronous, in-memory temp store and a 64 MiB page cache
+        self.assertEqual((pragmas['synchronous'], pragmas['temp_store']), (1, 2))
+        self.assertEqual(pragmas['cache_size'], -64 * 1024)
+        self.assertEqual(pragmas['busy_timeout'], 20000)
+
+    def test_transactions_take_the_write_lock_up_front(self):
+        self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+
+@unittest.skipUnless(settings.CONCURRENCY_TESTS, 'Set DJANGO_CONCURRENCY_TESTS=1 to test on a database file.')
+class SQLiteConcurrencyTest(TransactionTestCase):
+    """
+    Edits an album and reads the API from several threads at once, each with
+    its own connection to the test database file.
+    """
+    # Includes the read replica when one is configured
+    databases = '__all__'
+    threads = 6
+    rounds = 5
+
+    def setUp(self):
+        self.editor_user = User.objects.create_user(username='editor')
+        self.editor_user.user_permissions.add(Permission.objects.get(codename='Editor'))
+        MusicManagerUser.objects.create(user=self.editor_user, display_name='Editor')
+        self.album = Album.objects.create(
+            title='Busy Album', artist='Artist', price=9.99, format='CD', release_date=date.today(),
+        )
+        self.songs = [Song.objects.create(title=f'Song {i}', length=60) for i in range(4)]
+
+    def work(self, index, errors):
+        client = Client()
+        client.force_login(self.editor_user)
+        try:
+            for round_number in range(self.rounds):
+                # Each edit reorders the tracklist differently
+                tracks = self.songs[index % 4:] + self.songs[:index % 4]
+                response = client.post(reverse('album_edit', args=[self.album.id]), {
+                    'cover_image': 'no_cover.jpg',
+                    'title': 'Busy Album',
+                    'description': f'Edit {index}-{round_number}',
+                    'artist': 'Artist',
+                    'price': 9.99,
+                    'format': 'CD',
+                    'release_date': '2023-01-01',
+                    'tracks': [song.id for song in tracks],
+                })
+                if response.status_code != 302:
+                    errors.append(f'Edit returned {response.status_code}')
+                for url in (reverse('albums-list'), reverse('albums-detail', args=[self.album.id])):
+                    response = client.get(url)
+                    if response.status_code != 200:
+                        errors.append(f'{url} returned {response.status_code}')
+        except Exception as error:
+            errors.append(repr(error))
+        finally:
+            connection.close()
+
+    def test_concurrent_edits_and_reads(self):
+        errors = []
+        workers = [threading.Thread(target=self.work, args=(index, errors)) for index in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(errors, [])
+        self.album.refresh_from_db()
+        self.assertTrue(self.album.description.startswith('Edit '))
+        self.assertEqual(self.album.tracks.count(), 4)
+
+    def test_router_reads_own_writes(self):
+        router = ReadReplicaRouter()
+        self.assertEqual(router.db_for_read(Album), 'replica')
+        with transaction.atomic():
+            self.assertEqual(router.db_for_read(Album), 'default')
+        self.assertEqual(router.db_for_write(Album), 'default')
+
+class AsyncApiTest(ReorderedAlbumMixin, TestCase):
+    async def test_album_detail_matches_sync_api(self):
+        client = AsyncClient()
+        response = await client.get(reverse('async-albums-detail', args=[self.album.id]))
+        expected = await client.get(reverse('albums-detail', args=[self.album.id]))
+        self.assertEqual(response.json(), expected.json())
+        self.assertEqual([track['title'] for track in response.json()['tracks']], ['First Song', 'Second Song'])
+
+        response = await client.get(reverse('async-albums-detail', args=[self.album.id + 100]))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_album_list_pages(self):
+        client = AsyncClient()
+        await Album.objects.acreate(
+            title='Second Album', artist='Artist', price=5, format='DD', release_date=date.today(),
+        )
+        response = await client.get(reverse('async-albums-list'), {'page_size': 1, 'fields': 'id,title'})
+        data = response.json()
+        self.assertEqual(data['results'], [{'id': self.album.id, 'title': 'Test Album'}])
+
+        response = await client.get(data['next'])
+        self.assertEqual([album['title'] for album in response.json()['results']], ['Second Album'])
+        self.assertIsNone(response.json()['next'])
+
+        response = await client.get(reverse('async-albums-list'), {'page_size': 1000})
+        self.assertEqual(response.status_code, 400)
+
+    async def test_songs_and_search(self):
+        client = AsyncClient()
+        response = await client.get(reverse('async-songs-list'), {'search': 'first'})
+        self.assertEqual([song['id'] for song in response.json()['results']], [self.song2.id])
+        response = await client.get(reverse('async-songs-detail', args=[self.song1.id]))
+        self.assertEqual(response.json()['title'], 'Second Song')
+
+        response = await client.get(reverse('async-search'), {'q': 'firs'})
+        expected = await client.get(reverse('search'), {'q': 'firs'})
+        self.assertEqual(response.json(), expected.json())
+        self.assertEqual(response.json()['songs'][0]['title'], 'First Song')
+
+    def test_asgi_application(self):
+        from MyMusicMaestro.asgi import application
+        self.assertTrue(callable(application))
+
+class ReadPathBenchmarkTest(LiveServerTestCase):
+    def test_benchmark_command(self):
+        Album.objects.create(title='Album', artist='Artist', price=5, format='CD', release_date=date.today())
+        out = io.StringIO()
+        call_command(
+            'benchmark_read_path',
+            f'sync={self.live_server_url}/api/albums/',
+            f'async={self.live_server_url}/api/async/albums/',
+            '--clients=4', '--requests=2', '--send-delay=0', '--read-delay=0', '--json',
+            stdout=out,
+        )
+        results = json.loads(out.getvalue())
+        for name in ('sync', 'async'):
+            self.assertEqual((results[name]['requests'], results[name]['errors']), (8, 0))
+            self.assertGreater(results[name]['requests_per_second'], 0)
+
+class BulkTracklistTest(TestCase):
+    def setUp(self):
+        self.album = Album.objects.create(
+            title='Bulk Album', artist='Artist', price=9.99, format='CD', release_date=date.today(),
+        )
+        self.songs = [Song.objects.create(title=f'Song {i}', length=60) for i in range(100)]
+
+    def test_bulk_items(self):
+        AlbumTracklistItem.objects.create(album=self.album, song=self.songs[0], position=1)
+        response = self.client.post(reverse('tracklist-bulk'), [
+            {'album': self.album.id, 'song': self.songs[0].id, 'position': 3},
+            {'album': self.album.id, 'song': self.songs[1].id, 'position': 1},
+            {'album': self.album.id, 'song': self.songs[2].id},
+        ], content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(item['status'], item['position']) for item in response.data['results']],
+            [('updated', 3), ('created', 1), ('created', 4)],
+        )
+        self.assertEqual(self.album.ordered_tracks, [self.songs[1], self.songs[0], self.songs[2]])
+
+    def test_bulk_items_report_per_item_errors(self):
+        response = self.client.post(reverse('tracklist-bulk'), [
+            {'album': self.album.id, 'song': self.songs[0].id},
+            {'album': self.album.id, 'song': 99999},
+            {'album': self.album.id, 'song': self.songs[0].id},
+        ], content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        errors = response.data['errors']
+        self.assertEqual(errors[0], {})
+        self.assertIn('song', errors[1])
+        self.assertIn('non_field_errors', errors[2])
+        # Nothing is written when any item is invalid
+        self.assertFalse(AlbumTracklistItem.objects.exists())
+
+        response = self.client.post(reverse('tracklist-bulk'), [{'album': 'x', 'song': 1}],
+                                    content_type='application/json')
+        self.assertIn('album', response.data['errors'][0])
+
+    def replace(self, songs):
+        return self.client.put(
+            reverse('tracklist-replace', args=[self.album.id]), {'songs': songs}, content_type='application/json'
+        )
+
+    def test_replace_tracklist_in_constant_queries(self):
+        song_ids = [song.id for song in self.songs]
+        # Album, song check, savepoint, current rows, insert, change log,
+        # aggregates, touch, album change log, catalogue stats (album, stats
+        # and counted values read, stats and counted values written) and release
+        with self.assertNumQueries(14):
+            response = self.replace(song_ids)
+        self.assertEqual(response.data['created'], 100)
+
+        reordered = song_ids[50:] + song_ids[:40]
+        # As above, with the deleted rows read, logged, deleted and their
+        # album's aggregates and version updated and logged once, and one
+        # bulk update instead of the insert. The stats find nothing more to
+        # change when the album is touched the second time.
+        with self.assertNumQueries(21):
+            response = self.replace(reordered)
+        self.assertEqual((response.data['deleted'], response.data['updated']), (10, 90))
+        self.assertEqual([song.id for song in self.album.ordered_tracks], reordered)
+
+    def test_replace_reports_invalid_songs(self):
+        response = self.replace([self.songs[0].id, 'abc', 99999, self.songs[0].id])
+        self.assertEqual(response.status_code, 400)
+        errors = response.data['errors']['songs']
+        self.assertIsNone(errors[0])
+        self.assertEqual(sum(error is not None for error in errors), 3)
+        for value in (True, 1.5):
+            response = self.replace([value])
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('is not a valid song ID', response.data['errors']['songs'][0])
+        self.assertEqual(self.replace([float(self.songs[0].id)]).data['created'], 1)
+        self.assertEqual(self.replace([]).data['created'], 0)
+        self.assertEqual(
+            self.client.put(reverse('tracklist-replace', args=[9999]), {'songs': []},
+                            content_type='application/json').status_code,
+            404,
+        )
+
+class CatalogueGeneratorTest(TestCase):
+    def test_same_seed_gives_same_catalogue(self):
+        first, second = CatalogueGenerator(seed=3), CatalogueGenerator(seed=3)
+        self.assertEqual([album.title for album in first.albums()], [album.title for album in second.albums()])
+        self.assertEqual(list(first.songs()), list(second.songs()))
+        self.assertEqual(first.track_counts(), second.track_counts())
+        self.assertNotEqual(first.track_counts(), CatalogueGenerator(seed=4).track_counts())
+
+    def test_generate_catalogue(self):
+        call_command('generate_catalogue', albums=20, songs=300, artists=3, stdout=io.StringIO())
+        self.assertEqual((Album.objects.count(), Song.objects.count()), (20, 300))
+        self.assertTrue(AlbumTracklistItem.objects.exists())
+        # Every album belongs to one of the generated artists' profiles
+        self.assertFalse(Album.objects.filter(owner__isnull=True).exists())
+        self.assertEqual(MusicManagerUser.objects.filter(albums__isnull=False).distinct().count(), 3)
+
+        with self.assertRaises(CommandError):
+            call_command('generate_catalogue', albums=5, songs=5, stdout=io.StringIO())
+        call_command('generate_catalogue', albums=5, songs=50, artists=3, clear=True, stdout=io.StringIO())
+        self.assertEqual((Album.objects.count(), Song.objects.count()), (5, 50))
+
+class BenchmarkTest(TestCase):
+    def run_benchmarks(self, budgets):
+        with tempfile.TemporaryDirectory() as directory:
+            budgets_path = os.path.join(directory, 'budgets.json')
+            output_path = os.path.join(directory, 'baseline.json')
+            with open(budgets_path, 'w') as stream:
+                json.dump(budgets, stream)
+            try:
+                call_command(
+                    'run_benchmarks', scale=['tiny'], repeats=1, in_place=True, budgets=budgets_path,
+                    output=output_path, stdout=io.StringIO(),
+                )
+            finally:
+                with open(output_path) as stream:
+                    self.baseline = json.load(stream)
+
+    def test_records_baseline_within_budget(self):
+        self.run_benchmarks({'tiny': {'album_list': {'queries': 100}}})
+        results = self.baseline['results']['tiny']
+        for name in ('album_list', 'album_detail', 'album_edit', 'api_albums_list', 'api_songs_detail',
+                     'api_tracklist_list', 'importer'):
+            self.assertGreater(results[name]['ms'], 0)
+            self.assertGreater(results[name]['queries'], 0)
+            self.assertGreater(results[name]['peak_kb'], 0)
+        # Imports are rolled back
+        self.assertFalse(Album.objects.filter(title__startswith='Imported').exists())
+
+    def test_fails_over_budget(self):
+        with self.assertRaisesMessage(CommandError, 'tiny album_edit: queries'):
+            self.run_benchmarks({'tiny': {'album_edit': {'queries': 0}}})
+        self.assertGreater(self.baseline['results']['tiny']['album_edit']['queries'], 0)
+
+@override_settings(REQUEST_PROFILING=True, REQUEST_PROFILING_SLOW_MS=0, REQUEST_PROFILING_DUPLICATE_QUERIES=5)
+class RequestProfilingTest(CatalogueFixturesMixin, TestCase):
+    def get_logged(self, url):
+        with self.assertLogs('label_music_manager.profiling', 'WARNING') as logs:
+            response = self.client.get(url)
+        return response, json.loads(logs.records[0].getMessage())
+
+    def test_server_timing_and_slow_request_log(self):
+        self.client.login(username='editor', password='password')
+        response, record = self.get_logged(reverse('album_detail', args=[self.album1.id]))
+        timing = response.headers['Server-Timing']
+        for metric in ('sql;dur=', 'view;dur=', 'template;dur=', 'permissions;dur=', 'total;dur='):
+            self.assertIn(metric, timing)
+        self.assertEqual((record['endpoint'], record['status'], record['reasons']), ('GET album_detail', 200, ['slow']))
+        self.assertGreater(record['sql_count'], 0)
+        self.assertGreaterEqual(record['total_ms'], record['template_ms'])
+
+        response, record = self.get_logged(reverse('albums-detail', args=[self.album1.id]))
+        self.assertIn('serializer;dur=', response.headers['Server-Timing'])
+        self.assertGreater(record['serializer_ms'], 0)
+
+    @override_settings(REQUEST_PROFILING_SLOW_MS=60000)
+    def test_flags_repeated_queries(self):
+        def get_response(request):
+            for song in Song.objects.all():
+                Album.objects.filter(tracks=song).first()
+            return HttpResponse()
+
+        for index in range(5):
+            Song.objects.create(title=f'Song {index}', length=60)
+        with self.assertLogs('label_music_manager.profiling', 'WARNING') as logs:
+            RequestProfilingMiddleware(get_response)(RequestFactory().get('/'))
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['reasons'], ['duplicate_queries'])
+        self.assertEqual(record['duplicates'][0]['count'], Song.objects.count())
+        self.assertEqual(record['endpoint'], 'GET <unresolved>')
+
+    @override_settings(DEBUG=True)
+    async def test_async_requests_are_not_adapted(self):
+        # With DEBUG, Django logs each sync-only middleware it adapts while
+        # loading the middleware chain
+        with self.assertNoLogs('django.request', 'DEBUG'):
+            with self.assertLogs('label_music_manager.profiling', 'WARNING'):
+                response = await AsyncClient().get(reverse('async-albums-detail', args=[self.album1.id]))
+        self.assertRegex(response.headers['Server-Timing'], r'desc="[1-9]\d* queries"')
+
+    @override_settings(REQUEST_PROFILING_SLOW_MS=60000)
+    def test_samples_requests_that_are_not_flagged(self):
+        response, record = self.get_logged(reverse('album_list'))
+        self.assertEqual((record['reasons'], record['sample_rate']), ([], 1))
+        with override_settings(REQUEST_PROFILING_SAMPLE_RATE=0):
+            with self.assertNoLogs('label_music_manager.profiling', 'WARNING'):
+                self.client.get(reverse('album_list'))
+
+    def test_normalize_sql(self):
+        self.assertEqual(
+            normalize_sql("SELECT * FROM t WHERE a = 'x''y' AND b = 12 AND c IN (%s, %s,%s)"),
+            'SELECT * FROM t WHERE a = ? AND b = ? AND c IN (...)',
+        )
+
+    @override_settings(REQUEST_PROFILING=False)
+    def test_disabled_by_default(self):
+        self.assertNotIn('Server-Timing', self.client.get(reverse('album_list')).headers)
+
+    def test_summarize_request_log(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.log', delete=False) as stream:
+            for total_ms in range(1, 101):
+                stream.write(json.dumps({'endpoint': 'GET album_list', 'total_ms': total_ms, 'sql_count': 2,
+                                         'reasons': [], 'duplicates': [], 'sample_rate': 0.5}) + '\n')
+            # Flagged but not sampled, so left out of the percentiles
+            stream.write(json.dumps({'endpoint': 'GET album_list', 'total_ms': 900, 'sql_count': 2,
+                                     'reasons': ['slow'], 'duplicates': []}) + '\n')
+            stream.write(json.dumps({'endpoint': 'GET albums-list', 'total_ms': 5, 'sql_count': 8,
+                                     'reasons': ['duplicate_queries'],
+                                     'duplicates': [{'sql': 'SELECT ?', 'count': 8}]}) + '\n')
+            stream.write('not json\n')
+        self.addCleanup(os.remove, stream.name)
+        out = io.StringIO()
+        call_command('summarize_request_log', stream.name, '--json', stdout=out)
+        summary = json.loads(out.getvalue())
+        self.assertEqual(list(summary), ['GET album_list', 'GET albums-list'])
+        self.assertEqual(
+            [summary['GET album_list'][key] for key in ('requests', 'sampled', 'p50_ms', 'p95_ms', 'p99_ms')],
+            [200, 100, 50, 95, 99],
+        )
+        self.assertEqual(summary['GET album_list']['slow_requests'], 1)
+        self.assertEqual(summary['GET albums-list']['duplicate_query_requests'], 1)
+        self.assertEqual(summary['GET albums-list']['sampled'], 0)
+        with self.assertRaises(CommandError):
+            call_command('summarize_request_log', stream.name + '.missing')
+
+class AlbumAggregateTest(TestCase):
+    def setUp(self):
+        self.album = Album.objects.create(title='Album', artist='Artist', price=5, format='CD', release_date=date.today())
+        self.other = Album.objects.create(title='Other', artist='Artist', price=5, format='VL', release_date=date.today())
+        self.songs = [Song.objects.create(title=f'Song {index}', length=60 * (index + 1)) for index in range(4)]
+
+    def assertAggregates(self, album, track_count, total_playtime):
+        album.refresh_from_db()
+        self.assertEqual((album.track_count, album.total_playtime), (track_count, total_playtime))
+        self.assertFalse(Album.objects.inconsistent_aggregates().exists())
+
+    def test_single_items(self):
+        item = AlbumTracklistItem.objects.create(album=self.album, song=self.songs[0], position=1)
+        AlbumTracklistItem.objects.create(album=self.album, song=self.songs[1], position=2)
+        self.assertAggregates(self.album, 2, 180)
+
+        # Moving an item to another album updates both
+        item = AlbumTracklistItem.objects.get(pk=item.pk)
+        item.album = self.other
+        item.save()
+        self.assertAggregates(self.album, 1, 120)
+        self.assertAggregates(self.other, 1, 60)
+
+        item.delete()
+        self.assertAggregates(self.other, 0, 0)
+
+    def test_song_length_changes(self):
+        self.album.tracks.add(self.songs[0], self.songs[1])
+        self.other.tracks.add(self.songs[0])
+        song = Song.objects.get(pk=self.songs[0].pk)
+        song.length = 100
+        song.save()
+        self.assertAggregates(self.album, 2, 220)
+        self.assertAggregates(self.other, 1, 100)
+
+        # Deleting a song removes it from every album
+        song.delete()
+        self.assertAggregates(self.album, 1, 120)
+        self.assertAggregates(self.other, 0, 0)
+
+    def test_bulk_and_m2m_paths(self):
+        self.album.tracks.add(*self.songs)
+        self.assertAggregates(self.album, 4, 600)
+        self.album.tracks.remove(self.songs[3])
+        self.assertAggregates(self.album, 3, 360)
+        self.songs[0].album_set.add(self.other)
+        self.assertAggregates(self.other, 1, 60)
+        self.songs[0].album_set.clear()
+        self.assertAggregates(self.album, 2, 300)
+        self.assertAggregates(self.other, 0, 0)
+
+        AlbumTracklistItem.objects.filter(album=self.album).delete()
+        self.assertAggregates(self.album, 0, 0)
+
+        sync_tracklist(self.album, [song.pk for song in self.songs[:3]])
+        self.assertAggregates(self.album, 3, 360)
+        Song.objects.filter(pk__in=[self.songs[0].pk, self.songs[1].pk]).delete()
+        self.assertAggregates(self.album, 1, 180)
+
+        CatalogueImporter().run([('song', {'title': 'Imported', 'length': 30, 'albums': ['Other']})])
+        self.assertAggregates(self.other, 1, 30)
+
+    def test_recompute_command(self):
+        self.album.tracks.add(*self.songs)
+        # Queryset updates bypass the signals
+        Song.objects.filter(pk=self.songs[0].pk).update(length=1000)
+        with self.assertRaisesMessage(CommandError, '1 albums have stale aggregates'):
+            call_command('recompute_album_aggregates', check=True, stdout=io.StringIO())
+
+        call_command('recompute_album_aggregates', stdout=io.StringIO())
+        self.assertAggregates(self.album, 4, 1540)
+        call_command('recompute_album_aggregates', check=True, stdout=io.StringIO())
+
+    def test_api_filters_and_sorts_by_aggregates(self):
+        self.album.tracks.add(self.songs[0])
+        self.other.tracks.add(self.songs[1], self.songs[2])
+        response = self.client.get(reverse('albums-list'), {'ordering': '-total_playtime'})
+        self.assertEqual([album['title'] for album in response.data['results']], ['Other', 'Album'])
+        self.assertEqual(response.data['results'][0]['track_count'], 2)
+        self.assertEqual(response.data['results'][0]['total_playtime'], 300)
+
+        response = self.client.get(reverse('albums-list'), {'min_tracks': 2})
+        self.assertEqual([album['title'] for album in response.data['results']], ['Other'])
+        response = self.client.get(reverse('albums-list'), {'max_playtime': 100})
+        self.assertEqual([album['title'] for album in response.data['results']], ['Album'])
+        self.assertEqual(self.client.get(reverse('albums-list'), {'min_tracks': 'x'}).status_code, 400)
+
+class ExportTest(CatalogueFixturesMixin, TestCase):
+    def get_content(self, response):
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_ndjson_export(self):
+        song2 = Song.objects.create(title='Test Song 2', length=60)
+        AlbumTracklistItem.objects.create(album=self.album1, song=song2, position=0)
+        response = self.client.get(reverse('export', args=['ndjson']))
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        self.assertIn('albums.ndjson', response['Content-Disposition'])
+
+        records = [json.loads(line) for line in self.get_content(response).splitlines()]
+        self.assertEqual([record['title'] for record in records], ['Test Album', 'Sealife'])
+        self.assertEqual([track['title'] for track in records[0]['tracks']], ['Test Song 2', 'Test Song 1'])
+        self.assertEqual(records[0]['track_count'], 2)
+        self.assertEqual(records[1]['tracks'], [])
+
+    def test_csv_export(self):
+        response = self.client.get(reverse('export', args=['csv']))
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        rows = list(csv.DictReader(io.StringIO(self.get_content(response))))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual((rows[0]['title'], rows[0]['song_title'], rows[0]['position']), ('Test Album', 'Test Song 1', '1'))
+        # Albums without tracks still get a row
+        self.assertEqual((rows[1]['title'], rows[1]['song_title']), ('Sealife', ''))
+
+    async def test_asgi_export_streams_asynchronously(self):
+        # A sync iterator would be read to its end before the first chunk is sent
+        response = await AsyncClient().get(reverse('export', args=['ndjson']), headers={'Accept-Encoding': 'gzip'})
+        self.assertTrue(response.is_async)
+        chunks = [chunk async for chunk in response.streaming_content]
+        records = [json.loads(line) for line in gzip.decompress(b''.join(chunks)).decode().splitlines()]
+        self.assertEqual([record['title'] for record in records], ['Test Album', 'Sealife'])
+
+    def test_filters(self):
+        def titles(**filters):
+            response = self.client.get(reverse('export', args=['ndjson']), filters)
+            return [json.loads(line)['title'] for line in self.get_content(response).splitlines()]
+
+        self.assertEqual(titles(artist='Artist2'), ['Sealife'])
+        self.assertEqual(titles(format='Vinyl'), ['Sealife'])
+        self.assertEqual(titles(released_after=date.today() + timedelta(days=1)), [])
+
+        since = timezone.now()
+        Album.objects.touch([self.album1.pk])
+        self.assertEqual(titles(modified_since=since.isoformat()), ['Test Album'])
+
+        self.assertEqual(self.client.get(reverse('export', args=['ndjson']), {'format': 'Tape'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('export', args=['xml'])).status_code, 404)
+
+    def test_queries_per_chunk(self):
+        for index in range(5):
+            album = Album.objects.create(title=f'Album {index}', artist='Bulk', price=1, format='CD', release_date=date.today())
+            album.tracks.add(self.song1)
+        # Seven albums in chunks of two: four album and four tracklist queries
+        with self.assertNumQueries(8):
+            chunks = list(exporter.export({}, 'ndjson', chunk_size=2))
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual(sum(chunk.count('\n') for chunk in chunks), 7)
+
+        CatalogueExportView.chunk_size = 2
+        self.addCleanup(setattr, CatalogueExportView, 'chunk_size', 500)
+        response = self.client.get(reverse('export', args=['csv']))
+        self.assertEqual(len(self.get_content(response).splitlines()), 8)
+
+    def test_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'albums.csv')
+            call_command('export_catalogue', format='csv', output=path, album_format='CD', stderr=io.StringIO())
+            with open(path, encoding='utf-8', newline='') as stream:
+                rows = list(csv.DictReader(stream))
+        self.assertEqual([row['title'] for row in rows], ['Test Album'])
+
+        stdout = io.StringIO()
+        call_command('export_catalogue', artist='Artist2', stdout=stdout)
+        self.assertEqual(json.loads(stdout.getvalue())['title'], 'Sealife')
+        with self.assertRaisesMessage(CommandError, 'released_after'):
+            call_command('export_catalogue', released_after='yesterday', stdout=io.StringIO())
+
+class FastSerializerTest(CatalogueFixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        # Long and non-ASCII text, with separators JSONRenderer escapes
+        Album.objects.filter(pk=self.album1.pk).update(
+            description='Caf\u00e9 \u2028 \u2029 ' + 'x' * 300,
+            cover_variants={
+                'source': self.album1.cover_image.name,
+                'jpeg': {'300': 'covers/variants/a-300.jpg', '150': 'covers/variants/a-150.jpg'},
+                'webp': {'150': 'covers/variants/a-150.webp'},
+            },
+        )
+        self.album1.tracks.add(Song.objects.create(title='\u00c9t\u00e9', length=61))
+
+    def assertSameAlbums(self, path, format=None):
+        request = self.client.get(path).wsgi_request
+        albums = Album.objects.with_tracklist().order_by('id')
+        expected = JSONRenderer().render(
+            AlbumSerializer(albums, many=True, context={'request': request, 'format': format}).data
+        )
+        payloads = AlbumReader(request, format=format).read(Album.objects.order_by('id'))
+        self.assertEqual(FastJSONRenderer().render(list(payloads.values())), expected)
+
+    def test_albums_match_serializer(self):
+        self.assertSameAlbums('/api/albums/')
+        self.assertSameAlbums('/api/albums/', format='json')
+        self.assertSameAlbums('/api/albums/?fields=id,title,price')
+        self.assertSameAlbums('/api/albums/?fields=id,short_description,cover_srcset&expand=tracks')
+
+    def test_songs_match_serializer(self):
+        request = self.client.get('/api/songs/').wsgi_request
+        songs = Song.objects.order_by('id')
+        expected = JSONRenderer().render(SongSerializer(songs, many=True, context={'request': request}).data)
+        payloads = SongReader(request).read(songs)
+        self.assertEqual(FastJSONRenderer().render(list(payloads.values())), expected)
+
+    def test_endpoints(self):
+        response = self.client.get(reverse('albums-detail', args=[self.album1.pk]))
+        expected = AlbumSerializer(Album.objects.get(pk=self.album1.pk), context={'request': response.wsgi_request})
+        self.assertEqual(response.content, JSONRenderer().render(expected.data))
+        self.assertEqual(self.client.get(reverse('albums-detail', args=[0])).json(),
+                         {'detail': 'No Album matches the given query.'})
+        self.assertEqual(self.client.get('/api/albums/x/').status_code, 404)
+        # Filters apply to details, as with get_object()
+        self.assertEqual(self.client.get(reverse('albums-detail', args=[self.album2.pk]), {'min_tracks': 1}).status_code, 404)
+
+        response = self.client.get(reverse('songs-list'))
+        self.assertEqual([song['title'] for song in response.json()['results']], ['Test Song 1', '\u00c9t\u00e9'])
+        self.assertEqual(self.client.get(reverse('songs-detail', args=[self.song1.pk])).json()['length'], 120)
+        # Indented output falls back to JSONRenderer
+        response = self.client.get(reverse('songs-list'), HTTP_ACCEPT='application/json; indent=2')
+        self.assertIn(b'\n  "next"', response.content)
+
+    def test_benchmark_command(self):
+        stdout = io.StringIO()
+        call_command('benchmark_serializers', scale='tiny', repeats=1, in_place=True, json=True, stdout=stdout)
+        results = json.loads(stdout.getvalue())
+        self.assertGreater(results['reader']['albums_per_second'], 0)
+        self.assertGreater(results['serializer']['albums_per_second'], 0)
+
+class CompressionTest(CatalogueFixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        for index in range(20):
+            Album.objects.create(title=f'Album {index}', artist='Bulk', price=1, format='CD', release_date=date.today())
+
+    def test_accepted_encodings(self):
+        self.assertEqual(get_accepted_encodings('gzip, deflate, br;q=0.5'), {'gzip', 'deflate', 'br'})
+        self.assertEqual(get_accepted_encodings('gzip;q=0, br'), {'br'})
+        self.assertEqual(get_accepted_encodings('*'), {'gzip', 'br'})
+
+    def test_gzips_large_responses(self):
+        plain = self.client.get(reverse('albums-list'))
+        self.assertFalse(plain.has_header('Content-Encoding'))
+
+        response = self.client.get(reverse('albums-list'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(json.loads(gzip.decompress(response.content)), plain.json())
+        # The ETag is weakened but still matches conditional requests
+        self.assertTrue(response['ETag'].startswith('W/"'))
+        response = self.client.get(
+            reverse('albums-list'), HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag']
+        )
+        self.assertEqual(response.status_code, 304)
+
+        # Small responses are sent as they are
+        response = self.client.get(reverse('songs-detail', args=[self.song1.pk]), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_streamed_export(self):
+        response = self.client.get(reverse('export', args=['ndjson']), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        lines = gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()
+        self.assertEqual(len(lines), 22)
+
+    @unittest.skipIf(brotli is None, 'brotli is not installed')
+    def test_brotli(self):
+        response = self.client.get(reverse('albums-list'), HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(json.loads(brotli.decompress(response.content)), self.client.get(reverse('albums-list')).json())
+        # Pages carrying CSRF tokens keep Django's padded gzip
+        response = self.client.get(reverse('album_list'), HTTP_ACCEPT_ENCODING='br, gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
+class PrecompressedStaticTest(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.static_root = os.path.join(directory.name, 'static')
+        self.build_dir = os.path.join(directory.name, 'build')
+        os.makedirs(os.path.join(self.static_root, 'js'))
+        os.makedirs(self.build_dir)
+        self.write(os.path.join(self.static_root, 'js', 'main.0123abcd.js'), 'console.log("album");\n' * 200)
+        self.write(os.path.join(self.static_root, 'small.css'), 'body { margin: 0 }')
+        self.write(os.path.join(self.build_dir, 'index.html'), '<div id="root"></div>' * 100)
+        self.write(os.path.join(self.build_dir, 'logo.png'), 'x' * 5000)
+        settings_override = override_settings(
+            SPA_BUILD_DIR=self.build_dir,
+            STATIC_FILE_ROOTS={'/static/': [self.static_root], '/app/': [self.build_dir]},
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        call_command('compress_assets', self.static_root, self.build_dir, stdout=io.StringIO())
+
+    def write(self, path, content):
+        with open(path, 'w') as stream:
+            stream.write(content)
+
+    def test_compress_assets(self):
+        script = os.path.join(self.static_root, 'js', 'main.0123abcd.js')
+        self.assertTrue(os.path.exists(script + '.gz'))
+        self.assertEqual(os.path.exists(script + '.br'), brotli is not None)
+        # Small and already compressed files are skipped
+        self.assertFalse(os.path.exists(os.path.join(self.static_root, 'small.css.gz')))
+        self.assertFalse(os.path.exists(os.path.join(self.build_dir, 'logo.png.gz')))
+
+    def test_serves_precompressed_variants(self):
+        response = self.client.get('/static/js/main.0123abcd.js', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/javascript')
+        self.assertEqual(response['Cache-Control'], f'public, max-age={365 * 24 * 60 * 60}, immutable')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertIn(b'console.log', gzip.decompress(b''.join(response.streaming_content)))
+
+        response = self.client.get('/static/js/main.0123abcd.js')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(self.client.get(
+            '/static/js/main.0123abcd.js', HTTP_IF_NONE_MATCH=response['ETag']
+        ).status_code, 304)
+
+        response = self.client.get('/static/small.css', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        self.assertEqual(self.client.get('/static/missing.css').status_code, 404)
+        self.assertEqual(self.client.get('/static/../build/index.html').status_code, 404)
+
+    def test_spa_routes(self):
+        for path in ('/app/', '/app/albums/1'):
+            response = self.client.get(path, HTTP_ACCEPT_ENCODING='gzip')
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertEqual(response['Cache-Control'], 'no-cache')
+            self.assertIn(b'id="root"', gzip.decompress(b''.join(response.streaming_content)))
+        self.assertEqual(self.client.get('/app/missing.js').status_code, 404)
+
+    def test_collectstatic_hashes_and_compresses(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(
+            STATIC_ROOT=directory,
+            STORAGES={**settings.STORAGES, 'staticfiles': {
+                'BACKEND': 'label_music_manager.assets.CompressedManifestStaticFilesStorage',
+            }},
+        ):
+            call_command('collectstatic', interactive=False, verbosity=0)
+            with open(os.path.join(directory, 'staticfiles.json')) as stream:
+                paths = json.load(stream)['paths']
+            hashed = paths['admin/css/base.css']
+            self.assertRegex(hashed, r'^admin/css/base\.[0-9a-f]{12}\.css$')
+            self.assertTrue(os.path.exists(os.path.join(directory, hashed + '.gz')))
+
+class TemplatedViewQueryTest(CatalogueFixturesMixin, TestCase):
+    """
+    Query budgets of every templated view for an album of 30 tracks. They
+    match the single-track budgets of MusicManagerQueryTest, so tracks are
+    never loaded one at a time.
+    """
+    def setUp(self):
+        super().setUp()
+        self.songs = [Song.objects.create(title=f'Track {index}', length=100 + index) for index in range(29)]
+        sync_tracklist(self.album1, [self.song1.id] + [song.id for song in self.songs])
+        self.edit_data = {
+            'cover_image': 'dripping-stereo.png',
+            'title': 'Test Album',
+            'artist': 'Artist',
+            'price': 9.99,
+            'format': 'CD',
+            'release_date': '2023-01-01',
+            'tracks': [self.song1.id] + [song.id for song in self.songs],
+        }
+
+    def test_album_list(self):
+        with self.assertNumQueries(2):
+            self.client.get(reverse('album_list'))
+        # The search, as the matching card is cached
+        with self.assertNumQueries(1):
+            self.client.get(reverse('album_list'), {'q': 'Test'})
+        self.client.login(username='artist', password='password')
+        with self.assertNumQueries(5):
+            self.client.get(reverse('album_list'))
+
+    def test_album_detail(self):
+        self.client.login(username='editor', password='password')
+        with self.assertNumQueries(6):
+            response = self.client.get(reverse('album_detail', args=[self.album1.id]))
+        self.assertContains(response, 'Track 28')
+        # The rendered summary is cached
+        with self.assertNumQueries(5):
+            self.client.get(reverse('album_detail_slug', args=[self.album1.id, self.album1.slug]))
+
+    def test_album_edit(self):
+        self.client.login(username='editor', password='password')
+        with self.assertNumQueries(6):
+            response = self.client.get(reverse('album_edit', args=[self.album1.id]))
+        self.assertEqual(len(response.context['selected_tracks']), 30)
+        self.assertIn('30: Track 28', response.context['tracks'])
+
+        # - session, user, album with its tracklist, profile and role: 6
+        # - the form's check that title, artist and format stay unique: 1
+        # - savepoint, album update and release: 3
+        # - post_save: the cover task found by its idempotency key, the
+        #   search row, the catalogue stats counting the new release year
+        #   (album, stats and counted values read, stats and counted values
+        #   written) and the change log: 7
+        # - the unchanged tracklist: songs checked, then its rows read in a
+        #   savepoint, without writes: 4
+        with self.assertNumQueries(21):
+            self.client.post(reverse('album_edit', args=[self.album1.id]), self.edit_data)
+        # Re-rendered with errors and the posted tracks, loaded in one query
+        with self.assertNumQueries(7):
+            self.client.post(reverse('album_edit', args=[self.album1.id]), {**self.edit_data, 'title': ''})
+
+    def test_album_create(self):
+        self.client.login(username='editor', password='password')
+        with self.assertNumQueries(4):
+            self.client.get(reverse('album_create'))
+        # - session, user, profile and role: 4
+        # - the form's check that title, artist and format are unique: 1
+        # - savepoint and release: 2
+        # - the owner's profile looked up and the album inserted: 2
+        # - post_save: the cover task looked up by its idempotency key and
+        #   inserted in a savepoint (4), the search row (1), the catalogue
+        #   stats (4) and the change log (1): 10
+        # - the tracklist: songs checked, current rows read and inserted in
+        #   a savepoint, and logged: 6
+        # - albums_touched after the tracklist: aggregates and updated_at
+        #   written, the catalogue stats counted again (4) and the change
+        #   log: 7
+        with self.assertNumQueries(32):
+            self.client.post(reverse('album_create'), {**self.edit_data, 'title': 'New Album'})
+
+    def test_album_delete(self):
+        self.client.login(username='editor', password='password')
+        with self.assertNumQueries(5):
+            self.client.get(reverse('album_delete', args=[self.album1.id]))
+        # - session, user, album, profile and role: 5
+        # - the deletion collecting the tracklist rows, whose deletes send
+        #   signals: 1
+        # - pre_delete: the album subtracted from the catalogue stats
+        #   (counted values and stats read, stats written and the emptied
+        #   artist and format deleted): 4
+        # - the tracklist read and logged as deleted: 2
+        # - counted values, tracklist and album deleted: 3
+        # - post_delete: the search row and the change log: 2
+        with self.assertNumQueries(17):
+            self.client.post(reverse('album_delete', args=[self.album1.id]))
+
+class AlbumListPageTest(TestCase):
+    def setUp(self):
+        catalogue_cache.get_cache().clear()
+        catalogue_cache.stats.reset()
+        self.albums = [
+            Album.objects.create(
+                title=f'Album {index}', artist='Artist', price=5, format='CD', release_date=date.today(),
+                description=f'Description {index} ' + 'x' * 300,
+            )
+            for index in range(5)
+        ]
+        AlbumListView.page_size = 2
+        self.addCleanup(setattr, AlbumListView, 'page_size', 24)
+
+    def get_titles(self, response):
+        return re.findall(r'<h5 class="card-title">(.*?)</h5>', response.content.decode())
+
+    def test_pages(self):
+        response = self.client.get(reverse('album_list'))
+        self.assertEqual(self.get_titles(response), ['Album 0', 'Album 1'])
+        self.assertContains(response, f'?after={self.albums[1].id}')
+        self.assertNotContains(response, 'rel="prev"')
+
+        response = self.client.get(reverse('album_list'), {'after': self.albums[1].id})
+        self.assertEqual(self.get_titles(response), ['Album 2', 'Album 3'])
+        self.assertContains(response, f'?before={self.albums[2].id}')
+
+        response = self.client.get(reverse('album_list'), {'after': self.albums[3].id})
+        self.assertEqual(self.get_titles(response), ['Album 4'])
+        self.assertNotContains(response, 'rel="next"')
+
+        response = self.client.get(reverse('album_list'), {'before': self.albums[2].id})
+        self.assertEqual(self.get_titles(response), ['Album 0', 'Album 1'])
+        self.assertNotContains(response, 'rel="prev"')
+
+    def test_cursors_past_the_ends(self):
+        response = self.client.get(reverse('album_list'), {'before': self.albums[-1].id + 1000})
+        self.assertEqual(self.get_titles(response), ['Album 3', 'Album 4'])
+        self.assertContains(response, f'?before={self.albums[3].id}')
+        self.assertNotContains(response, 'rel="next"')
+
+        response = self.client.get(reverse('album_list'), {'after': self.albums[-1].id + 1000})
+        self.assertEqual(self.get_titles(response), ['Album 3', 'Album 4'])
+        self.assertContains(response, f'?before={self.albums[3].id}')
+        self.assertNotContains(response, 'rel="next"')
+
+        response = self.client.get(reverse('album_list'), {'before': self.albums[0].id})
+        self.assertEqual(self.get_titles(response), ['Album 0', 'Album 1'])
+        self.assertContains(response, f'?after={self.albums[1].id}')
+
+    def test_only_existing_cursors_are_cached(self):
+        for cursor in range(self.albums[-1].id + 1, self.albums[-1].id + 4):
+            self.client.get(reverse('album_list'), {'after': cursor})
+        self.assertNotIn('album_list', catalogue_cache.stats.snapshot())
+        self.client.get(reverse('album_list'), {'after': self.albums[1].id})
+        self.client.get(reverse('album_list'), {'after': self.albums[1].id})
+        self.assertEqual(catalogue_cache.stats.snapshot()['album_list'], {'hits': 1, 'misses': 1})
+
+    def test_cards(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('album_list'))
+        # Descriptions are cut short by the database
+        self.assertIn('SUBSTR', queries.captured_queries[-1]['sql'])
+        self.assertContains(response, 'Description 0 ' + 'x' * 241 + '...')
+        self.assertNotContains(response, 'x' * 242)
+        self.assertContains(response, 'loading="lazy"')
+
+    def test_only_changed_cards_are_rendered(self):
+        self.client.get(reverse('album_list'))
+        self.assertEqual(catalogue_cache.stats.snapshot()['album_card'], {'hits': 0, 'misses': 2})
+
+        self.albums[0].title = 'Renamed'
+        self.albums[0].save()
+        response = self.client.get(reverse('album_list'))
+        self.assertEqual(self.get_titles(response), ['Renamed', 'Album 1'])
+        self.assertEqual(catalogue_cache.stats.snapshot()['album_card'], {'hits': 1, 'misses': 3})
+
+        # The page itself is cached until an album changes
+        with self.assertNumQueries(0):
+            self.client.get(reverse('album_list'))
+
+def failing_task(**arguments):
+    raise RuntimeError('Task failed')
+
+def slow_task(seconds):
+    time.sleep(seconds)
+
+@override_settings(TASK_QUEUE_INLINE_LIMIT=1)
+class TaskQueueTest(CatalogueFixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        # Leave out the cover tasks queued by the albums above
+        Task.objects.all().delete()
+        self.songs = [self.song1] + [Song.objects.create(title=f'Song {i}', length=60) for i in range(2)]
+        self.album_data = {
+            'cover_image': 'no_cover.jpg',
+            'title': 'Test Album',
+            'artist': 'Artist',
+            'price': 9.99,
+            'format': 'CD',
+            'release_date': '2023-01-01',
+        }
+
+    def test_queued_tasks_need_a_shared_catalogue_cache(self):
+        caches = {**settings.CACHES, 'catalogue': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        with override_settings(CACHES=caches):
+            errors = check_catalogue_cache_is_shared(None)
+            self.assertEqual([error.id for error in errors], ['label_music_manager.E001'])
+            with override_settings(TASK_QUEUE_EAGER=True):
+                self.assertEqual(check_catalogue_cache_is_shared(None), [])
+        self.assertEqual(check_catalogue_cache_is_shared(None), [])
+
+    def test_idempotency_key(self):
+        task = tasks.enqueue('delete_album', key='delete', album_id=self.album1.id)
+        self.assertEqual(tasks.enqueue('delete_album', key='delete', album_id=self.album2.id), task)
+        self.assertEqual(Task.objects.count(), 1)
+        with self.assertRaises(LookupError):
+            tasks.enqueue('unknown')
+
+        # A task that failed for good is queued again rather than returned
+        Task.objects.filter(pk=task.pk).update(status=Task.FAILED, attempts=5, last_error='Error')
+        requeued = tasks.enqueue('delete_album', key='delete', album_id=self.album2.id)
+        self.assertEqual(requeued.pk, task.pk)
+        self.assertEqual((requeued.status, requeued.attempts, requeued.last_error), (Task.QUEUED, 0, ''))
+        self.assertEqual(requeued.arguments, {'album_id': self.album2.id})
+        tasks.run_pending()
+        self.assertFalse(Album.objects.filter(pk=self.album2.pk).exists())
+
+    def test_retries_with_backoff(self):
+        with mock.patch.dict(tasks.TASKS, {'fail': 'label_music_manager.tests.failing_task'}):
+            task = tasks.enqueue('fail', max_attempts=2)
+            with self.assertLogs('label_music_manager.tasks', 'WARNING'):
+                self.assertEqual(tasks.run_pending(), 1)
+            task.refresh_from_db()
+            self.assertEqual((task.status, task.attempts), (Task.QUEUED, 1))
+            self.assertIn('Task failed', task.last_error)
+            retry_delay = timedelta(seconds=settings.TASK_QUEUE_RETRY_DELAY - 1)
+            self.assertGreaterEqual(task.run_after, timezone.now() + retry_delay)
+            # Not due again until the delay has passed
+            self.assertEqual(tasks.run_pending(), 0)
+
+            Task.objects.filter(pk=task.pk).update(run_after=timezone.now())
+            with self.assertLogs('label_music_manager.tasks', 'ERROR'):
+                self.assertEqual(tasks.run_next('worker'), Task.FAILED)
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts), (Task.FAILED, 2))
+        self.assertIsNotNone(task.finished_at)
+
+    def test_expired_lease_is_claimed_again(self):
+        task = tasks.enqueue('delete_album', album_id=self.album2.id)
+        self.assertEqual(tasks.claim('lost').pk, task.pk)
+        self.assertIsNone(tasks.claim('other'))
+
+        expired = timezone.now() - timedelta(seconds=settings.TASK_QUEUE_LEASE + 1)
+        Task.objects.filter(pk=task.pk).update(locked_at=expired)
+        claimed = tasks.claim('other')
+        self.assertEqual((claimed.locked_by, claimed.attempts), ('other', 2))
+        self.assertEqual(tasks.run(claimed), Task.SUCCEEDED)
+        self.assertFalse(Album.objects.filter(id=self.album2.id).exists())
+
+    def test_long_album_delete_is_queued(self):
+        AlbumTracklistItem.objects.create(album=self.album1, song=self.songs[1], position=2)
+        self.client.login(username='editor', password='password')
+        response = self.client.post(reverse('album_delete', args=[self.album1.id]))
+        self.assertRedirects(response, reverse('album_list'))
+        self.assertTrue(Album.objects.filter(id=self.album1.id).exists())
+
+        task = Task.objects.get()
+        self.assertEqual((task.name, task.created_by), ('delete_album', self.editor_user))
+        self.assertEqual(tasks.run_pending(), 1)
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.result), (Task.SUCCEEDED, {'deleted': True}))
+        self.assertFalse(Album.objects.filter(id=self.album1.id).exists())
+
+    def test_long_tracklist_is_written_by_task(self):
+        self.client.login(username='editor', password='password')
+        response = self.client.post(reverse('album_edit', args=[self.album1.id]), {
+            **self.album_data, 'tracks': [song.id for song in reversed(self.songs)],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(list(self.album1.tracks.all()), [self.song1])
+
+        tasks.run_pending()
+        self.assertEqual(Album.objects.get(id=self.album1.id).ordered_tracks, list(reversed(self.songs)))
+        self.assertEqual(Task.objects.get(name='rewrite_tracklist').result, {'created': 2, 'deleted': 0, 'updated': 1})
+
+        # Unknown songs are still rejected with the form
+        response = self.client.post(reverse('album_edit', args=[self.album1.id]), {
+            **self.album_data, 'tracks': [self.song1.id, 9999],
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Task.objects.filter(name='rewrite_tracklist').count(), 1)
+
+    def test_api(self):
+        self.client.login(username='editor', password='password')
+        response = self.client.put(
+            reverse('tracklist-replace', args=[self.album2.id]),
+            {'songs': [song.id for song in self.songs]}, content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], Task.QUEUED)
+        self.assertEqual(response.headers['Location'], response.data['url'])
+
+        response = self.client.delete(reverse('albums-detail', args=[self.album2.id]))
+        self.assertEqual(response.status_code, 204)
+        tasks.run_pending()
+
+        response = self.client.get(reverse('tasks-list'), {'status': Task.SUCCEEDED})
+        self.assertEqual([task['result'] for task in response.data['results']], [None])
+
+        # Other users only see the tasks they queued
+        self.client.login(username='viewer', password='password')
+        self.assertEqual(self.client.get(reverse('tasks-list')).data['results'], [])
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('tasks-list')).status_code, 403)
+
+    def test_import(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        upload = SimpleUploadedFile('catalogue.ndjson', json.dumps({
+            'type': 'album', 'title': 'Imported', 'artist': 'Artist', 'price': 5, 'format': 'CD',
+            'release_date': '2020-01-01',
+        }).encode())
+
+        self.client.login(username='viewer', password='password')
+        self.assertEqual(self.client.post(reverse('import'), {'file': upload}).status_code, 403)
+        self.client.login(username='editor', password='password')
+        with override_settings(IMPORT_UPLOAD_ROOT=media.name):
+            upload.seek(0)
+            response = self.client.post(reverse('import'), {'file': upload}, headers={'Idempotency-Key': 'first'})
+            self.assertEqual(response.status_code, 202)
+            # Sending the request again returns the same task
+            repeated = self.client.post(reverse('import'), {'file': upload}, headers={'Idempotency-Key': 'first'})
+            self.assertEqual(repeated.data['id'], response.data['id'])
+
+            # Uploads are kept out of MEDIA_ROOT, which is served publicly
+            self.assertEqual(len(os.listdir(media.name)), 1)
+            tasks.run_pending()
+            self.assertEqual(os.listdir(media.name), [])
+        self.assertTrue(Album.objects.filter(title='Imported').exists())
+        task = self.client.get(response.data['url']).data
+        self.assertEqual((task['status'], task['result']['albums']), (Task.SUCCEEDED, 1))
+
+    def test_failed_import_discards_upload(self):
+        uploads = tempfile.TemporaryDirectory()
+        self.addCleanup(uploads.cleanup)
+        with override_settings(IMPORT_UPLOAD_ROOT=uploads.name):
+            name = importer.get_upload_storage().save('broken.ndjson', io.BytesIO(b'{not json'))
+            task = tasks.enqueue('import_catalogue', max_attempts=1, name=name, input_format='ndjson')
+            tasks.run_pending()
+            self.assertEqual(os.listdir(uploads.name), [])
+        task.refresh_from_db()
+        self.assertEqual(task.status, Task.FAILED)
+
+class TaskWorkerTest(TransactionTestCase):
+    @override_settings(TASK_QUEUE_LEASE=0.3)
+    def test_lease_is_renewed_while_running(self):
+        with mock.patch.dict(tasks.TASKS, {'slow': 'label_music_manager.tests.slow_task'}):
+            task = tasks.enqueue('slow', seconds=0.5)
+            claimed = tasks.claim('test')
+            self.assertEqual(tasks.run(claimed), Task.SUCCEEDED)
+        task.refresh_from_db()
+        # Renewed about every 0.1 seconds, so never claimable by another worker
+        self.assertGreater(task.locked_at, claimed.locked_at + timedelta(seconds=0.3))
+
+    def test_worker_survives_errors(self):
+        outcomes = [OperationalError('database is locked'), Task.SUCCEEDED, None]
+
+        def run_next(worker_id):
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        with mock.patch.object(tasks, 'run_next', run_next), self.assertLogs('label_music_manager.tasks') as logs:
+            tasks.work('test', threading.Event(), poll_interval=0, burst=True)
+        self.assertEqual(outcomes, [])
+        self.assertIn('database is locked', logs.output[1])
+
+    def test_run_workers_burst(self):
+        albums = [
+            Album.objects.create(title=f'Album {i}', artist='Artist', price=5, format='CD', release_date=date.today())
+            for i in range(4)
+        ]
+        Task.objects.all().delete()
+        for album in albums:
+            tasks.enqueue('delete_album', album_id=album.id)
+
+        out = io.StringIO()
+        # Threads sharing the in-memory test database lock each other's tables
+        threads = '2' if settings.CONCURRENCY_TESTS else '1'
+        call_command('run_workers', '--threads', threads, '--burst', stdout=out)
+        self.assertIn('Workers stopped.', out.getvalue())
+        self.assertEqual(set(Task.objects.values_list('status', flat=True)), {Task.SUCCEEDED})
+        self.assertFalse(Album.objects.exists())
+
+class ChangeFeedTest(CatalogueFixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        catalogue_cache.get_cache().clear()
+        self.cursor = self.client.get(reverse('changes')).data['cursor']
+
+    def get_changes(self, since=None, **params):
+        response = self.client.get(reverse('changes'), {'since': self.cursor if since is None else since, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def summarize(self, feed):
+        return [(change['type'], change['action'], change['id']) for change in feed['changes']]
+
+    def test_changes_in_commit_order(self):
+        song = Song.objects.create(title='New Song', length=90)
+        self.album2.tracks.add(song, through_defaults={'position': 1})
+        self.album1.title = 'Renamed'
+        self.album1.save()
+        song.title = 'Renamed Song'
+        song.save()
+        item = AlbumTracklistItem.objects.get(album=self.album2)
+
+        feed = self.get_changes()
+        self.assertFalse(feed['has_more'])
+        # Objects changed several times appear once, at their last change
+        self.assertEqual(self.summarize(feed), [
+            ('tracklist', 'created', item.id),
+            ('album', 'updated', self.album1.id),
+            ('album', 'updated', self.album2.id),
+            ('song', 'updated', song.id),
+        ])
+        data = {(change['type'], change['id']): change['data'] for change in feed['changes']}
+        self.assertEqual(data[('song', song.id)]['title'], 'Renamed Song')
+        self.assertEqual(data[('album', self.album1.id)]['title'], 'Renamed')
+        self.assertEqual(data[('album', self.album2.id)]['tracks'][0]['title'], 'Renamed Song')
+        self.assertEqual(
+            data[('tracklist', item.id)], {'id': item.id, 'album': self.album2.id, 'song': song.id, 'position': 1}
+        )
+
+        # Nothing new after the returned cursor
+        self.assertEqual(self.get_changes(feed['cursor'])['changes'], [])
+
+    def test_deletions_leave_tombstones(self):
+        album_id, item_id = self.album1.id, self.tracklist_item.id
+        self.album1.delete()
+        feed = self.get_changes()
+        self.assertEqual(self.summarize(feed), [
+            ('tracklist', 'deleted', item_id),
+            ('album', 'deleted', album_id),
+        ])
+        self.assertEqual([change['data'] for change in feed['changes']], [None, None])
+
+    def test_bulk_writes_are_logged(self):
+        songs = [Song.objects.create(title=f'Song {i}', length=60) for i in range(3)]
+        self.cursor = self.client.get(reverse('changes')).data['cursor']
+        sync_tracklist(self.album2, [song.id for song in songs])
+        sync_tracklist(self.album1, [songs[0].id])
+        CatalogueImporter().run([('song', {'title': 'Imported', 'runtime': 60, 'albums': ['Sealife']})])
+
+        changed = self.summarize(self.get_changes())
+        imported = Song.objects.get(title='Imported')
+        self.assertIn(('song', 'created', imported.id), changed)
+        self.assertIn(('tracklist', 'deleted', self.tracklist_item.id), changed)
+        self.assertEqual(len([change for change in changed if change[0] == 'tracklist']), 6)
+        self.assertEqual({change[2] for change in changed if change[0] == 'album'}, {self.album1.id, self.album2.id})
+
+    def test_pages(self):
+        songs = [Song.objects.create(title=f'Song {i}', length=60) for i in range(5)]
+        feed = self.get_changes(limit=2)
+        self.assertEqual(self.summarize(feed), [('song', 'created', song.id) for song in songs[:2]])
+        self.assertTrue(feed['has_more'])
+        feed = self.get_changes(feed['cursor'], limit=10)
+        self.assertEqual(self.summarize(feed), [('song', 'created', song.id) for song in songs[2:]])
+        self.assertFalse(feed['has_more'])
+
+    def test_cost_follows_changes_not_catalogue(self):
+        for i in range(20):
+            Song.objects.create(title=f'Song {i}', length=60)
+        self.cursor = changes.get_head()
+        Song.objects.create(title='Latest', length=60)
+        # Compaction marker, change log and songs
+        with self.assertNumQueries(3):
+            feed = self.get_changes()
+        self.assertEqual(len(feed['changes']), 1)
+
+    def test_compaction(self):
+        Song.objects.create(title='Old', length=60)
+        Change.objects.update(created_at=timezone.now() - timedelta(days=settings.CHANGE_LOG_RETENTION + 1))
+        song = Song.objects.create(title='New', length=60)
+        old_cursor = self.cursor
+
+        out = io.StringIO()
+        call_command('compact_changes', stdout=out)
+        self.assertIn('Removed', out.getvalue())
+        self.assertEqual(Change.objects.exclude(action=Change.COMPACTED).count(), 1)
+
+        # Clients further behind than the log are told to start over
+        response = self.client.get(reverse('changes'), {'since': 0})
+        self.assertEqual(response.status_code, 410)
+        self.assertEqual(response.data['cursor'], changes.get_head())
+        start = changes.get_start()
+        self.assertGreater(start, old_cursor)
+        self.assertEqual(self.summarize(self.get_changes(start)), [('song', 'created', song.id)])
+
+        # Compacting again keeps the marker
+        call_command('compact_changes', stdout=io.StringIO())
+        self.assertEqual(changes.get_start(), start)
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get(reverse('changes'), {'since': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('changes'), {'since': 0, 'limit': 0}).status_code, 400)
+
+class CatalogueStatsTest(CatalogueFixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.login(username='editor', password='password')
+
+    def get_stats(self, **params):
+        response = self.client.get(reverse('stats'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def get_groups(self, dimension):
+        return {group['key']: group for group in self.get_stats()[dimension]}
+
+    def test_stats_by_artist_format_and_year(self):
+        data = self.get_stats()
+        self.assertEqual(data['totals'], {
+            'album_count': 2, 'track_count': 1, 'total_playtime': 120, 'average_price': '12.49',
+        })
+        self.assertEqual(data['format'], [
+            {'key': 'CD', 'album_count': 1, 'track_count': 1, 'total_playtime': 120, 'average_price': '9.99'},
+            {'key': 'VL', 'album_count': 1, 'track_count': 0, 'total_playtime': 0, 'average_price': '14.99'},
+        ])
+        self.assertEqual([group['key'] for group in data['artist']], ['Artist', 'Artist2'])
+        self.assertEqual(data['year'], [{
+            'key': str(date.today().year), 'album_count': 2, 'track_count': 1, 'total_playtime': 120,
+            'average_price': '12.49',
+        }])
+
+        data = self.get_stats(group='format,year')
+        self.assertNotIn('artist', data)
+        self.assertEqual(data['totals']['album_count'], 2)
+
+    def test_stats_follow_changes(self):
+        song = Song.objects.create(title='New Song', length=200)
+        self.album2.tracks.add(song, through_defaults={'position': 1})
+        self.assertEqual(self.get_groups('format')['VL']['total_playtime'], 200)
+
+        # Saved albums write back their stored aggregates, so load them first
+        self.album1.refresh_from_db()
+        self.album1.format = 'VL'
+        self.album1.price = 10.01
+        self.album1.save()
+        formats = self.get_groups('format')
+        self.assertNotIn('CD', formats)
+        self.assertEqual(formats['VL']['album_count'], 2)
+        self.assertEqual(formats['VL']['track_count'], 2)
+        self.assertEqual(formats['VL']['average_price'], '12.50')
+
+        song.length = 100
+        song.save()
+        self.assertEqual(self.get_groups('artist')['Artist2']['total_playtime'], 100)
+
+        self.album1.delete()
+        self.assertEqual(list(self.get_groups('artist')), ['Artist2'])
+        self.assertEqual(stats.verify(), [])
+
+    def test_bulk_writes_keep_stats(self):
+        songs = [Song.objects.create(title=f'Song {i}', length=60) for i in range(3)]
+        sync_tracklist(self.album2, [song.id for song in songs])
+        CatalogueImporter().run([
+            ('album', {'title': 'Imported', 'artist': 'Artist2', 'format': 'DD', 'price': 5,
+                       'release_date': '2001-01-01'}),
+            ('song', {'title': 'Imported Song', 'runtime': 30, 'albums': ['Imported', 'Test Album']}),
+        ])
+        self.assertEqual(stats.verify(), [])
+        self.assertEqual(self.get_groups('year')['2001']['track_count'], 1)
+
+        Album.objects.filter(artist='Artist2').delete()
+        self.assertEqual(stats.verify(), [])
+        self.assertEqual(list(self.get_groups('artist')), ['Artist'])
+
+    def test_unchanged_albums_cost_one_query(self):
+        # Reading the albums with the values they were counted with
+        with self.assertNumQueries(1):
+            stats.refresh_albums([self.album1.id, self.album2.id])
+
+    def test_rebuild_and_verify(self):
+        # Queryset updates bypass the signals
+        Album.objects.filter(pk=self.album1.pk).update(format='DD')
+        with self.assertRaises(CommandError):
+            call_command('rebuild_catalogue_stats', '--verify', stdout=io.StringIO())
+
+        out = io.StringIO()
+        call_command('rebuild_catalogue_stats', stdout=out)
+        self.assertIn('Rebuilt 5 catalogue stats', out.getvalue())
+        out = io.StringIO()
+        call_command('rebuild_catalogue_stats', '--verify', stdout=out)
+        self.assertIn('All catalogue stats match', out.getvalue())
+        self.assertEqual(set(self.get_groups('format')), {'DD', 'VL'})
+
+        # Stale stored aggregates are caught too, as the live aggregate reads the tracklists
+        Album.objects.filter(pk=self.album1.pk).update(track_count=0, total_playtime=0)
+        stats.rebuild()
+        self.assertEqual(len(stats.verify()), 3)
+        CatalogueStat.objects.filter(dimension=CatalogueStat.ARTIST).delete()
+        self.assertEqual(len(stats.verify()), 4)
+
+    def test_only_editors(self):
+        self.client.login(username='artist', password='password')
+        self.assertEqual(self.client.get(reverse('stats')).status_code, 403)
+        self.client.logout()
+        self.assertIn(self.client.get(reverse('stats')).status_code, (401, 403))
+        self.client.login(username='editor', password='password')
+        self.assertEqual(self.client.get(reverse('stats'), {'group': 'genre'}).status_code, 400)
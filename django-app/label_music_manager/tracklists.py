@@ -0,0 +1,206 @@
+# Tracklist services shared by the templated views and the API
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Max
+from . import changes, tasks
+from .models import Album, AlbumTracklistItem, Change, Song
+
+def check_song_ids(song_ids, allow_repeats=False):
+    """
+    Checks submitted song IDs with a single query.
+    Returns the IDs as integers and a list of errors aligned with song_ids,
+    holding None for each valid ID and a message for each malformed or
+    unknown one, and for repeated ones unless allow_repeats is set.
+    """
+    cleaned = []
+    for song_id in song_ids:
+        # JSON true and 1.5 would otherwise pass as song 1
+        if isinstance(song_id, bool) or (isinstance(song_id, float) and not song_id.is_integer()):
+            cleaned.append(None)
+            continue
+        try:
+            cleaned.append(int(song_id))
+        except (TypeError, ValueError):
+            cleaned.append(None)
+
+    known = set(Song.objects.filter(id__in={song_id for song_id in cleaned if song_id is not None})
+                .values_list('id', flat=True))
+    errors = []
+    seen = set()
+    for raw, song_id in zip(song_ids, cleaned):
+        if song_id is None:
+            errors.append(f'"{raw}" is not a valid song ID.')
+        elif song_id not in known:
+            errors.append(f'Invalid pk "{song_id}" - object does not exist.')
+        elif song_id in seen and not allow_repeats:
+            errors.append(f'Song {song_id} is listed more than once.')
+        else:
+            errors.append(None)
+        seen.add(song_id)
+    return cleaned, errors
+
+def clean_song_ids(song_ids):
+    """
+    Validates submitted song IDs with a single query.
+    Returns the IDs as integers in submission order, without duplicates.
+    Raises a ValidationError naming any malformed or unknown IDs.
+    """
+    cleaned, errors = check_song_ids(song_ids, allow_repeats=True)
+    invalid = [str(raw) for raw, error in zip(song_ids, errors) if error is not None]
+    if invalid:
+        raise ValidationError(
+            'Unknown songs selected: %(ids)s', code='invalid_songs', params={'ids': ', '.join(invalid)}
+        )
+    return list(dict.fromkeys(cleaned))
+
+def sync_tracklist(album, song_ids):
+    """
+    Makes the album's tracklist match song_ids, using their order as positions.
+    Raises a ValidationError for malformed or unknown IDs.
+    """
+    return apply_tracklist(album, clean_song_ids(song_ids))
+
+def schedule_tracklist(album, song_ids, user=None):
+    """
+    Like sync_tracklist, but a tracklist of more than TASK_QUEUE_INLINE_LIMIT
+    songs is only validated here and written by the task queue.
+    Returns the queued task, or None when the tracklist was written.
+    """
+    if len(song_ids) <= settings.TASK_QUEUE_INLINE_LIMIT:
+        sync_tracklist(album, song_ids)
+        return None
+    return tasks.enqueue('rewrite_tracklist', user=user, album_id=album.pk, song_ids=clean_song_ids(song_ids))
+
+def rewrite_tracklist(album_id, song_ids):
+    """
+    Task writing a tracklist queued by schedule_tracklist. Songs deleted
+    since it was queued are left out. Returns the counts of apply_tracklist,
+    or None when the album is gone.
+    """
+    album = Album.objects.filter(pk=album_id).only('id').first()
+    if album is None:
+        return None
+    cleaned, errors = check_song_ids(song_ids)
+    return apply_tracklist(album, [song_id for song_id, error in zip(cleaned, errors) if error is None])
+
+def apply_tracklist(album, song_ids):
+    """
+    Makes the album's tracklist match already validated song IDs.
+    The existing rows are diffed against the selection so only the missing
+    rows are inserted, the dropped rows deleted and the moved rows
+    repositioned, each in bulk and all in one transaction.
+    Returns the number of rows created, deleted and updated.
+    """
+    with transaction.atomic():
+        wanted = {song_id: position for position, song_id in enumerate(song_ids, start=1)}
+        existing = AlbumTracklistItem.objects.filter(album=album).only('id', 'song_id', 'position')
+
+        to_delete = []
+        to_update = []
+        for item in existing:
+            position = wanted.pop(item.song_id, None)
+            if position is None:
+                to_delete.append(item.id)
+            elif item.position != position:
+                item.position = position
+                to_update.append(item)
+        to_create = [
+            AlbumTracklistItem(album=album, song_id=song_id, position=position)
+            for song_id, position in wanted.items()
+        ]
+
+        if to_delete:
+            AlbumTracklistItem.objects.filter(id__in=to_delete).delete()
+        if to_create:
+            AlbumTracklistItem.objects.bulk_create(to_create)
+        if to_update:
+            AlbumTracklistItem.objects.bulk_update(to_update, ['position'])
+        # Bulk writes bypass the signals logging changes; deletes send them
+        changes.record(Change.TRACKLIST, Change.CREATED, [item.pk for item in to_create])
+        changes.record(Change.TRACKLIST, Change.UPDATED, [item.pk for item in to_update])
+        if to_create:
+            Album.objects.filter(pk=album.pk).refresh_aggregates()
+        if to_create or to_update:
+            # Bulk writes bypass the signals that version the album
+            Album.objects.touch([album.pk])
+
+    return {'created': len(to_create), 'deleted': len(to_delete), 'updated': len(to_update)}
+
+def upsert_items(items):
+    """
+    Adds tracklist items, or moves existing ones, given as dicts with album,
+    song and an optional position. Items without a position are appended to
+    their album. Album and song IDs are checked with one query each, and
+    nothing is written unless every item is valid.
+    Returns a (results, errors) pair of lists aligned with items, where
+    errors is None when the items were written.
+    """
+    album_ids = set(Album.objects.filter(id__in={item['album'] for item in items}).values_list('id', flat=True))
+    song_ids = set(Song.objects.filter(id__in={item['song'] for item in items}).values_list('id', flat=True))
+
+    errors = []
+    seen = set()
+    for item in items:
+        error = {}
+        if item['album'] not in album_ids:
+            error['album'] = [f'Invalid pk "{item["album"]}" - object does not exist.']
+        if item['song'] not in song_ids:
+            error['song'] = [f'Invalid pk "{item["song"]}" - object does not exist.']
+        if (item['album'], item['song']) in seen:
+            error['non_field_errors'] = ['The same album and song are listed more than once.']
+        seen.add((item['album'], item['song']))
+        errors.append(error)
+    if any(errors):
+        return None, errors
+
+    with transaction.atomic():
+        existing = {
+            (item.album_id, item.song_id): item
+            for item in AlbumTracklistItem.objects.filter(album_id__in=album_ids, song_id__in=song_ids)
+            if (item.album_id, item.song_id) in seen
+        }
+        last_positions = dict(
+            AlbumTracklistItem.objects.filter(album_id__in=album_ids)
+            .values('album_id').annotate(last=Max('position')).values_list('album_id', 'last')
+        )
+
+        results = []
+        to_create = []
+        to_update = []
+        for item in items:
+            key = (item['album'], item['song'])
+            position = item.get('position')
+            if position is None and key not in existing:
+                position = (last_positions.get(item['album']) or 0) + 1
+            if position is not None:
+                last_positions[item['album']] = max(position, last_positions.get(item['album']) or 0)
+
+            row = existing.get(key)
+            if row is None:
+                row = AlbumTracklistItem(album_id=item['album'], song_id=item['song'], position=position)
+                to_create.append(row)
+                status = 'created'
+            elif position is not None and row.position != position:
+                row.position = position
+                to_update.append(row)
+                status = 'updated'
+            else:
+                status = 'unchanged'
+            results.append((row, status))
+
+        if to_create:
+            AlbumTracklistItem.objects.bulk_create(to_create)
+        if to_update:
+            AlbumTracklistItem.objects.bulk_update(to_update, ['position'])
+        changes.record(Change.TRACKLIST, Change.CREATED, [row.pk for row in to_create])
+        changes.record(Change.TRACKLIST, Change.UPDATED, [row.pk for row in to_update])
+        if to_create:
+            Album.objects.filter(pk__in={row.album_id for row in to_create}).refresh_aggregates()
+        if to_create or to_update:
+            Album.objects.touch(row.album_id for row in to_create + to_update)
+
+    return [
+        {'id': row.id, 'album': row.album_id, 'song': row.song_id, 'position': row.position, 'status': status}
+        for row, status in results
+    ], None
@@ -2,13 +2,18 @@
 from django.contrib.auth.views import LogoutView
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
+from . import async_views
 from .views import AlbumListView, AlbumDetailView, AlbumEditView, AlbumDeleteView, AlbumCreateView
-from .api_views import AlbumViewSet, SongViewSet, AlbumTracklistViewSet
+from .api_views import (
+    AlbumViewSet, SongViewSet, AlbumTracklistViewSet, CacheStatsView, CatalogueExportView, CatalogueImportView,
+    CatalogueStatsView, ChangeFeedView, SearchView, TaskViewSet,
+)
 
 router = DefaultRouter()
 router.register(r'albums', AlbumViewSet, basename='albums')
 router.register(r'songs', SongViewSet, basename='songs')
 router.register(r'tracklist', AlbumTracklistViewSet, basename='tracklist')
+router.register(r'tasks', TaskViewSet, basename='tasks')
 
 urlpatterns = [
     # Templated views
@@ -21,6 +26,20 @@ urlpatterns = [
     path('albums/<int:id>/<slug:slug>/', AlbumDetailView.as_view(), name='album_detail_slug'),
 
     # API endpoints
+    path('api/cache/stats/', CacheStatsView.as_view(), name='cache_stats'),
+    path('api/search/', SearchView.as_view(), name='search'),
+    path('api/export/albums.<str:export_format>', CatalogueExportView.as_view(), name='export'),
+    path('api/import/', CatalogueImportView.as_view(), name='import'),
+    path('api/changes/', ChangeFeedView.as_view(), name='changes'),
+    path('api/stats/', CatalogueStatsView.as_view(), name='stats'),
+
+    # Async read-only API endpoints for the ASGI server
+    path('api/async/albums/', async_views.album_list, name='async-albums-list'),
+    path('api/async/albums/<int:pk>/', async_views.album_detail, name='async-albums-detail'),
+    path('api/async/songs/', async_views.song_list, name='async-songs-list'),
+    path('api/async/songs/<int:pk>/', async_views.song_detail, name='async-songs-detail'),
+    path('api/async/search/', async_views.search_catalogue, name='async-search'),
+
     path('api/', include(router.urls)),
 
     path('accounts/logout/', LogoutView.as_view(), name='logout'),
@@ -1,48 +1,189 @@
 # Use this file for your templated views only
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.conf import settings
 from django.contrib import messages
+from django.core.exceptions import ValidationError
 from django.db import transaction
+from django.db.models.functions import Substr
+from django.http import HttpResponseRedirect
+from django.middleware.csrf import get_token
+from django.template.loader import render_to_string
 from django.urls import reverse_lazy
+from django.utils.translation import get_language
 from django.views.generic import ListView, DetailView, UpdateView, DeleteView, CreateView
 from rest_framework.exceptions import PermissionDenied
 from rest_framework.generics import get_object_or_404
-from .models import Album, MusicManagerUser, AlbumTracklistItem, Song
+from . import catalogue_cache, search, tasks
+from .conditional import has_pending_messages, make_etag, not_modified, set_validators
+from .models import Album, Song
+from .profiles import get_music_manager
+from .tracklists import schedule_tracklist
+
+def get_selected_tracks(request, album):
+    """
+    Returns the songs to show as selected in the album track picker.
+    A re-rendered submission keeps the posted tracks, otherwise the album's
+    current tracklist is used. Either way the songs are loaded in one query,
+    and the rest of the library is searched from the page instead of rendered.
+    """
+    if request.method == 'POST':
+        track_ids = [track_id for track_id in request.POST.getlist('tracks') if track_id.isdigit()]
+        songs = Song.objects.in_bulk(track_ids)
+        return [songs[int(track_id)] for track_id in dict.fromkeys(track_ids) if int(track_id) in songs]
+    if album is None or album.pk is None:
+        return []
+    return album.ordered_tracks
+
+# Album fields rendered by the list cards. The description is cut short in the query.
+CARD_FIELDS = ['id', 'title', 'artist', 'price', 'format', 'cover_image', 'cover_variants']
+CARD_DESCRIPTION_LENGTH = 255
+
+def get_card_albums(album_ids):
+    """
+    Loads the albums of the given IDs with only the fields their cards show.
+    """
+    return Album.objects.filter(id__in=album_ids).only(*CARD_FIELDS).annotate(
+        short_description=Substr('description', 1, CARD_DESCRIPTION_LENGTH + 1)
+    )
+
+def render_cards(album_ids):
+    """
+    Returns the card HTML of each album, in order. Cards are cached per
+    album version, so only new and changed albums are rendered.
+    """
+    cards, keys = catalogue_cache.get_albums(album_ids, get_language(), kind='album_card')
+    missing = [album_id for album_id in album_ids if album_id not in cards]
+    if missing:
+        fresh = {}
+        for album in get_card_albums(missing):
+            if len(album.short_description) > CARD_DESCRIPTION_LENGTH:
+                album.short_description = album.short_description[:CARD_DESCRIPTION_LENGTH] + '...'
+            fresh[album.id] = render_to_string('label_music_manager/album_card.html', {'album': album})
+        catalogue_cache.set_entries({keys[album_id]: card for album_id, card in fresh.items()})
+        cards.update(fresh)
+    # Albums deleted since their IDs were read are left out
+    return [cards[album_id] for album_id in album_ids if album_id in cards]
 
 class AlbumListView(ListView):
     """
-    Displays a list of all albums.
+    Displays a list of all albums, a page at a time.
     Artists only see their own albums, while other users can view all albums.
+    For a search (?q=), albums holds the IDs of the matches in rank order.
     """
     model = Album
     context_object_name = 'albums'
     template_name = 'label_music_manager/album_list.html'
 
+    # Albums per page. Pages are keyed by album ID (?after= and ?before=),
+    # so they need neither a count nor an offset.
+    page_size = 24
+
+    # Most albums shown for a search
+    search_limit = 50
+
+    def get_search_query(self):
+        return self.request.GET.get('q', '').strip()
+
+    def get_cursor(self, name):
+        value = self.request.GET.get(name, '')
+        return int(value) if value.isdigit() else None
+
     def get_queryset(self):
-        user = self.request.user
-
-        # Unauthenticated users can view all albums
-        if not user.is_authenticated:
-            return Album.objects.all()
-
-        # Artists can only view their own albums
-        if user.is_authenticated:
-            music_manager_user = MusicManagerUser.objects.get(user=user)
-            if user.has_perm('label_music_manager.Artist'):
-                return Album.objects.filter(artist=music_manager_user.display_name)
-        # Viewers and editors can view all albums.
+        music_manager = get_music_manager(self.request)
+        owner_id = music_manager.profile_id if music_manager.is_artist else None
+
+        # Artists can only view the albums their profile owns
+        if music_manager.is_artist and owner_id is None:
+            return Album.objects.none()
+
+        # Searches are ranked by the full-text index, which is kept in step
+        # with the albums, so its IDs are used as they are
+        query = self.get_search_query()
+        if query:
+            return search.search_ids(query, 'album', owner_id, self.search_limit)
+
+        if owner_id is not None:
+            return Album.objects.filter(owner=owner_id)
+        # Unauthenticated users, viewers and editors can view all albums.
         return Album.objects.all()
 
+    def read_after(self, ids, after):
+        album_ids = list(ids.filter(id__gt=after or 0)[:self.page_size + 1])
+        has_next = len(album_ids) > self.page_size
+        album_ids = album_ids[:self.page_size]
+        has_previous = bool(album_ids) and after is not None and ids.filter(id__lt=album_ids[0]).exists()
+        return album_ids, has_previous, has_next
+
+    def read_before(self, ids, before):
+        album_ids = ids.order_by('-id')
+        if before is not None:
+            album_ids = album_ids.filter(id__lt=before)
+        album_ids = list(album_ids[:self.page_size + 1])[::-1]
+        has_previous = len(album_ids) > self.page_size
+        album_ids = album_ids[-self.page_size:]
+        has_next = bool(album_ids) and before is not None and ids.filter(id__gt=album_ids[-1]).exists()
+        return album_ids, has_previous, has_next
+
+    def get_page(self, queryset):
+        """
+        Returns the album IDs of the requested page and the cursors of the
+        previous and next pages, or None where there is no such page. A
+        cursor past either end of the list gets the first or last page.
+        """
+        after, before = self.get_cursor('after'), self.get_cursor('before')
+        ids = queryset.order_by('id').values_list('id', flat=True)
+        if before is not None:
+            album_ids, has_previous, has_next = self.read_before(ids, before)
+            if not album_ids:
+                album_ids, has_previous, has_next = self.read_after(ids, None)
+        else:
+            album_ids, has_previous, has_next = self.read_after(ids, after)
+            if not album_ids and after is not None:
+                album_ids, has_previous, has_next = self.read_before(ids, None)
+        previous_cursor = album_ids[0] if has_previous else None
+        next_cursor = album_ids[-1] if has_next else None
+        return album_ids, previous_cursor, next_cursor
+
+    def render_page(self, queryset):
+        album_ids, previous_cursor, next_cursor = self.get_page(queryset)
+        return render_to_string('label_music_manager/album_cards.html', {
+            'cards': render_cards(album_ids),
+            'previous_cursor': previous_cursor,
+            'next_cursor': next_cursor,
+        })
+
     def get_context_data(self, **kwargs):
         """
         Include the display name of the user for template access.
         """
-        user = self.request.user
         context = super().get_context_data(**kwargs)
 
         # Check if the user is authenticated
-        if user.is_authenticated:
-            music_manager_user = MusicManagerUser.objects.get(user=user)
-            context['display_name'] = music_manager_user.display_name
+        music_manager = get_music_manager(self.request)
+        if self.request.user.is_authenticated:
+            context['display_name'] = music_manager.display_name
+
+        context['query'] = self.get_search_query()
+        if context['query']:
+            context['album_cards'] = render_to_string(
+                'label_music_manager/album_cards.html', {'cards': render_cards(context['albums'])}
+            )
+            return context
+
+        # Pages are cached per role view (artists see their own list) and
+        # cursor. A changed album only re-renders its own card. Cursors that
+        # are not one of the listed albums are not cached, so made-up ones
+        # cannot fill the cache.
+        after, before = self.get_cursor('after'), self.get_cursor('before')
+        cursor = before if before is not None else after
+        if cursor is not None and not self.object_list.filter(id=cursor).exists():
+            context['album_cards'] = self.render_page(self.object_list)
+            return context
+        scope = catalogue_cache.get_scope(music_manager.profile_id if music_manager.is_artist else None)
+        variant = f'{get_language()}:{after}:{before}'
+        context['album_cards'] = catalogue_cache.get_or_set_list(
+            scope, variant, lambda: self.render_page(self.object_list)
+        )
 
         return context
 
@@ -68,26 +209,63 @@ class AlbumDetailView(DetailView):
         # Look up album by ID only (for the /albums/:id format)
         return get_object_or_404(Album, id=album_id)
 
+    def get(self, request, *args, **kwargs):
+        """
+        Answer repeat requests with 304 Not Modified while neither the album
+        nor the signed in user has changed.
+        """
+        self.object = self.get_object()
+        music_manager = get_music_manager(request)
+        # The logout form carries a CSRF token, whose secret changes at each
+        # login. The token is masked afresh on every response, so the ETag
+        # is weak.
+        csrf_secret = None
+        if request.user.is_authenticated:
+            get_token(request)
+            csrf_secret = request.META['CSRF_COOKIE']
+        etag = 'W/' + make_etag(
+            'album-page', self.object.pk, self.object.updated_at, request.get_full_path(),
+            request.user.pk, music_manager.role, music_manager.display_name, music_manager.owns(self.object),
+            csrf_secret,
+        )
+
+        if not has_pending_messages(request):
+            response = not_modified(request, etag)
+            if response is not None:
+                return response
+        context = self.get_context_data(object=self.object)
+        return set_validators(self.render_to_response(context), etag, self.object.updated_at)
+
     def get_context_data(self, **kwargs):
         """
         Add album tracks and display name for template access.
         """
-        user = self.request.user
         context = super().get_context_data(**kwargs)
 
         # Add display name only if the user is authenticated
-        if user.is_authenticated:
-            music_manager_user = MusicManagerUser.objects.get(user=user)
-            context['display_name'] = music_manager_user.display_name
+        if self.request.user.is_authenticated:
+            context['display_name'] = get_music_manager(self.request).display_name
+        # Artists get the edit and delete buttons for the albums they own,
+        # as the edit and delete views authorize them
+        context['owns_album'] = get_music_manager(self.request).owns(self.object)
 
-        # Fetch all tracks related to the album through the AlbumTracklistItem model
+        # The album details and tracklist are cached per album
         album = self.object
-        track_items = AlbumTracklistItem.objects.filter(album=album).order_by('position')
-        tracks = [item.song for item in track_items]
-        context['tracks'] = tracks
+        context['album_summary'] = catalogue_cache.get_or_set_album(
+            album.pk, get_language(), lambda: self.render_summary(album), kind='album_page'
+        )
 
         return context
 
+    def render_summary(self, album):
+        """
+        Render the album details and its tracks.
+        """
+        # The tracklist and its songs are read in one joined query
+        return render_to_string(
+            'label_music_manager/album_summary.html', {'album': album, 'tracks': album.ordered_tracks}
+        )
+
 class AlbumEditView(LoginRequiredMixin, UpdateView):
     """
     Handles editing of album details.
@@ -112,17 +290,16 @@ class AlbumEditView(LoginRequiredMixin, UpdateView):
         Retrieve album object for editing
         """
         album_id = self.kwargs.get('id')
-        album = get_object_or_404(Album, id=album_id)
-
-        user = self.request.user
-        music_manager_user = MusicManagerUser.objects.get(user=user)
+        # The tracklist and its songs are prefetched for the form and the track picker
+        album = get_object_or_404(Album.objects.with_tracklist(), id=album_id)
+        music_manager = get_music_manager(self.request)
 
         # Check if the user has the 'Editor' permission
-        if user.has_perm('label_music_manager.Editor'):
+        if music_manager.is_editor:
             return album
 
         # Check if the user is the artist of the album
-        if user.has_perm('label_music_manager.Artist') and album.artist == music_manager_user.display_name:
+        if music_manager.owns(album):
             return album
 
         # If neither condition is met, raise a PermissionDenied error
@@ -133,39 +310,37 @@ class AlbumEditView(LoginRequiredMixin, UpdateView):
         Retrieves the tracklist of the album with their positions.
         Adds display name for template access and all songs for dropdown.
         """
-        user = self.request.user
         context = super().get_context_data(**kwargs)
+        context['display_name'] = get_music_manager(self.request).display_name
 
-        music_manager_user = MusicManagerUser.objects.get(user=user)
-        context['display_name'] = music_manager_user.display_name
-
-        # Fetch all tracks related to the album through the AlbumTracklistItem model
+        # The tracklist prefetched by get_object()
         album = self.object
-        track_items = AlbumTracklistItem.objects.filter(album=album).order_by('position')
+        track_items = album.tracklist_items
         # Format tracks as Position: Track Name and join them with newlines
         tracks_string = "\n".join([f"{item.position}: {item.song.title}" for item in track_items])
         context['tracks'] = tracks_string
-        context['songs'] = Song.objects.all()
+        context['selected_tracks'] = get_selected_tracks(self.request, album)
 
         return context
 
     def form_valid(self, form):
         """
         Handle form submission for album editing.
-        Save selected tracks to the album.
+        Save the album and sync its tracklist to the selected tracks.
         """
-        album = form.save(commit=False)
-        selected_tracks = self.request.POST.getlist('tracks')
-
-        # Clear existing tracks and add the selected ones
-        album.tracks.clear()
-        for track_id in selected_tracks:
-            song = Song.objects.get(id=track_id)
-            album.tracks.add(song)
-        album.save()
-
-        messages.success(self.request, 'Album updated successfully.')
-        return super().form_valid(form)
+        try:
+            with transaction.atomic():
+                self.object = form.save()
+                queued = schedule_tracklist(self.object, self.request.POST.getlist('tracks'), self.request.user)
+        except ValidationError as error:
+            form.add_error(None, error)
+            return self.form_invalid(form)
+
+        if queued:
+            messages.success(self.request, 'Album updated successfully. Its tracklist will be updated shortly.')
+        else:
+            messages.success(self.request, 'Album updated successfully.')
+        return HttpResponseRedirect(self.get_success_url())
 
     def get_success_url(self):
         """
@@ -188,15 +363,13 @@ class AlbumDeleteView(LoginRequiredMixin, DeleteView):
         """
         album_id = self.kwargs.get('id')
         album = get_object_or_404(Album, id=album_id)
-
-        user = self.request.user
-        music_manager_user = MusicManagerUser.objects.get(user=user)
+        music_manager = get_music_manager(self.request)
 
         # Editors are able to delete albums
-        if user.has_perm('label_music_manager.Editor'):
+        if music_manager.is_editor:
             return album
         # Artists cannot delete their own albums
-        if user.has_perm('label_music_manager.Artist') and album.artist == music_manager_user.display_name:
+        if music_manager.owns(album):
             raise PermissionDenied("Artists cannot delete their own albums.")
         # If not editor, then you cannot delete albums
         raise PermissionDenied("You do not have permission to delete this album.")
@@ -204,7 +377,15 @@ class AlbumDeleteView(LoginRequiredMixin, DeleteView):
     def form_valid(self, form):
         """
         Provide confirmation message upon successful deletion.
+        Albums with more than TASK_QUEUE_INLINE_LIMIT tracks are deleted by
+        the task queue, so the request does not wait for their tracklist.
         """
+        if self.object.track_count > settings.TASK_QUEUE_INLINE_LIMIT:
+            tasks.enqueue(
+                'delete_album', key=f'delete_album:{self.object.pk}', user=self.request.user, album_id=self.object.pk
+            )
+            messages.success(self.request, 'Album will be deleted shortly')
+            return HttpResponseRedirect(self.get_success_url())
         messages.success(self.request, 'Album deleted successfully')
         return super().form_valid(form)
 
@@ -234,32 +415,38 @@ class AlbumCreateView(LoginRequiredMixin, CreateView):
 
     def dispatch(self, request, *args, **kwargs):
         # Only Editors can create albums
-        if not request.user.has_perm('label_music_manager.Editor'):
+        if not get_music_manager(request).is_editor:
             raise PermissionDenied("You do not have permission to create an album.")
         return super().dispatch(request, *args, **kwargs)
 
     def get_context_data(self, **kwargs):
         """
-        Include all songs for dropdown.
+        Include the selected songs for the track picker.
         """
         context = super().get_context_data(**kwargs)
-        context['songs'] = Song.objects.all()
         context['album'] = self.object if hasattr(self, 'object') else None
+        context['selected_tracks'] = get_selected_tracks(self.request, context['album'])
 
         return context
 
     def form_valid(self, form):
-        # Save the album to get an ID
-        album = form.save()
-
-        # Add selected tracks to the album
-        selected_tracks = self.request.POST.getlist('tracks')
-        for track_id in selected_tracks:
-            song = Song.objects.get(id=track_id)
-            album.tracks.add(song)
-
-        messages.success(self.request, 'Album created successfully.')
-        return super().form_valid(form)
+        """
+        Save the album to get an ID, then add the selected tracks in order.
+        """
+        try:
+            with transaction.atomic():
+                self.object = form.save()
+                queued = schedule_tracklist(self.object, self.request.POST.getlist('tracks'), self.request.user)
+        except ValidationError as error:
+            self.object = None
+            form.add_error(None, error)
+            return self.form_invalid(form)
+
+        if queued:
+            messages.success(self.request, 'Album created successfully. Its tracklist will be added shortly.')
+        else:
+            messages.success(self.request, 'Album created successfully.')
+        return HttpResponseRedirect(self.get_success_url())
 
 
     def get_success_url(self):
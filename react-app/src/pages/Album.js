@@ -49,7 +49,7 @@ function Album() {
           <h1 className='fw-bold'>{album.title}</h1>
           <h4 className='fw-bold'>£{album.price}</h4>
           <p>
-            {album.artist} ({album.release_year}), {album.tracks.length} Songs, {totalMinutes} min {totalSeconds} sec
+            {album.artist} ({album.release_year}), {album.track_count} Songs, {totalMinutes} min {totalSeconds} sec
           </p>
           <p className='text-muted'>{album.description}</p>
         </Col>
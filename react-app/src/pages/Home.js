@@ -1,13 +1,16 @@
 import React from 'react';
-import { useQuery } from '@tanstack/react-query';
+import { useInfiniteQuery } from '@tanstack/react-query';
 import { API } from '../constants';
-import { Card, Row, Col, Container } from 'react-bootstrap';
+import { Button, Card, Row, Col, Container } from 'react-bootstrap';
 import './Home.css';
 import Error from '../components/Error';
 import Loading from '../components/Loading';
 
-const fetchAlbums = async () => {
-    const response = await fetch(`${API}albums/`);
+// Only the fields shown on the album cards are requested
+const ALBUM_CARD_FIELDS = 'id,cover_image,cover_srcset,title,price,artist,release_year,short_description';
+
+const fetchAlbums = async ({ pageParam }) => {
+    const response = await fetch(pageParam);
     if (!response.ok) {
       throw new Error('Network response was not ok');
     }
@@ -15,21 +18,25 @@ const fetchAlbums = async () => {
   };
   
 function Home() {
-    const { data: albums, error, isLoading } = useQuery({
+    const { data, error, isLoading, fetchNextPage, hasNextPage, isFetchingNextPage } = useInfiniteQuery({
         queryKey: ['albums'],
         queryFn: fetchAlbums,
+        initialPageParam: `${API}albums/?fields=${ALBUM_CARD_FIELDS}`,
+        getNextPageParam: (lastPage) => lastPage.next,
     });
 
     if (isLoading) return <Loading />;
     if (error) return <Error message={`Error loading album: ${error.message}`} />;
 
+    const albums = data.pages.flatMap(page => page.results);
+
     return (
         <Container className='mt-4'>
         <Row className='g-5'>
             {albums.map(album => (
             <Col key={album.id} sm={12} md={6} lg={4}>
                 <Card className='mb-4 album-card'>
-                <Card.Img variant='top' src={album.cover_image} className='album-cover' />
+                <Card.Img variant='top' src={album.cover_image} srcSet={album.cover_srcset || undefined} sizes='300px' className='album-cover' />
                 <Card.Body>
                     <Card.Title className='album-title fw-bold'>
                     <a href={`/albums/${album.id}`}>
@@ -46,6 +53,13 @@ function Home() {
             </Col>
             ))}
         </Row>
+        {hasNextPage && (
+            <div className='d-flex justify-content-center mb-4'>
+            <Button variant='dark' onClick={() => fetchNextPage()} disabled={isFetchingNextPage}>
+                {isFetchingNextPage ? 'Loading...' : 'Load more'}
+            </Button>
+            </div>
+        )}
         </Container>
     );
 }